@@ -14,17 +14,26 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import asyncio
+import os
 import pathlib
+import shlex
 
 from aiohttp import web
-import aiohttp_apispec
 from oslo_config import cfg
 
 import deepaas
+from deepaas.api import compression
+from deepaas.api import health
+from deepaas.api import ratelimit
+from deepaas.api import spec
 from deepaas.api import v2
 from deepaas.api import versions
+from deepaas import config
 from deepaas import log
 from deepaas import model
+from deepaas import startup
+from deepaas import tracing
 
 LOG = log.getLogger(__name__)
 
@@ -71,11 +80,16 @@ async def get_app(
 
     APP = web.Application(debug=CONF.debug, client_max_size=CONF.client_max_size)
 
+    tracing.setup(APP)
+    APP.middlewares.append(tracing.tracing_middleware)
     APP.middlewares.append(web.normalize_path_middleware())
+    APP.middlewares.append(compression.compression_middleware)
+    ratelimit.setup(APP)
 
     model.register_v2_models(APP)
 
-    v2app = v2.get_app(enable_train=enable_train, enable_predict=enable_predict)
+    with startup.phase("routes"):
+        v2app = v2.get_app(enable_train=enable_train, enable_predict=enable_predict)
     if base_path:
         path = str(pathlib.Path(base_path) / "v2")
     else:
@@ -93,12 +107,14 @@ async def get_app(
     else:
         APP.add_routes(versions.routes)
 
+    health.setup_routes(APP, base_path=base_path)
+
     LOG.info("Serving loaded V2 models: %s", list(model.V2_MODELS.keys()))
 
     if CONF.warm:
-        for _, m in model.V2_MODELS.items():
-            LOG.debug("Warming models...")
-            await m.warm()
+        # Warm the models in the background, so that the server starts
+        # answering the liveness probes in the meantime
+        health.start_warming(APP, _warm_models())
 
     if swagger:
         doc = str(pathlib.Path(base_path + doc))
@@ -106,22 +122,96 @@ async def get_app(
         static_path = str(pathlib.Path(base_path + static_path))
 
         # init docs with all parameters, usual for ApiSpec
-        aiohttp_apispec.setup_aiohttp_apispec(
-            app=APP,
-            title="DEEP as a Service API endpoint",
-            info={
-                "description": API_DESCRIPTION,
-            },
-            externalDocs={
-                "description": "API documentation",
-                "url": "https://deepaas.readthedocs.org/",
-            },
-            version=deepaas.extract_version(),
-            url=swagger,
-            swagger_path=doc if enable_doc else None,
-            prefix=prefix,
-            static_path=static_path,
-            in_place=True,
-        )
+        with startup.phase("apispec"):
+            key = spec.get_key(
+                model.V2_MODELS,
+                base_path=base_path,
+                prefix=prefix,
+                doc=doc if enable_doc else None,
+                enable_train=enable_train,
+                enable_predict=enable_predict,
+            )
+            spec.setup(
+                APP,
+                url=swagger,
+                swagger_path=doc if enable_doc else None,
+                static_path=static_path,
+                spec_file=CONF.spec_file,
+                key=key,
+                title="DEEP as a Service API endpoint",
+                info={
+                    "description": API_DESCRIPTION,
+                },
+                externalDocs={
+                    "description": "API documentation",
+                    "url": "https://deepaas.readthedocs.org/",
+                },
+                version=deepaas.extract_version(),
+                prefix=prefix,
+            )
+
+    if not CONF.warm:
+        _mark_ready()
 
     return APP
+
+
+async def _warm_models():
+    LOG.debug("Warming models...")
+    semaphore = None
+    if CONF.warm_concurrency:
+        semaphore = asyncio.Semaphore(CONF.warm_concurrency)
+    await asyncio.gather(
+        *[
+            _warm_model(name, m, semaphore)
+            for name, m in model.V2_MODELS.items()
+            # Lazy models are warmed when they are used for the first time
+            if not getattr(m, "lazy", False)
+        ]
+    )
+    _mark_ready()
+
+
+async def _warm_model(name, m, semaphore):
+    with startup.phase("warm", model=name):
+        await m.warm(semaphore=semaphore)
+
+
+def _mark_ready():
+    startup.mark_ready()
+    if CONF.startup_profile:
+        startup.dump_profile(CONF.startup_profile)
+
+
+def normalize_base_path(base_path):
+    """Normalize the base path under which the API is served.
+
+    :param base_path: the configured base path, it may be empty.
+    :returns: the normalized path, or an empty string if it is empty.
+    :raises ValueError: if the path does not start with a ``/``.
+    """
+    if not base_path:
+        return ""
+    if not base_path.startswith("/"):
+        raise ValueError("Base path should start with a '/'.")
+    return str(pathlib.Path(base_path))
+
+
+async def app_factory():
+    """Get the main app, to be served by an external server.
+
+    The DEEPaaS options are read from the configuration files and from the
+    ``DEEPAAS_ARGS`` environment variable (e.g. ``--model-name foo``). For
+    example, to serve it with Gunicorn::
+
+        DEEPAAS_ARGS="--model-name foo" gunicorn deepaas.api:app_factory \\
+            --worker-class aiohttp.GunicornWebWorker --bind unix:/run/deepaas.sock
+    """
+    argv = ["deepaas"] + shlex.split(os.environ.get("DEEPAAS_ARGS", ""))
+    config.setup(argv)
+    return await get_app(
+        enable_doc=CONF.doc_endpoint,
+        enable_train=CONF.train_endpoint,
+        enable_predict=CONF.predict_endpoint,
+        base_path=normalize_base_path(CONF.base_path),
+    )
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Compression of the responses, negotiated with the Accept-Encoding header.
+
+Responses are compressed with zstd, brotli or gzip (in this order of
+preference, zstd and brotli only if their modules are installed), depending on
+what the client accepts. Compressed request bodies (i.e. with a
+Content-Encoding header) are decompressed by aiohttp itself.
+"""
+
+import asyncio
+import gzip
+
+from aiohttp import web
+from oslo_config import cfg
+
+try:
+    import brotli
+except ImportError:  # brotli is optional
+    brotli = None
+
+try:
+    from compression import zstd  # Python >= 3.14
+except ImportError:
+    try:
+        from backports import zstd
+    except ImportError:  # zstd is optional
+        zstd = None
+
+CONF = cfg.CONF
+
+# Bodies larger than this are compressed in a thread, not to block the loop
+EXECUTOR_SIZE = 32 * 1024
+
+COMPRESSORS = {"gzip": lambda data: gzip.compress(data, 6)}
+if brotli is not None:
+    COMPRESSORS["br"] = lambda data: brotli.compress(data, quality=4)
+if zstd is not None:
+    COMPRESSORS["zstd"] = lambda data: zstd.compress(data, 3)
+
+# Content codings we prefer, when the client accepts several of them equally
+PREFERENCE = ("zstd", "br", "gzip")
+
+COMPRESSIBLE_TYPES = (
+    "application/javascript",
+    "application/json",
+    "application/xml",
+    "application/x-ndjson",
+    "image/svg+xml",
+)
+
+
+def _parse_accept_encoding(header):
+    accepted = {}
+    for item in header.split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[coding] = q
+    return accepted
+
+
+def get_encoding(accept_encoding, available=COMPRESSORS):
+    """Choose the content coding of a response.
+
+    :param accept_encoding: value of the Accept-Encoding header of the request
+    :param available: content codings that can be used
+    :returns: the content coding, or None if the response should not be
+        compressed
+    """
+    accepted = _parse_accept_encoding(accept_encoding or "")
+    encoding, best = None, 0.0
+    for coding in PREFERENCE:
+        if coding not in available:
+            continue
+        q = accepted.get(coding, accepted.get("*", 0.0))
+        if q > best:
+            encoding, best = coding, q
+    return encoding
+
+
+def is_compressible(content_type):
+    """Check if it is worth compressing a content type."""
+    return (
+        content_type.startswith("text/")
+        or content_type in COMPRESSIBLE_TYPES
+        or content_type.endswith(("+json", "+xml"))
+    )
+
+
+async def compress(data, encoding):
+    """Compress data, in a thread if it is large."""
+    if len(data) < EXECUTOR_SIZE:
+        return COMPRESSORS[encoding](data)
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, COMPRESSORS[encoding], data)
+
+
+@web.middleware
+async def compression_middleware(request, handler):
+    """Compress the responses, if the client accepts it."""
+    resp = await handler(request)
+    if not CONF.compress_responses:
+        return resp
+
+    # Streamed responses (e.g. files or events) are sent as they are
+    if not isinstance(resp, web.Response) or resp.prepared:
+        return resp
+    if "Content-Encoding" in resp.headers or not is_compressible(resp.content_type):
+        return resp
+
+    if "Accept-Encoding" not in resp.headers.get("Vary", ""):
+        resp.headers.add("Vary", "Accept-Encoding")
+
+    body = resp.body
+    if (
+        not isinstance(body, (bytes, bytearray))
+        or len(body) < CONF.compression_min_size
+    ):
+        return resp
+
+    encoding = get_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return resp
+
+    resp.body = await compress(bytes(body), encoding)
+    resp.headers["Content-Encoding"] = encoding
+    return resp
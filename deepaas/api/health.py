@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Liveness and readiness endpoints, for orchestrators and load balancers.
+
+The models are warmed in the background once the API is set up, so that the
+liveness endpoint (``/healthz``) answers as soon as the server is listening,
+while the readiness endpoint (``/readyz``) only succeeds once all the models
+are warmed and their workers are not saturated. Requests wait for the workers
+of their model to be warmed.
+
+If warming the models fails, the process keeps running (so that the error can
+be inspected), but both probes fail, so that orchestrators restart it instead
+of waiting forever for it to be ready.
+"""
+
+import asyncio
+
+from aiohttp import web
+import aiohttp_apispec
+from oslo_config import cfg
+
+from deepaas import log
+from deepaas import model
+
+LOG = log.getLogger(__name__)
+
+CONF = cfg.CONF
+
+# Background task warming the models, if any
+_WARM_TASK = None
+
+
+def start_warming(app, coro):
+    """Run the coroutine that warms the models in the background."""
+    global _WARM_TASK
+
+    _WARM_TASK = asyncio.ensure_future(coro)
+    _WARM_TASK.add_done_callback(_log_warm_error)
+    app.on_cleanup.append(_stop_warming)
+
+
+def _log_warm_error(task):
+    if not task.cancelled() and task.exception() is not None:
+        LOG.error(
+            "Error warming the models, DEEPaaS will not be ready nor alive",
+            exc_info=task.exception(),
+        )
+
+
+async def _stop_warming(app):
+    global _WARM_TASK
+
+    if _WARM_TASK is not None:
+        _WARM_TASK.cancel()
+        _WARM_TASK = None
+
+
+def get_warm_status():
+    """Get the status of the warming of the models.
+
+    :returns: "warming", "error" or "done" (also if the models are not warmed
+        at startup)
+    """
+    if _WARM_TASK is None:
+        return "done"
+    if not _WARM_TASK.done():
+        return "warming"
+    if _WARM_TASK.cancelled() or _WARM_TASK.exception() is not None:
+        return "error"
+    return "done"
+
+
+def get_readiness():
+    """Check whether DEEPaaS is ready to serve requests.
+
+    :returns: a tuple with whether it is ready and a dict describing why, with
+        the status of each of the models
+    """
+    warm = get_warm_status()
+    max_queue = CONF.readiness_max_queue
+    models = {}
+    saturated = []
+    for name, m in model.V2_MODELS.items():
+        status = m.get_load()
+        status["warm"] = m.warmed
+        models[name] = status
+        if max_queue and status["queued"] > max_queue:
+            saturated.append(name)
+
+    if warm != "done":
+        status = warm
+    elif saturated:
+        status = "saturated"
+    else:
+        status = "ready"
+    return status == "ready", {"status": status, "models": models}
+
+
+@aiohttp_apispec.docs(
+    tags=["health"],
+    summary="Check that DEEPaaS is alive",
+    description="""Liveness probe, it succeeds as soon as the server is
+    listening, even if the models are still being warmed, but fails if warming
+    them failed.""",
+    produces=["application/json"],
+    responses={
+        200: {"description": "DEEPaaS is alive"},
+        503: {"description": "Warming the models failed"},
+    },
+)
+async def get_healthz(request):
+    if get_warm_status() == "error":
+        return web.json_response({"status": "error"}, status=503)
+    return web.json_response({"status": "ok"})
+
+
+@aiohttp_apispec.docs(
+    tags=["health"],
+    summary="Check that DEEPaaS is ready to serve requests",
+    description="""Readiness probe, it succeeds once all the models have been
+    warmed, as long as the number of requests waiting for a free worker of any
+    model does not exceed the "readiness-max-queue" option.""",
+    produces=["application/json"],
+    responses={
+        200: {"description": "DEEPaaS is ready"},
+        503: {"description": "The models are being warmed, or are saturated"},
+    },
+)
+async def get_readyz(request):
+    ready, body = get_readiness()
+    return web.json_response(body, status=200 if ready else 503)
+
+
+def setup_routes(app, base_path=""):
+    app.router.add_get(base_path + "/healthz", get_healthz, allow_head=True)
+    app.router.add_get(base_path + "/readyz", get_readyz, allow_head=True)
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Per client rate limiting of the predict and train requests.
+
+Each client (identified by a header, e.g. an API key, or by its address) gets
+a token bucket, refilled at "rate-limit" tokens per second up to
+"rate-limit-burst" tokens, and each request takes one token. Clients can also
+be limited to "client-max-concurrency" requests being served at the same
+time. Requests over the limits are rejected with a 429 status code and a
+"Retry-After" header, before they reach the handlers (and the workers).
+
+The header is sent by the clients, so any client can get a new bucket just by
+changing it: it must be set (or validated) by a trusted proxy in front of
+DEEPaaS. Otherwise, "client-max-ids-per-address" limits how many different IDs
+an address can use at the same time.
+"""
+
+import collections
+import math
+import time
+
+from aiohttp import web
+from oslo_config import cfg
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+CONF = cfg.CONF
+
+# Endings of the paths of the limited POST requests
+LIMITED_PATHS = ("/predict/", "/train/")
+
+# Time (in seconds) after which idle clients are forgotten, if the rate is not
+# limited
+IDLE_TIMEOUT = 60
+
+
+class _Client(object):
+    __slots__ = ("tokens", "last", "inflight", "address")
+
+    def __init__(self, tokens, now, address=None):
+        self.tokens = tokens
+        self.last = now
+        self.inflight = 0
+        self.address = address
+
+
+class RateLimiter(object):
+    """Token buckets and concurrency counters of the clients.
+
+    The clients are kept in an ordered dict, least recently seen first, so
+    that the idle ones (whose bucket is full again and have no requests being
+    served, i.e. that are the same as a new client) are expired in constant
+    time per request.
+
+    :param rate: Tokens per second added to the buckets, 0 means no limit.
+    :param burst: Size of the buckets.
+    :param max_concurrency: Maximum number of requests being served per
+        client, 0 means no limit.
+    :param max_ids_per_address: Maximum number of clients with different IDs
+        (that are not their address) tracked at the same time for an address,
+        0 means no limit. See :meth:`get_key`.
+    """
+
+    def __init__(self, rate=0, burst=1, max_concurrency=0, max_ids_per_address=0):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.max_concurrency = max_concurrency
+        self.max_ids_per_address = max_ids_per_address
+        if rate:
+            self.idle_timeout = self.burst / rate
+        else:
+            self.idle_timeout = IDLE_TIMEOUT
+        self._clients = collections.OrderedDict()
+        # Number of clients tracked for each address
+        self._ids = collections.Counter()
+
+    def __len__(self):
+        return len(self._clients)
+
+    def _refill(self, client, now):
+        if self.rate:
+            elapsed = now - client.last
+            client.tokens = min(self.burst, client.tokens + elapsed * self.rate)
+        client.last = now
+
+    def _expire(self, now):
+        while self._clients:
+            key, client = next(iter(self._clients.items()))
+            if now - client.last < self.idle_timeout:
+                break
+            if client.inflight:
+                # Still being served, check it again later
+                self._clients.move_to_end(key)
+                self._refill(client, now)
+                continue
+            del self._clients[key]
+            if client.address is not None:
+                self._ids[client.address] -= 1
+                if not self._ids[client.address]:
+                    del self._ids[client.address]
+
+    def get_key(self, client_id, address):
+        """Get the key of the limits of a client.
+
+        Clients are identified by their ID, unless it is new and there are
+        already max_ids_per_address clients tracked for the address that it
+        comes from. In that case the client is identified by its address.
+        """
+        if (
+            client_id == address
+            or not self.max_ids_per_address
+            or client_id in self._clients
+            or self._ids[address] < self.max_ids_per_address
+        ):
+            return client_id
+        return address
+
+    def acquire(self, key, now=None, address=None):
+        """Try to start a request of a client.
+
+        :param address: address of the client, if it is not the key
+        :returns: None if the request is allowed (and then :meth:`release`
+            must be called once it is served), otherwise the number of seconds
+            after which the client should retry
+        """
+        now = time.monotonic() if now is None else now
+        self._expire(now)
+
+        client = self._clients.get(key)
+        if client is None:
+            if key == address:
+                address = None
+            client = self._clients[key] = _Client(self.burst, now, address)
+            if address is not None:
+                self._ids[address] += 1
+        else:
+            self._clients.move_to_end(key)
+            self._refill(client, now)
+
+        if self.max_concurrency and client.inflight >= self.max_concurrency:
+            return 1
+        if self.rate:
+            if client.tokens < 1:
+                return (1 - client.tokens) / self.rate
+            client.tokens -= 1
+        client.inflight += 1
+        return None
+
+    def release(self, key):
+        client = self._clients.get(key)
+        if client is not None:
+            client.inflight -= 1
+
+
+def get_client_id(request):
+    """Get the ID of the client, from the configured header or its address."""
+    if CONF.client_id_header:
+        client_id = request.headers.get(CONF.client_id_header)
+        if client_id:
+            return client_id
+    return request.remote
+
+
+def _is_limited(request):
+    if request.method != "POST":
+        return False
+    resource = request.match_info.route.resource
+    return resource is not None and resource.canonical.endswith(LIMITED_PATHS)
+
+
+def get_middleware(limiter):
+    """Get a middleware that enforces the limits of the limiter."""
+
+    @web.middleware
+    async def ratelimit_middleware(request, handler):
+        if not _is_limited(request):
+            return await handler(request)
+
+        client_id = limiter.get_key(get_client_id(request), request.remote)
+        retry_after = limiter.acquire(client_id, address=request.remote)
+        if retry_after is not None:
+            LOG.debug("Rate limit exceeded by client %s", client_id)
+            raise web.HTTPTooManyRequests(
+                reason="Rate limit exceeded, retry later",
+                headers={"Retry-After": str(max(1, math.ceil(retry_after)))},
+            )
+        try:
+            return await handler(request)
+        finally:
+            limiter.release(client_id)
+
+    return ratelimit_middleware
+
+
+def setup(app):
+    """Enforce the configured limits in the app, if any."""
+    if not (CONF.rate_limit or CONF.client_max_concurrency):
+        return
+    limiter = RateLimiter(
+        rate=CONF.rate_limit,
+        burst=CONF.rate_limit_burst,
+        max_concurrency=CONF.client_max_concurrency,
+        max_ids_per_address=CONF.client_max_ids_per_address,
+    )
+    app.middlewares.append(get_middleware(limiter))
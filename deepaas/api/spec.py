@@ -0,0 +1,163 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Generation, caching and serving of the OpenAPI (Swagger) specification.
+
+Generating the specification means introspecting all the routes and schemas of
+the API, so it can be generated once and stored in a file that is loaded on
+the next startups. The specification is served from memory, with an ETag and
+precompressed, so that clients fetching it do not cost any CPU.
+"""
+
+import gzip
+import hashlib
+import json
+import os
+
+from aiohttp import web
+import aiohttp_apispec
+
+import deepaas
+from deepaas.api import compression
+from deepaas import log
+from deepaas.model import loading
+
+LOG = log.getLogger(__name__)
+
+# Key of the specification where we store the key of the cache, so that we
+# can tell if a stored specification is still valid
+KEY = "x-deepaas-spec-key"
+
+
+def get_key(models, **kwargs):
+    """Get the cache key for a specification.
+
+    The specification depends on the DEEPaaS version, the models being served
+    (and their versions) and the options used to build the API.
+
+    :param models: names of the models that are served
+    :param kwargs: options used to build the API
+    """
+    versions = {
+        name: loading.get_model_distribution_metadata(name, "v2").get("version")
+        for name in sorted(models)
+    }
+    data = {"deepaas": deepaas.extract_version(), "models": versions, **kwargs}
+    return hashlib.sha256(json.dumps(data, sort_keys=True).encode()).hexdigest()
+
+
+def load(path, key=None):
+    """Load a specification from a file.
+
+    :param path: path of the file
+    :param key: expected cache key, if the specification stored has another
+        one it is not returned
+    :returns: the specification, or None if there is not a valid one
+    """
+    try:
+        with open(path) as f:
+            spec = json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError as e:
+        LOG.warning("Ignoring invalid API specification in %s: %s", path, e)
+        return None
+
+    if key is not None and spec.get(KEY) != key:
+        LOG.info("API specification in %s is outdated, regenerating it", path)
+        return None
+    return spec
+
+
+def dump(spec, path):
+    """Write a specification to a file, atomically."""
+    tmp = "%s.%s.tmp" % (path, os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(spec, f)
+    os.replace(tmp, path)
+    LOG.info("API specification written to %s", path)
+
+
+class SpecHandler(object):
+    """Serve a specification, with an ETag and precompressed variants."""
+
+    def __init__(self, spec):
+        self.body = json.dumps(spec).encode()
+        self.etag = hashlib.sha256(self.body).hexdigest()[:32]
+        # Compressed only once, so use the best compression available
+        self.encoded = {"gzip": gzip.compress(self.body, 9)}
+        if compression.brotli is not None:
+            self.encoded["br"] = compression.brotli.compress(self.body)
+        if compression.zstd is not None:
+            self.encoded["zstd"] = compression.zstd.compress(self.body, 19)
+
+    async def __call__(self, request):
+        headers = {"Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+
+        if_none_match = request.if_none_match or ()
+        if any(e.value == self.etag or e.value == "*" for e in if_none_match):
+            resp = web.Response(status=304, headers=headers)
+            resp.etag = self.etag
+            return resp
+
+        encoding = compression.get_encoding(
+            request.headers.get("Accept-Encoding"), self.encoded
+        )
+        if encoding is None:
+            body = self.body
+        else:
+            body = self.encoded[encoding]
+            headers["Content-Encoding"] = encoding
+
+        resp = web.Response(body=body, content_type="application/json", headers=headers)
+        resp.etag = self.etag
+        return resp
+
+
+def setup(
+    app, url, swagger_path=None, static_path=None, spec_file=None, key=None, **kwargs
+):
+    """Set up the specification of the app, and the routes to serve it.
+
+    :param app: the application
+    :param url: URL of the specification
+    :param swagger_path: URL of the Swagger UI, None to disable it
+    :param static_path: URL of the Swagger UI static files
+    :param spec_file: file to load the specification from, that is generated
+        (and written) if there is no valid specification stored
+    :param key: cache key of the specification, see get_key()
+    :param kwargs: arguments for aiohttp_apispec.AiohttpApiSpec
+    :returns: the specification
+    """
+    # We serve the specification ourselves, so we do not pass the URL
+    apispec = aiohttp_apispec.AiohttpApiSpec(url=None, **kwargs)
+
+    spec = load(spec_file, key) if spec_file else None
+    if spec is None:
+        # This introspects all the routes of the app
+        apispec.register(app, in_place=True)
+        spec = app["swagger_dict"]
+        if key is not None:
+            spec[KEY] = key
+        if spec_file:
+            dump(spec, spec_file)
+    app["swagger_dict"] = spec
+
+    app.router.add_route("GET", url, SpecHandler(spec), name="swagger.spec")
+    if swagger_path is not None:
+        # The Swagger UI page uses the route above to find the specification
+        apispec._add_swagger_web_page(app, static_path, swagger_path)
+    return spec
@@ -25,6 +25,8 @@ import aiohttp_apispec
 from oslo_config import cfg
 
 from deepaas import log
+from deepaas import profiling
+from deepaas import startup
 
 CONF = cfg.CONF
 
@@ -96,5 +98,81 @@ async def get(request):
     return web.HTTPNoContent()
 
 
+@aiohttp_apispec.docs(
+    tags=["debug"],
+    summary="""Return the timing of the startup phases.""",
+    description="""Return the time spent in each of the startup phases (e.g.
+    configuration parsing, model import, workers creation, warming or API
+    specification generation), relative to the start of the process.""",
+    produces=["application/json"],
+)
+async def get_startup(request):
+    return web.json_response(startup.get_report())
+
+
+@aiohttp_apispec.docs(
+    tags=["debug"],
+    summary="""List the stored profiles of the requests.""",
+    description="""List the IDs of the profiles of the requests that were
+    profiled (with the "X-Profile: 1" header), if the "profile-requests"
+    option is enabled.""",
+    produces=["application/json"],
+    responses={
+        200: {"description": "List of the IDs of the stored profiles"},
+        404: {"description": "Profiling of requests not enabled"},
+    },
+)
+async def get_profiles(request):
+    if not CONF.profile_requests:
+        raise web.HTTPNotFound(reason="Profiling of requests is not enabled")
+    return web.json_response(profiling.list_profiles())
+
+
+@aiohttp_apispec.docs(
+    tags=["debug"],
+    summary="""Download the profile of a request.""",
+    description="""Download the profile of a request, given the ID returned in
+    the "X-Profile-Id" header. By default it is returned as a pstats file, use
+    "format=collapsed" to get the collapsed stacks, to be rendered as a flame
+    graph (e.g. with flamegraph.pl or speedscope).""",
+    parameters=[
+        {
+            "in": "query",
+            "name": "format",
+            "schema": {"type": "string", "enum": list(profiling.FORMATS)},
+            "required": False,
+        }
+    ],
+    produces=["application/octet-stream", "text/plain"],
+    responses={
+        200: {"description": "The profile of the request"},
+        404: {"description": "Profile not found, or profiling not enabled"},
+    },
+)
+async def get_profile(request):
+    if not CONF.profile_requests:
+        raise web.HTTPNotFound(reason="Profiling of requests is not enabled")
+    profile_id = request.match_info["profile_id"]
+    fmt = request.query.get("format", "pstats")
+    if fmt not in profiling.FORMATS:
+        raise web.HTTPBadRequest(
+            reason="Invalid format, use one of: %s" % ", ".join(profiling.FORMATS)
+        )
+    path = profiling.get_profile_path(profile_id, fmt)
+    if path is None:
+        raise web.HTTPNotFound(reason="Profile not found")
+    ext, content_type = profiling.FORMATS[fmt]
+    return web.FileResponse(
+        path,
+        headers={
+            "Content-Type": content_type,
+            "Content-Disposition": 'attachment; filename="%s%s"' % (profile_id, ext),
+        },
+    )
+
+
 def setup_routes(app):
     app.router.add_get("/debug/", get, allow_head=False)
+    app.router.add_get("/debug/startup/", get_startup, allow_head=False)
+    app.router.add_get("/debug/profiles/", get_profiles, allow_head=False)
+    app.router.add_get("/debug/profiles/{profile_id}", get_profile, allow_head=False)
@@ -21,7 +21,10 @@ import webargs.core
 
 from deepaas.api.v2 import responses
 from deepaas.api.v2 import utils
+from deepaas import exceptions
 from deepaas import model
+from deepaas import profiling
+from deepaas import tracing
 
 
 def _get_model_response(model_name, model_obj):
@@ -63,27 +66,47 @@ def _get_handler(model_name, model_obj):
         @aiohttp_apispec.response_schema(response(), 200)
         @aiohttp_apispec.response_schema(responses.Failure(), 400)
         async def post(self, request):
-            args = await aiohttpparser.parser.parse(handler_args, request)
-            task = self.model_obj.predict(**args)
-            await task
+            with tracing.span("parse_arguments"):
+                args = await aiohttpparser.parser.parse(handler_args, request)
+            profile_id = profiling.get_request_profile(request)
+            if profile_id is None:
+                task = self.model_obj.predict(**args)
+            else:
+                task = self.model_obj.predict(
+                    profile=profiling.get_profile_prefix(profile_id), **args
+                )
+            try:
+                await task
+            except exceptions.WorkerDied:
+                raise web.HTTPServiceUnavailable(
+                    reason="The worker making the prediction died, retry later"
+                )
 
             ret = task.result()["output"]
 
             if isinstance(ret, model.v2.wrapper.ReturnedFile):
                 ret = open(ret.filename, "rb")
 
+            headers = {}
+            if profile_id is not None:
+                headers[profiling.PROFILE_ID_HEADER] = profile_id
+
             accept = args.get("accept", "application/json")
             if accept not in ["application/json", "*/*"]:
                 response = web.Response(
                     body=ret,
                     content_type=accept,
+                    headers=headers,
                 )
                 return response
             if self.model_obj.has_schema:
-                self.model_obj.validate_response(ret)
-                return web.json_response(ret)
+                with tracing.span("validate_response"):
+                    self.model_obj.validate_response(ret)
+            else:
+                ret = {"status": "OK", "predictions": ret}
 
-            return web.json_response({"status": "OK", "predictions": ret})
+            with tracing.span("serialize_response"):
+                return web.json_response(ret, headers=headers)
 
     return Handler(model_name, model_obj)
 
@@ -93,8 +116,5 @@ def setup_routes(app, enable=True):
     # different resources for each model. This way we can also load the
     # expected parameters if needed (as in the training method).
     for model_name, model_obj in model.V2_MODELS.items():
-        if enable:
-            hdlr = _get_handler(model_name, model_obj)
-        else:
-            hdlr = utils.NotEnabledHandler()
+        hdlr = utils.get_handler(_get_handler, model_name, model_obj, enable=enable)
         app.router.add_post("/models/%s/predict/" % model_name, hdlr.post)
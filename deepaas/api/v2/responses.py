@@ -62,10 +62,24 @@ class Training(marshmallow.Schema):
     status = fields.Str(
         required=True,
         description="Training status",
-        enum=["running", "error", "completed", "cancelled"],
-        validate=validate.OneOf(["running", "error", "completed", "cancelled"]),
+        enum=["queued", "running", "error", "completed", "cancelled"],
+        validate=validate.OneOf(
+            ["queued", "running", "error", "completed", "cancelled"]
+        ),
     )
     message = fields.Str(description="Optional message explaining status")
+    priority = fields.Int(description="Priority of a queued training")
+    position = fields.Int(description="Position of a queued training in the queue")
+
+
+class TrainingEvent(marshmallow.Schema):
+    id = fields.Int(required=True, description="Event identifier")  # noqa
+    date = fields.DateTime(required=True, description="Event date")
+    progress = fields.Float(
+        allow_none=True, description="Fraction of the training already done"
+    )
+    message = fields.Str(allow_none=True, description="Optional message")
+    metrics = fields.Dict(description="Metrics reported by the model")
 
 
 class TrainingList(marshmallow.Schema):
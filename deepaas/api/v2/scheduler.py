@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import heapq
+import itertools
+
+from deepaas import log
+
+LOG = log.getLogger("deepaas.api.v2.scheduler")
+
+
+class TrainingScheduler(object):
+    """Start trainings in priority order, limiting how many run at once.
+
+    Trainings with a higher priority are started first, trainings with the
+    same priority are started in submission order.
+
+    :param max_running: Maximum number of trainings running at the same time,
+        0 means no limit.
+    :param on_error: Callable that will be called with the training and the
+        exception if a queued training cannot be started.
+    """
+
+    def __init__(self, max_running=0, on_error=None):
+        self.max_running = max_running
+        self.running = 0
+        self._on_error = on_error
+        self._queue = []
+        self._seq = itertools.count()
+        self._positions = None
+
+    def _has_room(self):
+        return not self.max_running or self.running < self.max_running
+
+    def submit(self, training, start, priority=0):
+        """Start a training now if possible, otherwise queue it.
+
+        :param training: The training record.
+        :param start: Callable that starts the training, returning its task.
+            If it is called right away, any exception is propagated.
+        :param priority: Trainings with higher priority are started first.
+        :returns: True if the training was started, False if it was queued.
+        """
+        if self._has_room() and not self._queue:
+            self._start(start)
+            return True
+
+        heapq.heappush(self._queue, (-priority, next(self._seq), training, start))
+        self._positions = None
+        return False
+
+    def cancel(self, training):
+        """Remove a training from the queue, return False if it was not queued."""
+        queue = [entry for entry in self._queue if entry[2] is not training]
+        if len(queue) == len(self._queue):
+            return False
+        heapq.heapify(queue)
+        self._queue = queue
+        self._positions = None
+        return True
+
+    def position(self, training):
+        """Return the position of a training in the queue, None if not queued."""
+        if self._positions is None:
+            self._positions = {
+                id(entry[2]): position
+                for position, entry in enumerate(sorted(self._queue))
+            }
+        return self._positions.get(id(training))
+
+    def _start(self, start):
+        task = start()
+        self.running += 1
+        task.add_done_callback(self._on_done)
+
+    def _on_done(self, task):
+        self.running -= 1
+        while self._queue and self._has_room():
+            _, _, training, start = heapq.heappop(self._queue)
+            self._positions = None
+            try:
+                self._start(start)
+            except Exception as e:
+                LOG.exception("Cannot start queued training: %s", e)
+                if self._on_error is not None:
+                    self._on_error(training, e)
@@ -15,22 +15,36 @@
 # under the License.
 
 import asyncio
+import bisect
 import collections
 from datetime import datetime
+import functools
+import itertools
+import json
 import uuid
 
 from aiohttp import web
 import aiohttp_apispec
+from oslo_config import cfg
 from webargs import aiohttpparser
+from webargs import fields
+from webargs import validate
 import webargs.core
 
 from deepaas.api.v2 import responses
+from deepaas.api.v2 import scheduler
 from deepaas.api.v2 import utils
 from deepaas import log
 from deepaas import model
 
+CONF = cfg.CONF
+
 LOG = log.getLogger("deepaas.api.v2.train")
 
+TRAINING_STATUSES = ["queued", "running", "error", "done", "cancelled"]
+
+MAX_PAGE_SIZE = 1000
+
 UploadedFileInfo = collections.namedtuple(
     "UploadedFileInfo", ("name", "content_type", "original_filename")
 )
@@ -49,9 +63,63 @@ UploadedFileInfo = collections.namedtuple(
    Filename of the original file being uploaded.
 """
 
+list_args = webargs.core.dict2schema(
+    {
+        "limit": fields.Int(
+            validate=validate.Range(min=1, max=MAX_PAGE_SIZE),
+            metadata={"description": "Maximum number of trainings to return."},
+        ),
+        "cursor": fields.Int(
+            validate=validate.Range(min=0),
+            metadata={
+                "description": (
+                    "Opaque pagination cursor, as returned in the 'next' link "
+                    "of a previous page."
+                )
+            },
+        ),
+        "status": fields.Str(
+            validate=validate.OneOf(TRAINING_STATUSES),
+            metadata={
+                "description": "Only return trainings with this status.",
+                "enum": TRAINING_STATUSES,
+            },
+        ),
+        "since": fields.DateTime(
+            metadata={"description": "Only return trainings submitted after this date."}
+        ),
+        "until": fields.DateTime(
+            metadata={
+                "description": "Only return trainings submitted before this date."
+            }
+        ),
+    }
+)
+
+submit_args = webargs.core.dict2schema(
+    {
+        "priority": fields.Int(
+            missing=0,
+            metadata={
+                "description": (
+                    "Priority of the training if it has to be queued, trainings "
+                    "with a higher priority are started first."
+                )
+            },
+        ),
+    }
+)
+
 
 def _get_handler(model_name, model_obj):  # noqa
-    args = webargs.core.dict2schema(model_obj.get_train_args())
+    train_args = model_obj.get_train_args()
+    reserved = sorted(set(train_args) & set(submit_args().fields))
+    if reserved:
+        raise ValueError(
+            "Training arguments %s of model %s clash with the query parameters "
+            "of the train endpoint, rename them" % (", ".join(reserved), model_name)
+        )
+    args = webargs.core.dict2schema(train_args)
     args.opts.ordered = True
 
     class Handler(object):
@@ -61,10 +129,60 @@ def _get_handler(model_name, model_obj):  # noqa
         def __init__(self, model_name, model_obj):
             self.model_name = model_name
             self.model_obj = model_obj
+            # Trainings are stored twice, indexed by their UUID and in
+            # submission order (i.e. ordered both by their sequence
+            # number and by their submission date) so that we can paginate and
+            # filter them using bisection instead of walking the whole history.
+            # Deleted trainings are left in the history and skipped, and
+            # purged once they are the majority.
             self._trainings = {}
+            self._history = []
+            self._seq = itertools.count()
+            self._scheduler = scheduler.TrainingScheduler(
+                max_running=CONF.max_concurrent_trainings,
+                on_error=self._fail_training,
+            )
+
+        @staticmethod
+        def _finish_training(training, task):
+            """Store the final status of a training once its task is done.
+
+            This is done only once per training, so that listing trainings
+            does not need to inspect the task nor parse any date.
+            """
+            if task.cancelled():
+                training["status"] = "cancelled"
+            elif task.exception():
+                training["status"] = "error"
+                training["message"] = "%s" % task.exception()
+            else:
+                training["status"] = "done"
+                result = task.result()
+                end = datetime.strptime(result["finish_date"], "%Y-%m-%d %H:%M:%S.%f")
+                result["duration"] = str(end - training["started"])
+                training["result"] = result
+
+            for queue in training["subscribers"]:
+                queue.put_nowait(None)
 
         @staticmethod
-        def build_train_response(uuid, training):
+        def _fail_training(training, exc, status="error"):
+            """Mark a training that never started as finished."""
+            training["status"] = status
+            if exc is not None:
+                training["message"] = "%s" % exc
+            for queue in training["subscribers"]:
+                queue.put_nowait(None)
+
+        @staticmethod
+        def _add_event(training, event):
+            """Store an event reported by the model and notify subscribers."""
+            event["id"] = next(training["event_seq"])
+            training["events"].append(event)
+            for queue in training["subscribers"]:
+                queue.put_nowait(event)
+
+        def build_train_response(self, uuid, training):
             if not training:
                 return
 
@@ -72,78 +190,169 @@ def _get_handler(model_name, model_obj):  # noqa
             ret["date"] = training["date"]
             ret["args"] = training["args"]
             ret["uuid"] = uuid
+            ret["status"] = training["status"]
+            if "message" in training:
+                ret["message"] = training["message"]
+            if "result" in training:
+                ret["result"] = training["result"]
+            if training["status"] == "queued":
+                ret["priority"] = training["priority"]
+                ret["position"] = self._scheduler.position(training)
+            return ret
 
-            for key, val in ret["args"].items():
+        def _start_training(self, training):
+            training["task"] = self.model_obj.train(
+                on_event=functools.partial(self._add_event, training),
+                **training["args"],
+            )
+            training["status"] = "running"
+            training["started"] = datetime.now()
+            training["task"].add_done_callback(
+                lambda task: self._finish_training(training, task)
+            )
+            return training["task"]
+
+        def _add_training(self, uuid_, args, priority=0):
+            for key, val in args.items():
                 if isinstance(val, web.FileField):
-                    aux = UploadedFileInfo(
+                    args[key] = UploadedFileInfo(
                         name=val.name,
                         content_type=val.content_type,
                         original_filename=val.filename,
                     )
-                    ret["args"][key] = aux
-
-            if training["task"].cancelled():
-                ret["status"] = "cancelled"
-            elif training["task"].done():
-                exc = training["task"].exception()
-                if exc:
-                    ret["status"] = "error"
-                    ret["message"] = "%s" % exc
-                else:
-                    ret["status"] = "done"
-                    ret["result"] = training["task"].result()
-                    end = datetime.strptime(
-                        ret["result"]["finish_date"], "%Y-%m-%d %H:%M:%S.%f"
-                    )
-                    start = datetime.strptime(ret["date"], "%Y-%m-%d %H:%M:%S.%f")
-                    ret["result"]["duration"] = str(end - start)
-            else:
-                ret["status"] = "running"
+
+            start = datetime.now()
+            training = {
+                "start": start,
+                "date": str(start),
+                "args": args,
+                "status": "queued",
+                "priority": priority,
+                "events": collections.deque(maxlen=CONF.train_events_history),
+                "event_seq": itertools.count(),
+                "subscribers": set(),
+            }
+            self._scheduler.submit(
+                training, functools.partial(self._start_training, training), priority
+            )
+            training["seq"] = next(self._seq)
+            self._trainings[uuid_] = training
+            self._history.append((uuid_, training))
+            return training
+
+        def _remove_training(self, uuid_):
+            training = self._trainings.pop(uuid_, None)
+            if len(self._history) > 2 * len(self._trainings) + 1:
+                self._history = [
+                    (u, t) for u, t in self._history if u in self._trainings
+                ]
+            return training
+
+        def _list_trainings(
+            self, limit=None, cursor=None, status=None, since=None, until=None
+        ):
+            history = self._history
+            start = 0
+            # Submission dates are stored as naive local times
+            since, until = (
+                d.astimezone().replace(tzinfo=None) if d and d.tzinfo else d
+                for d in (since, until)
+            )
+            end = len(history)
+            if cursor is not None:
+                start = bisect.bisect_right(
+                    history, cursor, key=lambda item: item[1]["seq"]
+                )
+            if since is not None:
+                start = max(
+                    start,
+                    bisect.bisect_left(
+                        history, since, key=lambda item: item[1]["start"]
+                    ),
+                )
+            if until is not None:
+                end = bisect.bisect_right(
+                    history, until, key=lambda item: item[1]["start"]
+                )
+
+            ret = []
+            for i in range(start, end):
+                uuid_, training = history[i]
+                if uuid_ not in self._trainings:
+                    continue
+                if status is not None and training["status"] != status:
+                    continue
+                ret.append((uuid_, training))
+                if limit is not None and len(ret) == limit:
+                    break
             return ret
 
         @aiohttp_apispec.docs(
-            tags=["models"], summary="Retrain model with available data"
+            tags=["models"],
+            summary="Retrain model with available data",
+            description=(
+                "If the maximum number of concurrent trainings is reached, the "
+                "training is queued and started according to its 'priority' "
+                "(passed in the query string)."
+            ),
         )
+        @aiohttp_apispec.querystring_schema(submit_args)
         @aiohttp_apispec.querystring_schema(args)
         @aiohttpparser.parser.use_args(args)
         async def post(self, request, args):
+            query = await aiohttpparser.parser.parse(
+                submit_args, request, locations=("querystring",)
+            )
             uuid_ = uuid.uuid4().hex
-            train_task = self.model_obj.train(**args)
-            self._trainings[uuid_] = {
-                "date": str(datetime.now()),
-                "task": train_task,
-                "args": args,
-            }
-            ret = self.build_train_response(uuid_, self._trainings[uuid_])
+            training = self._add_training(uuid_, args, priority=query["priority"])
+            ret = self.build_train_response(uuid_, training)
             return web.json_response(ret)
 
         @aiohttp_apispec.docs(tags=["models"], summary="Cancel a running training")
         async def delete(self, request):
             uuid_ = request.match_info["uuid"]
-            training = self._trainings.pop(uuid_, None)
+            training = self._remove_training(uuid_)
             if not training:
                 raise web.HTTPNotFound()
-            training["task"].cancel()
-            try:
-                await asyncio.wait_for(training["task"], 5)
-            except asyncio.TimeoutError:
-                pass
+            if self._scheduler.cancel(training):
+                self._fail_training(training, None, status="cancelled")
+            elif "task" in training:
+                training["task"].cancel()
+                try:
+                    await asyncio.wait_for(training["task"], 5)
+                except asyncio.TimeoutError:
+                    pass
             LOG.info("Training %s has been cancelled" % uuid_)
             ret = self.build_train_response(uuid_, training)
             return web.json_response(ret)
 
         @aiohttp_apispec.docs(
-            tags=["models"], summary="Get a list of trainings (running or completed)"
+            tags=["models"],
+            summary="Get a list of trainings (running or completed)",
+            description=(
+                "Trainings are returned in submission order. If a 'limit' is "
+                "given and there might be more trainings available, a 'Link' "
+                "header with 'rel=\"next\"' will point to the next page."
+            ),
         )
+        @aiohttp_apispec.querystring_schema(list_args)
         @aiohttp_apispec.response_schema(responses.TrainingList(), 200)
         async def index(self, request):
-            ret = []
-            for uuid_, training in self._trainings.items():
-                training = self._trainings.get(uuid_, None)
-                aux = self.build_train_response(uuid_, training)
-                ret.append(aux)
+            query = await aiohttpparser.parser.parse(
+                list_args, request, locations=("querystring",)
+            )
+            trainings = self._list_trainings(**query)
 
-            return web.json_response(ret)
+            ret = [
+                self.build_train_response(uuid_, training)
+                for uuid_, training in trainings
+            ]
+            headers = {}
+            if "limit" in query and len(trainings) == query["limit"]:
+                next_url = request.rel_url.update_query(cursor=trainings[-1][1]["seq"])
+                headers["Link"] = '<%s>; rel="next"' % next_url
+
+            return web.json_response(ret, headers=headers)
 
         @aiohttp_apispec.docs(tags=["models"], summary="Get status of a training")
         @aiohttp_apispec.response_schema(responses.Training(), 200)
@@ -155,6 +364,66 @@ def _get_handler(model_name, model_obj):  # noqa
                 return web.json_response(ret)
             raise web.HTTPNotFound()
 
+        @aiohttp_apispec.docs(
+            tags=["models"],
+            summary="Get the progress events reported during a training",
+            description=(
+                "If the client accepts 'text/event-stream' the events are "
+                "streamed as Server-Sent Events until the training finishes, "
+                "ending with a 'status' event containing the training status. "
+                "Otherwise the last retained events are returned as a list."
+            ),
+            produces=["application/json", "text/event-stream"],
+        )
+        @aiohttp_apispec.response_schema(responses.TrainingEvent(many=True), 200)
+        async def events(self, request):
+            uuid_ = request.match_info["uuid"]
+            training = self._trainings.get(uuid_, None)
+            if not training:
+                raise web.HTTPNotFound()
+
+            if "text/event-stream" not in request.headers.get("Accept", ""):
+                return web.json_response(list(training["events"]))
+
+            try:
+                last_id = int(request.headers.get("Last-Event-ID", -1))
+            except ValueError:
+                last_id = -1
+
+            response = web.StreamResponse(
+                headers={
+                    "Content-Type": "text/event-stream",
+                    "Cache-Control": "no-cache",
+                }
+            )
+            await response.prepare(request)
+
+            queue = asyncio.Queue()
+            training["subscribers"].add(queue)
+            try:
+                # Events reported while we send the retained ones are also
+                # queued, so we skip those that we have already sent.
+                for event in list(training["events"]):
+                    if event["id"] > last_id:
+                        await self._send_event(response, "progress", event)
+                        last_id = event["id"]
+                if training["status"] in ("queued", "running"):
+                    while (event := await queue.get()) is not None:
+                        if event["id"] > last_id:
+                            await self._send_event(response, "progress", event)
+                ret = self.build_train_response(uuid_, training)
+                await self._send_event(response, "status", ret)
+            finally:
+                training["subscribers"].discard(queue)
+            return response
+
+        @staticmethod
+        async def _send_event(response, name, data):
+            msg = "event: %s\ndata: %s\n\n" % (name, json.dumps(data))
+            if name == "progress":
+                msg = "id: %s\n%s" % (data["id"], msg)
+            await response.write(msg.encode("utf-8"))
+
     return Handler(model_name, model_obj)
 
 
@@ -163,10 +432,7 @@ def setup_routes(app, enable=True):
     # different resources for each model. This way we can also load the
     # expected parameters if needed (as in the training method).
     for model_name, model_obj in model.V2_MODELS.items():
-        if enable:
-            hdlr = _get_handler(model_name, model_obj)
-        else:
-            hdlr = utils.NotEnabledHandler()
+        hdlr = utils.get_handler(_get_handler, model_name, model_obj, enable=enable)
         app.router.add_post("/models/%s/train/" % model_name, hdlr.post)
         app.router.add_get(
             "/models/%s/train/" % model_name, hdlr.index, allow_head=False
@@ -175,3 +441,8 @@ def setup_routes(app, enable=True):
             "/models/%s/train/{uuid}" % model_name, hdlr.get, allow_head=False
         )
         app.router.add_delete("/models/%s/train/{uuid}" % model_name, hdlr.delete)
+        app.router.add_get(
+            "/models/%s/train/{uuid}/events" % model_name,
+            hdlr.events,
+            allow_head=False,
+        )
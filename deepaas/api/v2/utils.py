@@ -23,3 +23,34 @@ class NotEnabledHandler(object):
             raise web.HTTPPaymentRequired()
 
         return f
+
+
+class LazyHandler(object):
+    """Handler that is only built when it is used for the first time.
+
+    This is used for models that are loaded lazily, as building their handlers
+    requires to load the model to get its arguments.
+
+    :param factory: Callable returning the actual handler.
+    """
+
+    def __init__(self, factory):
+        self._factory = factory
+        self._handler = None
+
+    def __getattr__(self, attr):
+        async def f(request):
+            if self._handler is None:
+                self._handler = self._factory()
+            return await getattr(self._handler, attr)(request)
+
+        return f
+
+
+def get_handler(factory, model_name, model_obj, enable=True):
+    """Get the handler for a model, built lazily if the model is lazy."""
+    if not enable:
+        return NotEnabledHandler()
+    if getattr(model_obj, "lazy", False):
+        return LazyHandler(lambda: factory(model_name, model_obj))
+    return factory(model_name, model_obj)
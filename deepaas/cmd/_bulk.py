@@ -0,0 +1,350 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Bulk inference for deepaas-cli.
+
+Run the predict method of a model over many inputs (a glob, a directory or a
+CSV/JSONL manifest with one set of arguments per row), loading the model only
+once per worker process. Completed inputs are recorded in a checkpoint file, so
+that an interrupted run can be resumed by launching it again.
+"""
+
+import csv
+import glob
+import json
+import mimetypes
+import multiprocessing as mp
+import os
+import shutil
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+MANIFEST_EXTENSIONS = (".csv", ".jsonl")
+
+# State of the current worker process, see _init_worker()
+_WORKER = {}
+
+
+class BulkError(Exception):
+    """Error in the bulk inference configuration or inputs."""
+
+
+def _get_files(source):
+    if os.path.isdir(source):
+        files = [
+            os.path.join(dirpath, f)
+            for dirpath, _, filenames in os.walk(source)
+            for f in filenames
+        ]
+    else:
+        files = [f for f in glob.glob(source, recursive=True) if os.path.isfile(f)]
+    return sorted(files)
+
+
+def _read_manifest(path, arg_types):
+    base = os.path.dirname(os.path.abspath(path))
+
+    with open(path, newline="") as f:
+        if path.endswith(".csv"):
+            rows = csv.DictReader(f)
+            convert = True
+        else:
+            rows = (json.loads(line) for line in f if line.strip())
+            convert = False
+
+        for n, row in enumerate(rows, 1):
+            unknown = set(row) - set(arg_types)
+            if unknown:
+                raise BulkError(
+                    "Unknown arguments in row %d of %s: %s"
+                    % (n, path, ", ".join(sorted(unknown)))
+                )
+            if convert:
+                # Empty CSV cells mean "use the default value"
+                row = {k: arg_types[k](v) for k, v in row.items() if v != ""}
+            yield "row-%d" % n, base, row
+
+
+def get_inputs(source, method_args, file_args, file_arg=None):
+    """Get the inputs for a bulk run.
+
+    :param source: glob, directory or manifest file (CSV or JSONL)
+    :param method_args: dictionary with the arguments of the method, as
+        returned by ``deepaas.cmd.cli._fields_to_dict``
+    :param file_args: list with the file arguments of the method
+    :param file_arg: argument that gets each of the files of a glob or
+        directory, only needed if the method has several file arguments
+    :return: list of (key, name, arguments) tuples, where the key identifies
+        the input in the checkpoint and combined output, and the name is the
+        (relative) path of its output file
+    """
+    if source.endswith(MANIFEST_EXTENSIONS) and os.path.isfile(source):
+        arg_types = {k: v["type"] for k, v in method_args.items()}
+        inputs = []
+        for key, base, row in _read_manifest(source, arg_types):
+            # Relative paths in a manifest are relative to the manifest
+            for k in file_args:
+                if row.get(k):
+                    row[k] = os.path.join(base, row[k])
+            inputs.append((key, key, row))
+        return inputs
+
+    if file_arg is None:
+        if len(file_args) != 1:
+            raise BulkError(
+                "Cannot guess which argument gets the input files, choose one "
+                "of %s with --deepaas_bulk_argument" % file_args
+            )
+        (file_arg,) = file_args
+    elif file_arg not in file_args:
+        raise BulkError("%s is not a file argument of the method" % file_arg)
+
+    files = _get_files(source)
+    if not files:
+        return []
+
+    # Outputs keep the layout of the inputs, relative to their common root
+    root = os.path.commonpath([os.path.abspath(f) for f in files])
+    if len(files) == 1:
+        root = os.path.dirname(root)
+    return [
+        (f, os.path.relpath(os.path.abspath(f), root), {file_arg: f}) for f in files
+    ]
+
+
+def check_inputs(inputs, method_args, common_args):
+    """Check that every input gets all the required arguments of the method.
+
+    Required arguments are optional in the command line in bulk mode, as they
+    can be given by the inputs, so they are checked here before starting.
+
+    :param inputs: list of (key, name, arguments) tuples, see get_inputs()
+    :param method_args: dictionary with the arguments of the method
+    :param common_args: arguments common to all the inputs
+    :raises BulkError: if an input lacks a required argument
+    """
+    required = {k for k, v in method_args.items() if v["required"]}
+    required -= {k for k, v in common_args.items() if v is not None}
+    for key, _, args in inputs:
+        missing = required - {k for k, v in args.items() if v is not None}
+        if missing:
+            raise BulkError(
+                "Missing required arguments for %s: %s"
+                % (key, ", ".join(sorted(missing)))
+            )
+
+
+def read_checkpoint(path):
+    """Get the keys of the inputs already processed."""
+    if not os.path.exists(path):
+        return set()
+    with open(path) as f:
+        return {json.loads(line) for line in f if line.strip()}
+
+
+def _init_worker(model, options):
+    """Set the model and the run options of this (worker) process.
+
+    :param model: model object, or the name of the model to be loaded
+    :param options: dictionary with the common arguments to all the inputs
+        ("common_args"), the file arguments ("file_args"), where the outputs
+        are stored ("out_dir", None if they are returned to the parent), the
+        content type requested ("accept") and how input files are staged
+        ("staging"). If "warm" is True, the model is warmed before processing
+        any input.
+    """
+    _WORKER.clear()
+    _WORKER.update(options)
+    try:
+        if isinstance(model, str):
+            from deepaas.model import loading
+
+            model = loading.get_model_by_name(model, "v2")
+
+        if options.get("warm") and hasattr(model, "warm"):
+            model.warm()
+    except Exception as e:
+        # A failing pool initializer would be restarted forever, so the error
+        # is reported for each of the inputs instead.
+        LOG.exception("[ERROR, bulk] Cannot load the model")
+        _WORKER["error"] = "%s: %s" % (type(e).__name__, e)
+    _WORKER["model"] = model
+
+
+def _store(result, out_file, accept=None):
+    out_dir = os.path.dirname(out_file)
+    os.makedirs(out_dir, exist_ok=True)
+
+    extension = mimetypes.guess_extension(accept) if accept else None
+    if extension in (None, ".json"):
+        out_file += ".json"
+        with open(out_file + ".tmp", "w") as f:
+            json.dump(result, f)
+    else:
+        out_file += extension
+        shutil.copy(result.name, out_file + ".tmp")
+    # Never leave a partially written output behind
+    os.replace(out_file + ".tmp", out_file)
+
+
+def _process(item):
+    """Run the prediction for one input, in a worker process.
+
+    :return: a (key, output, error) tuple. The output is the JSON encoded
+        result if the outputs are not stored by the worker.
+    """
+    from deepaas.cmd import _staging
+
+    key, name, args = item
+    if "error" in _WORKER:
+        return key, None, _WORKER["error"]
+
+    kwargs = dict(_WORKER["common_args"])
+    kwargs.update(args)
+
+    staged = []
+    try:
+        for k in _WORKER["file_args"]:
+            if kwargs.get(k):
+                kwargs[k] = _staging.stage_file(kwargs[k], _WORKER["staging"])
+                staged.append(kwargs[k].filename)
+
+        result = _WORKER["model"].predict(**kwargs)
+
+        if _WORKER["out_dir"] is None:
+            return key, json.dumps(result), None
+        _store(
+            result,
+            os.path.join(_WORKER["out_dir"], name),
+            _WORKER.get("accept"),
+        )
+        return key, None, None
+    except Exception as e:
+        return key, None, "%s: %s" % (type(e).__name__, e)
+    finally:
+        # Do not wait for the end of the run to remove the staged files (the
+        # model may have removed them already)
+        if _WORKER["staging"] != "reference":
+            for filename in staged:
+                try:
+                    os.remove(filename)
+                except FileNotFoundError:
+                    pass
+
+
+def run(
+    model_name,
+    model_obj,
+    inputs,
+    output,
+    common_args,
+    file_args,
+    checkpoint=None,
+    workers=1,
+    accept=None,
+    warm=True,
+    staging="copy",
+):
+    """Run the predictions for all the inputs.
+
+    :param model_name: name of the model, loaded by each worker process
+    :param model_obj: model object, used when there are no worker processes
+    :param inputs: list of (key, name, arguments) tuples, see get_inputs()
+    :param output: a ".jsonl" file, to write all the outputs to it (one line
+        per input), or a directory, to write one output file per input
+    :param common_args: arguments common to all the inputs
+    :param file_args: list with the file arguments of the method
+    :param checkpoint: file where the completed inputs are recorded. Defaults
+        to the output file (or directory) with a ".checkpoint" suffix.
+    :param workers: number of worker processes, if 1 the predictions are done
+        in this process
+    :param accept: content type requested to the model
+    :param warm: whether to warm the model before any prediction
+    :param staging: how the input files are staged, see
+        deepaas.cmd._staging.stage_file()
+    :return: dictionary with the number of inputs, the ones processed (now or
+        in a previous run) and the ones that failed
+    """
+    combined = output.endswith(".jsonl")
+    checkpoint = checkpoint or output.rstrip(os.sep) + ".checkpoint"
+
+    done = read_checkpoint(checkpoint)
+    pending = [item for item in inputs if item[0] not in done]
+    LOG.info(
+        "[INFO, bulk] %d inputs, %d already processed",
+        len(inputs),
+        len(inputs) - len(pending),
+    )
+
+    options = {
+        "common_args": common_args,
+        "file_args": file_args,
+        "out_dir": None if combined else output,
+        "accept": accept,
+        "warm": warm,
+        "staging": staging,
+    }
+
+    if combined:
+        os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+        out = open(output, "a")
+
+    failed = 0
+    pool = None
+    try:
+        if workers > 1 and len(pending) > 1:
+            workers = min(workers, len(pending))
+            pool = mp.get_context("spawn").Pool(
+                workers, initializer=_init_worker, initargs=(model_name, options)
+            )
+            chunksize = max(1, min(16, len(pending) // (workers * 4)))
+            results = pool.imap_unordered(_process, pending, chunksize)
+        else:
+            _init_worker(model_obj, options)
+            results = map(_process, pending)
+
+        with open(checkpoint, "a") as ckpt:
+            for key, result, error in results:
+                if error:
+                    failed += 1
+                    LOG.error("[ERROR, bulk] %s failed: %s", key, error)
+                    if combined:
+                        out.write(json.dumps({"input": key, "error": error}) + "\n")
+                    continue
+
+                if combined:
+                    out.write(
+                        '{"input": %s, "output": %s}\n' % (json.dumps(key), result)
+                    )
+                    out.flush()
+                # Record the input only when its output is stored
+                ckpt.write(json.dumps(key) + "\n")
+                ckpt.flush()
+    finally:
+        if pool is not None:
+            pool.terminate()
+        if combined:
+            out.close()
+
+    ret = {
+        "inputs": len(inputs),
+        "processed": len(inputs) - failed,
+        "failed": failed,
+    }
+    LOG.info("[INFO, bulk] Finished: %s", ret)
+    return ret
@@ -0,0 +1,248 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Persistent deepaas-cli daemon.
+
+A daemon keeps a (warmed) model loaded and listens on a Unix socket. Later
+deepaas-cli invocations forward their command line to it, and the daemon runs
+the requested method as if it was invoked directly, sending back its result,
+output and exit status.
+
+Requests are served one at a time, as the daemon changes its working
+directory to the one of the client and the configuration is global.
+
+The default sockets are created in a directory only accessible by the user
+(``$XDG_RUNTIME_DIR``, or a private directory in the temporary directory),
+both ends check that the other one is run by the same user, and the messages
+are plain JSON.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import stat
+import struct
+import sys
+import tempfile
+import traceback
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+_HEADER = struct.Struct("!Q")
+
+_PEERCRED = struct.Struct("3i")
+
+# Time (in seconds) to wait for the connection to the daemon
+CONNECT_TIMEOUT = 5
+
+
+def _get_private_dir():
+    runtime_dir = os.environ.get("XDG_RUNTIME_DIR")
+    if runtime_dir:
+        path = runtime_dir
+    else:
+        path = os.path.join(tempfile.gettempdir(), "deepaas-cli-%d" % os.getuid())
+        with contextlib.suppress(FileExistsError):
+            os.mkdir(path, 0o700)
+
+    # Somebody else could have created it first
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode) or st.st_uid != os.getuid() or st.st_mode & 0o077:
+        raise RuntimeError(
+            "The directory of the daemon socket %s must be a directory only "
+            "accessible by its owner, the current user" % path
+        )
+    return path
+
+
+def get_socket_path(model_name=None):
+    """Get the default socket path of the daemon for a model.
+
+    :raises RuntimeError: if the directory of the socket is not private
+    """
+    name = "deepaas-cli-%s.sock" % (model_name or "default")
+    return os.path.join(_get_private_dir(), name)
+
+
+def _check_peer(sock):
+    """Check that the other end of a Unix socket is run by the same user."""
+    creds = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, _PEERCRED.size)
+    _, uid, _ = _PEERCRED.unpack(creds)
+    if uid != os.getuid():
+        raise PermissionError("The peer is run by another user (uid %d)" % uid)
+
+
+def _send(sock, obj):
+    data = json.dumps(obj).encode("utf-8")
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv_exactly(sock, size):
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(min(size - len(buf), 1024 * 1024))
+        if not chunk:
+            raise EOFError("Connection closed")
+        buf += chunk
+    return bytes(buf)
+
+
+def _recv(sock):
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return json.loads(_recv_exactly(sock, size))
+
+
+def forward(path, argv, timeout=None):
+    """Run a command line in the daemon listening on path, if any.
+
+    :param timeout: maximum time (in seconds) to wait for the response, None
+        to wait until the daemon answers
+    :return: the response of the daemon (see run_request()), or None if there
+        is no daemon (of the current user) listening on the socket
+    :raises TimeoutError: if the daemon does not answer in time
+    """
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(path)
+            _check_peer(sock)
+        except PermissionError as e:
+            LOG.warning("Not using the daemon listening on %s: %s", path, e)
+            return None
+        except OSError:
+            return None
+        sock.settimeout(timeout)
+        try:
+            _send(sock, {"argv": list(argv), "cwd": os.getcwd()})
+            return _recv(sock)
+        except socket.timeout:
+            raise TimeoutError("The daemon did not answer in %s seconds" % timeout)
+    finally:
+        sock.close()
+
+
+def replay(response):
+    """Reproduce in the client the output and exit status of a request."""
+    sys.stdout.write(response["stdout"])
+    sys.stderr.write(response["stderr"])
+    if response["exit"] is not None:
+        sys.exit(response["exit"])
+    return response["result"]
+
+
+def run_request(request, func):
+    """Run func with the request command line, capturing its output.
+
+    :param request: dictionary with the command line ("argv") and working
+        directory ("cwd") of the client
+    :param func: function to run with the command line
+    :return: dictionary with the result of func ("result"), its exit status
+        ("exit", None if it did not exit) and its output ("stdout", "stderr")
+    """
+    stdout, stderr = io.StringIO(), io.StringIO()
+    response = {"result": None, "exit": None}
+
+    cwd = os.getcwd()
+    try:
+        os.chdir(request["cwd"])
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                response["result"] = func(request["argv"])
+            except SystemExit as e:
+                response["exit"] = e.code
+            except Exception:
+                traceback.print_exc()
+                response["exit"] = 1
+    finally:
+        os.chdir(cwd)
+
+    response["stdout"] = stdout.getvalue()
+    response["stderr"] = stderr.getvalue()
+    try:
+        json.dumps(response["result"])
+    except Exception as e:
+        response["result"] = None
+        response["stderr"] += "[ERROR]: Cannot send the result: %s\n" % e
+        response["exit"] = 1
+    return response
+
+
+def is_running(path):
+    """Check if there is a daemon listening on path."""
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        return True
+    except OSError:
+        return False
+    finally:
+        sock.close()
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            _check_peer(self.request)
+            request = _recv(self.request)
+            if not isinstance(request.get("argv"), list):
+                raise ValueError("No command line in request")
+        except EOFError:
+            # e.g. a client checking if the daemon is running
+            return
+        except (AttributeError, PermissionError, ValueError) as e:
+            LOG.warning("Invalid request: %s", e)
+            return
+        LOG.info("[INFO, daemon] Running: %s", " ".join(request["argv"]))
+        _send(self.request, run_request(request, self.server.func))
+
+
+def make_server(path, func):
+    """Create the daemon server, listening on a Unix socket.
+
+    :param path: path of the Unix socket
+    :param func: function that runs a command line (list of arguments)
+    """
+    if is_running(path):
+        raise RuntimeError("There is already a daemon listening on %s" % path)
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+
+    # Only the user running the daemon can connect to it
+    old_umask = os.umask(0o177)
+    try:
+        server = socketserver.UnixStreamServer(path, _Handler)
+    finally:
+        os.umask(old_umask)
+    server.func = func
+    return server
+
+
+def serve(path, func):
+    """Serve requests on a Unix socket until interrupted, see make_server()."""
+    server = make_server(path, func)
+    LOG.info("[INFO, daemon] Listening on %s", path)
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        with contextlib.suppress(FileNotFoundError):
+            os.unlink(path)
@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Staging of the input files given to deepaas-cli.
+
+Models get uploaded files as temporary files that they own (and that may be
+deleted after being used), so the input files given in the command line are
+staged as such, avoiding a full copy of the data whenever possible.
+"""
+
+import errno
+import mimetypes
+import os
+import shutil
+import tempfile
+
+try:
+    import fcntl
+except ImportError:  # Not available on Windows
+    fcntl = None
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+MODES = ("copy", "link", "reference")
+
+# From linux/fs.h, clone a file (reflink) in copy-on-write file systems
+FICLONE = 0x40049409
+
+CHUNK_SIZE = 1024 * 1024
+
+# Errors meaning that the file system or kernel does not support a method
+_UNSUPPORTED = (
+    errno.EXDEV,
+    errno.EINVAL,
+    errno.ENOSYS,
+    errno.EOPNOTSUPP,
+    errno.ENOTTY,
+    errno.EBADF,
+    errno.EPERM,
+)
+
+
+def _reflink(src, dst):
+    if fcntl is None:
+        raise OSError(errno.ENOSYS, "reflinks are not supported")
+    fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def _copy_file_range(src, dst):
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not supported")
+    while os.copy_file_range(src.fileno(), dst.fileno(), CHUNK_SIZE * 64):
+        pass
+
+
+def copy_file(src_path, dst_path):
+    """Copy a file, sharing its data with the original if possible.
+
+    Try, in order, a reflink (the copy shares the data blocks with the
+    original, e.g. in Btrfs or XFS), a kernel side copy (copy_file_range,
+    that also uses server side copies in network file systems) and finally a
+    chunked copy.
+    """
+    with open(src_path, "rb") as src, open(dst_path, "wb") as dst:
+        for method in (_reflink, _copy_file_range):
+            try:
+                method(src, dst)
+                return method.__name__.lstrip("_")
+            except OSError as e:
+                if e.errno not in _UNSUPPORTED:
+                    raise
+                # Start again from scratch with the next method
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        return "copy"
+
+
+def _link_file(src_path, dst_path):
+    try:
+        os.link(src_path, dst_path)
+        return "link"
+    except OSError as e:
+        # e.g. the temporary directory is in another file system
+        LOG.debug("Cannot link %s (%s), copying it", src_path, e)
+        return copy_file(src_path, dst_path)
+
+
+def stage_file(fpath, mode="copy"):
+    """Get a file object for the model from a file path.
+
+    :param fpath: path of the input file
+    :param mode: how the file is staged. "copy" makes a copy of the file (a
+        reflink or kernel side copy if possible), "link" makes a hard link to
+        it (falling back to a copy), that the model may delete but must not
+        modify in place, as it shares its contents with the original, and
+        "reference" gives the original file to the model, that must not
+        modify or delete it.
+    :return: deepaas.model.v2.wrapper.UploadedFile
+    """
+    from deepaas.model.v2 import wrapper as v2_wrapper
+
+    if mode not in MODES:
+        raise ValueError("Unknown staging mode %s" % mode)
+
+    if mode == "reference":
+        filename = os.path.abspath(fpath)
+    else:
+        # create tmp file as later it supposed
+        # to be deleted by the application
+        temp = tempfile.NamedTemporaryFile()
+        temp.close()
+        filename = temp.name
+        if mode == "link":
+            how = _link_file(fpath, filename)
+        else:
+            how = copy_file(fpath, filename)
+        LOG.debug("Staged %s as %s (%s)", fpath, filename, how)
+
+    # create file object
+    file_type = mimetypes.MimeTypes().guess_type(fpath)[0]
+    return v2_wrapper.UploadedFile(
+        name="data",
+        filename=filename,
+        content_type=file_type,
+        original_filename=fpath,
+    )
@@ -0,0 +1,481 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Load testing of the DEEPaaS API.
+
+Start DEEPaaS serving a model with a tunable cost (see
+deepaas.tests.fake_v2_model.BenchModel), send it predictions or trainings at a
+fixed rate or concurrency, and report the throughput and latencies, broken
+down by stage.
+"""
+
+import asyncio
+import collections
+import json
+import multiprocessing
+import sys
+import time
+import types
+
+import aiohttp
+from oslo_config import cfg
+
+import deepaas
+from deepaas.cmd import run
+from deepaas import config
+from deepaas import log
+from deepaas.model import loading
+
+cli_opts = [
+    cfg.StrOpt(
+        "url",
+        default="",
+        help="""
+Base URL of a DEEPaaS API to benchmark (e.g. http://127.0.0.1:5000). If not
+set, DEEPaaS is started serving the benchmark model, with the given options
+(e.g. "workers" or "http-workers"). If set, the API must be serving a model
+named "deepaas-bench".
+""",
+    ),
+    cfg.StrOpt(
+        "endpoint",
+        default="predict",
+        choices=["predict", "train"],
+        help="""
+Endpoint to benchmark. Trainings are followed until they finish.
+""",
+    ),
+    cfg.IntOpt(
+        "concurrency",
+        default=10,
+        min=1,
+        help="""
+Number of requests in flight. If "rate" is not set, each of them sends a new
+request as soon as it gets a response.
+""",
+    ),
+    cfg.FloatOpt(
+        "rate",
+        default=0,
+        min=0,
+        help="""
+Send requests at this fixed rate (requests per second), regardless of the
+responses, up to "concurrency" requests in flight. Latencies are measured from
+the time each request should have been sent.
+""",
+    ),
+    cfg.FloatOpt(
+        "duration",
+        default=10,
+        min=0,
+        help="""
+Seconds that the benchmark lasts, after the warm up.
+""",
+    ),
+    cfg.FloatOpt(
+        "warmup",
+        default=1,
+        min=0,
+        help="""
+Seconds sending requests before the benchmark starts, that are not reported.
+""",
+    ),
+    cfg.IntOpt(
+        "input-size",
+        default=0,
+        min=0,
+        help="""
+Size (in bytes) of the file uploaded with each prediction. If 0, no file is
+uploaded.
+""",
+    ),
+    cfg.StrOpt(
+        "output",
+        default="",
+        help="""
+Write the results to this file, as JSON, e.g. to compare DEEPaaS versions.
+""",
+    ),
+    cfg.FloatOpt(
+        "model-cpu-time",
+        default=0,
+        min=0,
+        help="""
+CPU seconds that the model spends in each prediction or training.
+""",
+    ),
+    cfg.FloatOpt(
+        "model-sleep",
+        default=0,
+        min=0,
+        help="""
+Seconds that the model sleeps in each prediction or training.
+""",
+    ),
+    cfg.IntOpt(
+        "model-output-size",
+        default=1024,
+        min=0,
+        help="""
+Size (in bytes) of the data returned by each prediction.
+""",
+    ),
+    cfg.IntOpt(
+        "model-memory",
+        default=0,
+        min=0,
+        help="""
+Memory (in MiB) allocated by each model worker.
+""",
+    ),
+]
+
+CONF = cfg.CONF
+CONF.register_cli_opts(cli_opts)
+
+LOG = log.getLogger(__name__)
+
+MODEL_NAME = "deepaas-bench"
+
+STAGES = ("total", "connect", "server", "model", "transfer", "training")
+
+
+def _get_model_params():
+    return {
+        "cpu_time": CONF.model_cpu_time,
+        "sleep": CONF.model_sleep,
+        "output_size": CONF.model_output_size,
+        "memory": CONF.model_memory,
+    }
+
+
+def _run_server(argv, model_params):
+    """Run DEEPaaS serving the benchmark model (in a child process)."""
+    from deepaas.tests import fake_v2_model
+
+    model = fake_v2_model.BenchModel(**model_params)
+    loading.add_model(MODEL_NAME, model, "v2")
+    sys.argv = ["deepaas-run"] + argv + ["--model-name", MODEL_NAME]
+    run.main()
+
+
+def _get_trace_config():
+    """Get a trace config that records when each stage of a request ends."""
+
+    def _record(name):
+        async def on_event(session, ctx, params):
+            if ctx.trace_request_ctx is not None:
+                ctx.trace_request_ctx[name] = time.perf_counter()
+
+        return on_event
+
+    trace = aiohttp.TraceConfig(trace_config_ctx_factory=types.SimpleNamespace)
+    trace.on_connection_queued_start.append(_record("queued_start"))
+    trace.on_connection_queued_end.append(_record("queued_end"))
+    trace.on_connection_create_start.append(_record("create_start"))
+    trace.on_connection_create_end.append(_record("create_end"))
+    trace.on_request_end.append(_record("headers"))
+    return trace
+
+
+def _get_stages(start, trace, end):
+    """Get the duration of the stages of a request from its trace."""
+    connect = 0.0
+    for name in ("queued", "create"):
+        if name + "_end" in trace:
+            connect += trace[name + "_end"] - trace[name + "_start"]
+    headers = trace.get("headers", end)
+    return {
+        "connect": connect,
+        "server": headers - start - connect,
+        "transfer": end - headers,
+    }
+
+
+class Benchmark(object):
+    """Send requests to a DEEPaaS API and record their latencies.
+
+    :param url: base URL of the API
+    :param endpoint: "predict" or "train"
+    :param input_size: size (in bytes) of the file uploaded with predictions
+    :param connector: aiohttp connector to use, if None a TCP one is used. Its
+        limit of connections is the limit of requests in flight.
+    """
+
+    def __init__(self, url, endpoint="predict", input_size=0, connector=None):
+        self.url = "%s/v2/models/%s/%s/" % (url.rstrip("/"), MODEL_NAME, endpoint)
+        self.endpoint = endpoint
+        self.input = b"x" * input_size
+        self.connector = connector
+        self.latencies = collections.defaultdict(list)
+        self.errors = collections.Counter()
+        self.recording = False
+
+    def _get_data(self):
+        if self.endpoint != "predict" or not self.input:
+            return None
+        data = aiohttp.FormData()
+        data.add_field("data", self.input, filename="input")
+        return data
+
+    async def _post(self, session, stages):
+        trace = {}
+        start = time.perf_counter()
+        async with session.post(
+            self.url, data=self._get_data(), trace_request_ctx=trace
+        ) as resp:
+            if resp.status >= 400:
+                raise aiohttp.ClientResponseError(
+                    resp.request_info, resp.history, status=resp.status
+                )
+            ret = await resp.json()
+        stages.update(_get_stages(start, trace, time.perf_counter()))
+        return ret
+
+    async def _train(self, session, stages):
+        ret = await self._post(session, stages)
+        start = time.perf_counter()
+        while ret["status"] in ("queued", "running"):
+            await asyncio.sleep(0.05)
+            async with session.get(self.url + ret["uuid"]) as resp:
+                ret = await resp.json()
+        stages["training"] = time.perf_counter() - start
+        if ret["status"] != "done":
+            raise RuntimeError("Training %s" % ret["status"])
+        return ret["result"]["output"]
+
+    async def request(self, session, scheduled=None):
+        """Send a request, recording its latencies.
+
+        :param scheduled: when the request should have been sent, the total
+            latency is measured from it
+        """
+        start = scheduled or time.perf_counter()
+        recording = self.recording
+        stages = {}
+        try:
+            if self.endpoint == "train":
+                ret = await self._train(session, stages)
+                stages["model"] = ret["duration"]
+            else:
+                ret = await self._post(session, stages)
+                stages["model"] = ret["predictions"]["duration"]
+                # The time spent by the model is not server overhead
+                stages["server"] -= stages["model"]
+        except aiohttp.ClientResponseError as e:
+            if recording:
+                self.errors["HTTP %s" % e.status] += 1
+            return
+        except Exception as e:
+            if recording:
+                self.errors[type(e).__name__] += 1
+            return
+        stages["total"] = time.perf_counter() - start
+        if recording:
+            for stage, duration in stages.items():
+                self.latencies[stage].append(duration)
+
+    async def _run_closed(self, session, concurrency, deadline):
+        async def _loop():
+            while time.perf_counter() < deadline:
+                await self.request(session)
+
+        await asyncio.gather(*[_loop() for _ in range(concurrency)])
+
+    async def _run_open(self, session, rate, deadline):
+        tasks = set()
+        start = time.perf_counter()
+        n = 0
+        while True:
+            scheduled = start + n / rate
+            if scheduled >= deadline:
+                break
+            await asyncio.sleep(max(0, scheduled - time.perf_counter()))
+            task = asyncio.create_task(self.request(session, scheduled))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            n += 1
+        await asyncio.gather(*tasks)
+
+    async def run(self, duration, warmup=0, concurrency=1, rate=0):
+        """Run the benchmark, returning the measured duration."""
+        # Requests over the concurrency wait for a connection
+        connector = self.connector or aiohttp.TCPConnector(limit=concurrency)
+        async with aiohttp.ClientSession(
+            connector=connector,
+            trace_configs=[_get_trace_config()],
+            timeout=aiohttp.ClientTimeout(total=None),
+        ) as session:
+            start = time.perf_counter()
+            deadline = start + warmup + duration
+
+            async def _record():
+                await asyncio.sleep(warmup)
+                self.recording = True
+                await asyncio.sleep(duration)
+                self.recording = False
+
+            recorder = asyncio.create_task(_record())
+            if rate:
+                await self._run_open(session, rate, deadline)
+            else:
+                await self._run_closed(session, concurrency, deadline)
+            await recorder
+        return duration
+
+
+def _percentile(values, p):
+    """Get a percentile (0-100) of sorted values, interpolating."""
+    k = (len(values) - 1) * p / 100
+    i = int(k)
+    if i + 1 >= len(values):
+        return values[-1]
+    return values[i] + (values[i + 1] - values[i]) * (k - i)
+
+
+def get_report(bench, duration):
+    """Get the results of a benchmark."""
+    latencies = {}
+    for stage in STAGES:
+        values = sorted(bench.latencies.get(stage, ()))
+        if not values:
+            continue
+        latencies[stage] = {
+            "mean": sum(values) / len(values),
+            "p50": _percentile(values, 50),
+            "p95": _percentile(values, 95),
+            "p99": _percentile(values, 99),
+            "max": values[-1],
+        }
+        latencies[stage] = {k: round(v, 6) for k, v in latencies[stage].items()}
+
+    requests = len(bench.latencies["total"])
+    return {
+        "requests": requests,
+        "errors": dict(bench.errors),
+        "duration": duration,
+        "throughput": round(requests / duration, 3) if duration else 0,
+        "latency": latencies,
+    }
+
+
+def print_report(report):
+    print("Requests: %(requests)s, throughput: %(throughput)s req/s" % report)
+    for error, n in sorted(report["errors"].items()):
+        print("Errors (%s): %s" % (error, n))
+    if not report["latency"]:
+        return
+    print()
+    print(
+        "%-10s %10s %10s %10s %10s %10s" % ("stage (ms)", *report["latency"]["total"])
+    )
+    for stage, values in report["latency"].items():
+        values = " ".join("%10.2f" % (v * 1000) for v in values.values())
+        print("%-10s %s" % (stage, values))
+
+
+async def _wait_ready(url, connector, proc, timeout=120):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession(connector=connector, connector_owner=False) as s:
+        while time.monotonic() < deadline:
+            if proc is not None and not proc.is_alive():
+                raise RuntimeError("DEEPaaS exited with %s" % proc.exitcode)
+            try:
+                async with s.get(url + "/readyz") as resp:
+                    if resp.status == 200:
+                        return
+                if resp.status == 404:
+                    # Older versions, without the readiness endpoint
+                    async with s.get(url + "/v2/models/") as resp:
+                        if resp.status == 200:
+                            return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise RuntimeError("DEEPaaS is not ready after %s seconds" % timeout)
+
+
+def _get_connector():
+    if CONF.listen_socket and not CONF.url:
+        return aiohttp.UnixConnector(path=CONF.listen_socket, limit=CONF.concurrency)
+    return aiohttp.TCPConnector(limit=CONF.concurrency)
+
+
+async def _bench(url, proc):
+    connector = _get_connector()
+    await _wait_ready(url, connector, proc)
+    bench = Benchmark(
+        url,
+        endpoint=CONF.endpoint,
+        input_size=CONF.input_size,
+        connector=connector,
+    )
+    duration = await bench.run(
+        CONF.duration,
+        warmup=CONF.warmup,
+        concurrency=CONF.concurrency,
+        rate=CONF.rate,
+    )
+    return get_report(bench, duration)
+
+
+def main():
+    config.setup(sys.argv)
+
+    proc = None
+    url = CONF.url
+    if not url:
+        if CONF.listen_socket:
+            url = "http://localhost"
+        else:
+            url = "http://%s:%s" % (CONF.listen_ip, CONF.listen_port)
+        # The server must not share anything with the load generator
+        ctx = multiprocessing.get_context("spawn")
+        proc = ctx.Process(target=_run_server, args=(sys.argv[1:], _get_model_params()))
+        proc.start()
+
+    try:
+        report = asyncio.run(_bench(url, proc))
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.join(30)
+            if proc.is_alive():
+                proc.kill()
+
+    report.update(
+        deepaas_version=deepaas.extract_version(),
+        url=CONF.url or None,
+        endpoint=CONF.endpoint,
+        concurrency=CONF.concurrency,
+        rate=CONF.rate or None,
+        input_size=CONF.input_size,
+        model=_get_model_params(),
+        server={"workers": CONF.workers, "http_workers": CONF.http_workers},
+    )
+    print_report(report)
+    if CONF.output:
+        with open(CONF.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print("\nResults written to %s" % CONF.output)
+
+    if report["errors"]:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -20,6 +20,7 @@
 import argparse
 import ast
 import deepaas
+import functools
 import json
 import mimetypes
 import multiprocessing as mp
@@ -27,22 +28,34 @@ import os
 import re
 import shutil
 import sys
-import tempfile
 import uuid
 
 from datetime import datetime
-from marshmallow import fields
 from oslo_config import cfg
 
+from deepaas.cmd import _daemon
+from deepaas.cmd import _shutdown
+from deepaas.cmd import _staging
 from deepaas import config
 from deepaas import log
-from deepaas.model import loading
-from deepaas.model.v2 import wrapper as v2_wrapper
+
+# NOTE: Every CLI invocation (including "--help") pays for the imports done
+# here, so heavy modules (i.e. the model itself, marshmallow, aiohttp or
+# stevedore) are only imported when the selected method needs them. The list
+# of modules that must not be imported is checked in the tests.
 
 CONF = config.CONF
 
 debug_cli = False
 
+METHODS = ("get_metadata", "warm", "predict", "train")
+
+# Default time (in seconds) to wait for the daemon to run an invocation
+DAEMON_TIMEOUT = 3600
+
+# Command line being parsed, it is not always sys.argv (see _daemon)
+_ARGV = sys.argv[1:]
+
 # Not all types are covered! If not listed, the type is 'str'
 # see https://marshmallow.readthedocs.io/en/stable/marshmallow.fields.html
 
@@ -58,25 +71,36 @@ def str2bool(v):
     return v.lower() in ("yes", "true", "t", "1")
 
 
-FIELD_TYPE_CONVERTERS = {
-    fields.Bool: str2bool,
-    fields.Boolean: str2bool,
-    fields.Date: str,
-    fields.DateTime: str,
-    fields.Dict: ast.literal_eval,
-    fields.Email: str,
-    fields.Float: float,
-    fields.Int: int,
-    fields.Integer: int,
-    fields.List: ast.literal_eval,
-    fields.Str: str,
-    fields.String: str,
-    fields.Time: str,
-    fields.URL: str,
-    fields.Url: str,
-    fields.UUID: str,
-    fields.Field: str,
-}
+@functools.lru_cache(maxsize=None)
+def _get_field_type_converters():
+    from marshmallow import fields
+
+    return {
+        fields.Bool: str2bool,
+        fields.Boolean: str2bool,
+        fields.Date: str,
+        fields.DateTime: str,
+        fields.Dict: ast.literal_eval,
+        fields.Email: str,
+        fields.Float: float,
+        fields.Int: int,
+        fields.Integer: int,
+        fields.List: ast.literal_eval,
+        fields.Str: str,
+        fields.String: str,
+        fields.Time: str,
+        fields.URL: str,
+        fields.Url: str,
+        fields.UUID: str,
+        fields.Field: str,
+    }
+
+
+def __getattr__(name):
+    # Keep FIELD_TYPE_CONVERTERS available without importing marshmallow
+    if name == "FIELD_TYPE_CONVERTERS":
+        return _get_field_type_converters()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
 
 
 # Helper function to get subdictionary from dict_one based on keys in dict_two
@@ -97,6 +121,9 @@ def _fields_to_dict(fields_in):
     :return: python dictionary
 
     """
+    from marshmallow import fields
+
+    converters = _get_field_type_converters()
     dict_out = {}
 
     for key, val in fields_in.items():
@@ -113,8 +140,8 @@ def _fields_to_dict(fields_in):
 
         # Infer "type"
         val_type = type(val)
-        if val_type in FIELD_TYPE_CONVERTERS:
-            param["type"] = FIELD_TYPE_CONVERTERS[val_type]
+        if val_type in converters:
+            param["type"] = converters[val_type]
 
         if val_type is fields.List:
             val_help += '\nType: list, enclosed as string: "[...]"'
@@ -154,37 +181,39 @@ def _get_model_name(model_name=None):
     :param model_name: name of the model
     :return: model object
     """
+    from deepaas.model import loading
 
-    models = loading.get_available_models("v2")
+    model_names = loading.get_available_model_names("v2")
     if model_name:
-        model_obj = models.get(model_name)
-        if model_obj is None:
+        if model_name not in model_names:
             sys.stderr.write(
                 "[ERROR]: The model {} is not available.\n"
-                "Available models: {}\n".format(model_name, list(models.keys()))
+                "Available models: {}\n".format(model_name, sorted(model_names))
             )
             sys.exit(1)
 
-        return model_name, model_obj
-
-    elif len(models) == 1:
-        return models.popitem()
+    elif len(model_names) == 1:
+        (model_name,) = model_names
 
     else:
         sys.stderr.write(
             "[ERROR]: There are several models available ({}).\n"
             "You have to choose one and set it in the DEEPAAS_V2_MODEL "
             "environment variable or using the --mode-name option"
-            ".\n".format(list(models.keys()))
+            ".\n".format(sorted(model_names))
         )
         sys.exit(1)
 
+    return model_name, loading.get_model_by_name(model_name, "v2")
+
 
 def _get_file_args(fields_in):
     """Function to retrieve a list of file-type fields
     :param fields_in: mashmallow fields
     :return: list
     """
+    from marshmallow import fields
+
     file_fields = []
     for k, v in fields_in.items():
         if type(v) is fields.Field:
@@ -192,24 +221,97 @@ def _get_file_args(fields_in):
     return file_fields
 
 
-# Get the model name
-model_name = CONF.model_name
+def _peek_argv(argv):
+    """Get the model name and the method requested in the command line.
 
-model_name, model_obj = _get_model_name(model_name)
+    We need them before the command line is actually parsed (i.e. when the
+    method subparsers are being built) so that we only load the model and
+    build the arguments for the requested method.
 
-# use deepaas.model.v2.wrapper.ModelWrapper(). deepaas>1.2.1dev4
-# model_obj = v2_wrapper.ModelWrapper(name=model_name,
-#                                    model_obj=model_obj)
-
-# Once we know the model name,
-# we get arguments for predict and train as dictionaries
-predict_args = _fields_to_dict(model_obj.get_predict_args())
-train_args = _fields_to_dict(model_obj.get_train_args())
-
-# Find which of the arguments are going to be files
-file_args = {}
-file_args["predict"] = _get_file_args(model_obj.get_predict_args())
-file_args["train"] = _get_file_args(model_obj.get_train_args())
+    :return: a tuple with the model name and method (or None)
+    """
+    # The method is the first positional argument, skipping the values of
+    # the options that precede it
+    value_opts = _get_value_options()
+    method = None
+    end = len(argv)
+    args = iter(enumerate(argv))
+    for i, arg in args:
+        if arg == "--" or not arg.startswith("-"):
+            end = i
+            if arg in METHODS:
+                method = arg
+            break
+        if arg in value_opts:
+            next(args, None)
+
+    parser = argparse.ArgumentParser(add_help=False)
+    parser.add_argument("--model-name", "--model_name", default=CONF.model_name)
+    args, _ = parser.parse_known_args(argv[:end])
+    return args.model_name, method
+
+
+def _get_value_options():
+    """Get the global options that take a value (i.e. that are not flags)."""
+    # Registered by oslo.config when the command line is parsed
+    names = {"--config-file", "--config-dir"}
+    for opt, _ in CONF._all_cli_opts():
+        if isinstance(opt, (cfg.BoolOpt, cfg.SubCommandOpt)):
+            continue
+        names.update(("--" + opt.dest, "--" + opt.dest.replace("_", "-")))
+        if opt.short:
+            names.add("-" + opt.short)
+    return names
+
+
+def _get_daemon_options(argv):
+    """Get the daemon socket path and timeout requested in the command line."""
+    parser = argparse.ArgumentParser(add_help=False, allow_abbrev=False)
+    parser.add_argument("--deepaas_daemon_socket")
+    parser.add_argument("--deepaas_daemon_timeout", type=float, default=DAEMON_TIMEOUT)
+    args, _ = parser.parse_known_args(argv)
+    path = args.deepaas_daemon_socket
+    if not path:
+        path = _daemon.get_socket_path(_peek_argv(argv)[0])
+    return path, args.deepaas_daemon_timeout or None
+
+
+def _is_daemon(argv):
+    """Check if the command line asks to start the daemon.
+
+    The options are checked as oslo.config would parse them (the last one
+    wins), also accepting an explicit value (``--deepaas_daemon=true``).
+    """
+    daemon = False
+    for arg in argv:
+        if arg == "--":
+            break
+        name, sep, value = arg.partition("=")
+        if name == "--deepaas_daemon":
+            daemon = not sep or value.lower() in ("true", "1", "yes", "on")
+        elif name == "--nodeepaas_daemon":
+            daemon = False
+    return daemon
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model(model_name=None):
+    """Load the model, only once."""
+    return _get_model_name(model_name)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_method_args(model_name, method):
+    """Get the arguments (and which of them are files) for a model method."""
+    if method not in ("predict", "train"):
+        return {}, []
+
+    _, model_obj = _get_model(model_name)
+    if method == "predict":
+        fields_in = model_obj.get_predict_args()
+    else:
+        fields_in = model_obj.get_train_args()
+    return _fields_to_dict(fields_in), _get_file_args(fields_in)
 
 
 # Function to add later these arguments to CONF via SubCommandOpt
@@ -217,6 +319,8 @@ def _add_methods(subparsers):
     """Function to add argparse subparsers via SubCommandOpt (see below)
     for DEEPaaS methods get_metadata, warm, predict, train
     """
+    # Only the requested method needs the model arguments
+    model_name, method = _peek_argv(_ARGV)
 
     # Use RawTextHelpFormatter to allow for line breaks in argparse help messages.
     def help_formatter(prog):
@@ -244,14 +348,6 @@ def _add_methods(subparsers):
         formatter_class=help_formatter,
     )
 
-    for key, val in predict_args.items():
-        predict_parser.add_argument(
-            "--%s" % key,
-            default=val["default"],
-            type=val["type"],
-            help=val["help"],
-            required=val["required"],
-        )
     # get train arguments configured
     train_parser = subparsers.add_parser(
         "train",
@@ -259,13 +355,21 @@ def _add_methods(subparsers):
         formatter_class=help_formatter,
     )
 
-    for key, val in train_args.items():
-        train_parser.add_argument(
+    parsers = {"predict": predict_parser, "train": train_parser}
+    if method not in parsers:
+        return
+
+    # In bulk mode the arguments can also come from the inputs
+    bulk = any(arg.startswith("--deepaas_bulk_input") for arg in _ARGV)
+
+    method_args, _ = _get_method_args(model_name, method)
+    for key, val in method_args.items():
+        parsers[method].add_argument(
             "--%s" % key,
             default=val["default"],
             type=val["type"],
             help=val["help"],
-            required=val["required"],
+            required=val["required"] and not bulk,
         )
 
 
@@ -281,6 +385,65 @@ cli_opts = [
         default=True,
         help="Activate multiprocessing; default is True",
     ),
+    cfg.BoolOpt(
+        "deepaas_daemon",
+        default=False,
+        help="Run as a daemon that keeps the (warmed) model loaded and "
+        "listens on a Unix socket (see --deepaas_daemon_socket). Later "
+        "invocations of deepaas-cli for the same model are forwarded to it; "
+        "default is False",
+    ),
+    cfg.StrOpt(
+        "deepaas_daemon_socket",
+        help="Path of the Unix socket of the daemon. Defaults to a socket "
+        "for the model in $XDG_RUNTIME_DIR or, if it is not set, in a private "
+        "directory of the user in the temporary directory",
+    ),
+    cfg.FloatOpt(
+        "deepaas_daemon_timeout",
+        default=DAEMON_TIMEOUT,
+        min=0,
+        help="Maximum time (in seconds) to wait for the daemon to run a "
+        "forwarded invocation, 0 means no limit; default is 3600",
+    ),
+    cfg.StrOpt(
+        "deepaas_input_staging",
+        default="copy",
+        choices=["copy", "link", "reference"],
+        help="How input files are given to the model: 'copy' (a reflink or "
+        "kernel side copy when the file system supports it), 'link' (a hard "
+        "link, falling back to a copy; the link shares its data with the "
+        "original, so use it only if the model does not modify its inputs in "
+        "place) or 'reference' (the original file, use it only if the model "
+        "does not modify or delete its inputs); default is 'copy'",
+    ),
+    cfg.StrOpt(
+        "deepaas_bulk_input",
+        help="Run the predict method for several inputs (bulk inference): a "
+        "glob, a directory (all its files, recursively) or a manifest file "
+        "(.csv or .jsonl) with one set of predict arguments per row. The "
+        "outputs are written to --deepaas_method_output, either one file per "
+        "input (if it is a directory) or one line per input (if it is a "
+        ".jsonl file)",
+    ),
+    cfg.StrOpt(
+        "deepaas_bulk_argument",
+        help="Predict argument that gets each of the bulk input files, only "
+        "needed if predict has more than one file argument",
+    ),
+    cfg.IntOpt(
+        "deepaas_bulk_workers",
+        default=1,
+        min=1,
+        help="Number of worker processes for bulk inference, each of them "
+        "loads the model once; default is 1",
+    ),
+    cfg.StrOpt(
+        "deepaas_bulk_checkpoint",
+        help="File where the inputs already processed in a bulk run are "
+        "recorded, so that an interrupted run is resumed when launched again. "
+        "Defaults to the output path with a .checkpoint suffix",
+    ),
     cfg.SubCommandOpt(
         "methods",
         title="methods",
@@ -295,7 +458,7 @@ cli_opts = [
 CONF = cfg.CONF
 CONF.register_cli_opts(cli_opts)
 
-LOG = log.get_logger(__name__)
+LOG = log.getLogger(__name__)
 
 
 # store DEEPAAS_METHOD output in a file
@@ -316,16 +479,83 @@ def _store_output(results, out_file):
     LOG.info("[INFO, Output] Output is saved in {}".format(out_file))
 
 
-# async def main():
-def main():
+def _run_bulk(model_name, model_obj, method_args, file_args, conf_vars):
+    """Run the predict method over all the inputs of a bulk run."""
+    from deepaas.cmd import _bulk
+
+    if not CONF.deepaas_method_output:
+        sys.stderr.write(
+            "[ERROR]: Bulk inference needs --deepaas_method_output, either a "
+            "directory or a .jsonl file.\n"
+        )
+        sys.exit(1)
+
+    try:
+        inputs = _bulk.get_inputs(
+            CONF.deepaas_bulk_input,
+            method_args,
+            file_args,
+            file_arg=CONF.deepaas_bulk_argument,
+        )
+        common_args = _get_subdict(conf_vars, method_args)
+        _bulk.check_inputs(inputs, method_args, common_args)
+    except _bulk.BulkError as e:
+        sys.stderr.write("[ERROR]: {}\n".format(e))
+        sys.exit(1)
+
+    workers = CONF.deepaas_bulk_workers
+    if not CONF.deepaas_with_multiprocessing:
+        workers = 1
+
+    ret = _bulk.run(
+        model_name,
+        model_obj,
+        inputs,
+        CONF.deepaas_method_output,
+        common_args,
+        file_args,
+        checkpoint=CONF.deepaas_bulk_checkpoint,
+        workers=workers,
+        accept=getattr(CONF.methods, "accept", None),
+        warm=CONF.warm,
+        staging=CONF.deepaas_input_staging,
+    )
+    return json.dumps(ret)
+
+
+def _serve():
+    """Keep the model loaded, running the methods requested by clients."""
+    model_name, model_obj = _get_model(CONF.model_name)
+    if CONF.warm:
+        model_obj.warm()
+
+    _shutdown.handle_signals()
+    try:
+        path = CONF.deepaas_daemon_socket or _daemon.get_socket_path(CONF.model_name)
+        _daemon.serve(path, _run_method)
+    except RuntimeError as e:
+        sys.stderr.write("[ERROR]: {}\n".format(e))
+        sys.exit(1)
+
+
+def _run_method(argv):
     """Executes model's methods with corresponding parameters"""
+    global _ARGV
+    _ARGV = argv
 
     # we may add deepaas config, but then too many options...
     # config.setup(sys.argv)
 
-    CONF(sys.argv[1:], project="deepaas", version=deepaas.extract_version())
+    CONF(argv, project="deepaas", version=deepaas.extract_version())
+
+    if CONF.deepaas_daemon:
+        return _serve()
 
-    LOG.info("[INFO, Method] {} was called.".format(CONF.methods.name))
+    method = CONF.methods.name
+    LOG.info("[INFO, Method] {} was called.".format(method))
+
+    model_name, model_obj = _get_model(_peek_argv(argv)[0])
+    method_args, file_args = _get_method_args(model_name, method)
 
     # put all variables in dict, makes life easier...
     conf_vars = vars(CONF._namespace)
@@ -333,36 +563,21 @@ def main():
     if CONF.deepaas_with_multiprocessing:
         mp.set_start_method("spawn", force=True)
 
+    if method == "predict" and CONF.deepaas_bulk_input:
+        return _run_bulk(model_name, model_obj, method_args, file_args, conf_vars)
+
     # Create file wrapper for file args (if provided)
-    for farg in file_args[CONF.methods.name]:
+    for farg in file_args:
         if getattr(CONF.methods, farg, None):
-            fpath = conf_vars[farg]
-
-            # create tmp file as later it supposed
-            # to be deleted by the application
-            temp = tempfile.NamedTemporaryFile()
-            temp.close()
-            # copy original file into tmp file
-            with open(fpath, "rb") as f:
-                with open(temp.name, "wb") as f_tmp:
-                    for line in f:
-                        f_tmp.write(line)
-
-            # create file object
-            file_type = mimetypes.MimeTypes().guess_type(fpath)[0]
-            file_obj = v2_wrapper.UploadedFile(
-                name="data",
-                filename=temp.name,
-                content_type=file_type,
-                original_filename=fpath,
-            )
             # re-write parameter in conf_vars
-            conf_vars[farg] = file_obj
+            conf_vars[farg] = _staging.stage_file(
+                conf_vars[farg], CONF.deepaas_input_staging
+            )
 
     # debug of input parameters
     LOG.debug("[DEBUG provided options, conf_vars]: {}".format(conf_vars))
 
-    if CONF.methods.name == "get_metadata":
+    if method == "get_metadata":
         meta = model_obj.get_metadata()
         meta_json = json.dumps(meta)
         LOG.debug("[DEBUG, get_metadata, Output]: {}".format(meta_json))
@@ -371,14 +586,14 @@ def main():
 
         return meta_json
 
-    elif CONF.methods.name == "warm":
+    elif method == "warm":
         # await model_obj.warm()
         model_obj.warm()
         LOG.info("[INFO, warm] Finished warm() method")
 
-    elif CONF.methods.name == "predict":
+    elif method == "predict":
         # call predict method
-        predict_vars = _get_subdict(conf_vars, predict_args)
+        predict_vars = _get_subdict(conf_vars, method_args)
         task = model_obj.predict(**predict_vars)
 
         if CONF.deepaas_method_output:
@@ -403,7 +618,7 @@ def main():
                 and extension != out_extension
             ):  # noqa: W503
                 out_file = out_file + extension
-                LOG.warn(
+                LOG.warning(
                     "[WARNING] You are trying to store {} "
                     "type data in the file "
                     "with {} extension!\n"
@@ -424,8 +639,8 @@ def main():
 
         return task
 
-    elif CONF.methods.name == "train":
-        train_vars = _get_subdict(conf_vars, train_args)
+    elif method == "train":
+        train_vars = _get_subdict(conf_vars, method_args)
         # structure of ret{} copied from api.v2.train.build_train_response !!!
         # so far, one needs to sync manually the structures
         start = datetime.now()
@@ -450,7 +665,7 @@ def main():
         return results_json
 
     else:
-        LOG.warn("[WARNING] No Method was requested! Return get_metadata()")
+        LOG.warning("[WARNING] No Method was requested! Return get_metadata()")
         meta = model_obj.get_metadata()
         meta_json = json.dumps(meta)
         LOG.debug("[DEBUG, get_metadata, Output]: {}".format(meta_json))
@@ -458,6 +673,25 @@ def main():
         return meta_json
 
 
+# async def main():
+def main():
+    """Executes model's methods, in a running daemon if there is one."""
+    argv = sys.argv[1:]
+    if not _is_daemon(argv):
+        try:
+            path, timeout = _get_daemon_options(argv)
+            response = _daemon.forward(path, argv, timeout=timeout)
+        except RuntimeError as e:
+            LOG.warning("Not using a daemon: %s", e)
+            response = None
+        except TimeoutError as e:
+            sys.stderr.write("[ERROR]: {}\n".format(e))
+            sys.exit(1)
+        if response is not None:
+            return _daemon.replay(response)
+    return _run_method(argv)
+
+
 if __name__ == "__main__":
     # loop = asyncio.get_event_loop()
     # loop.run_until_complete(main())
@@ -15,17 +15,26 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
-import pathlib
+import asyncio
+import contextlib
+import multiprocessing
+import multiprocessing.connection
+import os
+import socket
+import stat
 import sys
+import urllib.parse
 
 from aiohttp import web
 from oslo_config import cfg
 
 import deepaas
 from deepaas import api
+from deepaas.api import spec
 import deepaas.log
 from deepaas.cmd import _shutdown
 from deepaas import config
+from deepaas import profiling
 
 cli_opts = [
     cfg.StrOpt(
@@ -48,15 +57,66 @@ The DEEPaaS API service listens on this port number for incoming
 requests.
 """,
     ),
-    # Allow to define base path for the API
     cfg.StrOpt(
-        "base-path",
+        "listen-socket",
         default="",
         help="""
-Base path for the API. This is useful when the API is served behind a
-reverse proxy that is not at the root of the domain. For example, if
-the API is served at https://example.com/deepaas, then the base path
-should be set to /deepaas. Defaults to the root of the domain.
+Path of a Unix domain socket on which the DEEPaaS API will listen, instead of
+the "listen-ip" and "listen-port" options. Use it when DEEPaaS is behind a
+local reverse proxy (e.g. nginx or envoy), to avoid the TCP overhead. The
+socket is created with the permissions given by the umask of the process.
+""",
+    ),
+    cfg.IntOpt(
+        "backlog",
+        default=128,
+        min=1,
+        help="""
+Maximum number of pending connections that the listening socket can queue.
+""",
+    ),
+    cfg.FloatOpt(
+        "keepalive-timeout",
+        default=75.0,
+        min=0,
+        help="""
+Seconds that an idle connection is kept open, waiting for another request.
+Set it above the idle timeout of the reverse proxy in front of DEEPaaS, if
+any, so that its connections are reused.
+""",
+    ),
+    cfg.BoolOpt(
+        "access-log",
+        default=True,
+        help="""
+Log every request received (default: True). Disable it if the reverse proxy in
+front of DEEPaaS already logs them, to save the logging overhead.
+""",
+    ),
+    cfg.IntOpt(
+        "http-workers",
+        default=1,
+        min=1,
+        help="""
+Number of HTTP front-end processes. They share the listening port (using
+SO_REUSEPORT), so that parsing, validation and serialization of the requests
+scale with the number of cores. The model workers (see the "workers" option)
+are split among the front-end processes, so there must be at least as many
+model workers as front-end processes. Each front-end process keeps its own
+state: the trainings that it started (and their queue), the rate limits and
+concurrency caps of the clients and the readiness of its workers. Therefore,
+you should disable the train endpoint if you use more than one, and the rate
+limits apply to each of them separately.
+""",
+    ),
+    cfg.StrOpt(
+        "dump-spec",
+        default="",
+        help="""
+Generate the OpenAPI (Swagger) specification of the API, write it to this file
+and exit, without serving the API. Use it (e.g. when building a container
+image) together with the "spec-file" option, so that the specification is not
+generated at every startup.
 """,
     ),
 ]
@@ -87,43 +147,165 @@ or you can use any of our endpoints.
 """
 
 
+async def _dump_spec(path, **kwargs):
+    """Generate the API specification and write it to a file."""
+    # The models do not need to be warmed, and the specification must be
+    # generated even if there is one stored
+    CONF.set_override("warm", False)
+    CONF.set_override("spec_file", "")
+
+    app = await api.get_app(**kwargs)
+    try:
+        spec.dump(app["swagger_dict"], path)
+    finally:
+        # Stop the model workers
+        app.freeze()
+        await app.cleanup()
+
+
+def _get_workers_share(workers, http_workers, index):
+    """Get the model workers of a front-end process."""
+    return workers // http_workers + (1 if index < workers % http_workers else 0)
+
+
+def _bind_unix_socket(path, backlog):
+    """Create a listening Unix domain socket."""
+    # Remove the socket left behind by a previous run, but nothing else
+    with contextlib.suppress(FileNotFoundError):
+        if stat.S_ISSOCK(os.stat(path).st_mode):
+            os.unlink(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.bind(path)
+    sock.listen(backlog)
+    return sock
+
+
+def _get_listen_kwargs(reuse_port=False):
+    """Get the arguments of web.run_app that define where to listen."""
+    if CONF.listen_socket:
+        return {"sock": _bind_unix_socket(CONF.listen_socket, CONF.backlog)}
+    kwargs = {"host": CONF.listen_ip, "port": CONF.listen_port}
+    if reuse_port:
+        kwargs["reuse_port"] = True
+    return kwargs
+
+
+def _serve(app_kwargs, **kwargs):
+    app = api.get_app(**app_kwargs)
+    if not CONF.access_log:
+        kwargs["access_log"] = None
+    web.run_app(
+        app,
+        backlog=CONF.backlog,
+        keepalive_timeout=CONF.keepalive_timeout,
+        **kwargs,
+    )
+
+
+def _serve_front_end(index, app_kwargs, listen_kwargs):
+    """Serve the API in a front-end process."""
+    workers = _get_workers_share(CONF.workers, CONF.http_workers, index)
+    CONF.set_override("workers", workers)
+    deepaas.log.LOG.info("Starting HTTP front-end %s with %s workers", index, workers)
+    _serve(app_kwargs, print=print if index == 0 else None, **listen_kwargs)
+
+
+def _run_front_ends(app_kwargs):
+    """Run the front-end processes, until one of them exits."""
+    # TCP sockets are bound by each front-end (with SO_REUSEPORT), but Unix
+    # sockets cannot be shared that way, so it is bound here and inherited
+    listen_kwargs = _get_listen_kwargs(reuse_port=True)
+
+    # Nothing has been loaded yet, so it is safe (and faster) to fork
+    ctx = multiprocessing.get_context("fork")
+    procs = [
+        ctx.Process(target=_serve_front_end, args=(i, app_kwargs, listen_kwargs))
+        for i in range(CONF.http_workers)
+    ]
+    for p in procs:
+        p.start()
+
+    try:
+        multiprocessing.connection.wait([p.sentinel for p in procs])
+    finally:
+        for p in procs:
+            if p.is_alive():
+                p.terminate()
+        for p in procs:
+            p.join()
+
+    exitcode = max(abs(p.exitcode or 0) for p in procs)
+    if exitcode:
+        sys.exit(exitcode)
+
+
 def main():
     _shutdown.handle_signals()
 
     config.setup(sys.argv)
     log = deepaas.log.LOG
 
-    base_path = CONF.base_path
+    try:
+        base_path = api.normalize_base_path(CONF.base_path)
+    except ValueError as e:
+        print(e, file=sys.stderr)
+        sys.exit(1)
 
-    if base_path and not base_path.startswith("/"):
-        print("Base path should start with a '/'.", file=sys.stderr)
+    app_kwargs = dict(
+        enable_doc=CONF.doc_endpoint,
+        enable_train=CONF.train_endpoint,
+        enable_predict=CONF.predict_endpoint,
+        base_path=base_path,
+    )
+
+    if CONF.dump_spec:
+        asyncio.run(_dump_spec(CONF.dump_spec, **app_kwargs))
+        return
+
+    if CONF.http_workers > CONF.workers:
+        # Each front-end would load its own copy of the model
+        print(
+            "There must be at least as many workers ({}) as HTTP workers "
+            "({}).".format(CONF.workers, CONF.http_workers),
+            file=sys.stderr,
+        )
         sys.exit(1)
-    elif base_path:
-        base_path = str(pathlib.Path(base_path))
-    else:
-        base_path = ""
 
-    base = "http://{}:{}{}".format(CONF.listen_ip, CONF.listen_port, base_path)
-    spec = "{}/swagger.json".format(base)
+    if CONF.listen_socket:
+        base = "http+unix://{}{}".format(
+            urllib.parse.quote(CONF.listen_socket, safe=""), base_path
+        )
+    else:
+        base = "http://{}:{}{}".format(CONF.listen_ip, CONF.listen_port, base_path)
+    spec_url = "{}/swagger.json".format(base)
     docs = "{}/api".format(base)
     v2 = "{}/v2".format(base)
 
     print(INTRO)
-    print(BANNER.format(docs, spec, v2))
+    print(BANNER.format(docs, spec_url, v2))
 
     log.info("Starting DEEPaaS version %s", deepaas.extract_version())
 
-    app = api.get_app(
-        enable_doc=CONF.doc_endpoint,
-        enable_train=CONF.train_endpoint,
-        enable_predict=CONF.predict_endpoint,
-        base_path=CONF.base_path,
-    )
-    web.run_app(
-        app,
-        host=CONF.listen_ip,
-        port=CONF.listen_port,
-    )
+    if CONF.profile_requests:
+        # Create the directory before forking the front-ends, so that they
+        # all store the profiles in the same one
+        profiling.get_profile_dir()
+
+    try:
+        if CONF.http_workers > 1:
+            if CONF.train_endpoint:
+                log.warning(
+                    "Running %s HTTP front-ends with the train endpoint enabled, "
+                    "each training is only known by the front-end that started it",
+                    CONF.http_workers,
+                )
+            _run_front_ends(app_kwargs)
+        else:
+            _serve(app_kwargs, **_get_listen_kwargs())
+    finally:
+        if CONF.listen_socket:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(CONF.listen_socket)
 
 
 if __name__ == "__main__":
@@ -21,6 +21,7 @@ from oslo_config import cfg
 
 import deepaas
 from deepaas import log
+from deepaas import startup
 
 warnings.simplefilter("default", DeprecationWarning)
 
@@ -47,6 +48,76 @@ Enable debug endpoint. If set we will provide all the information that you
 print to the standard output and error (i.e. stdout and stderr) through the
 "/debug" endpoint. Default is to not provide this information. This will not
 provide logging information about the API itself.
+""",
+    ),
+    cfg.StrOpt(
+        "startup-profile",
+        default="",
+        help="""
+Profile (with cProfile) the import of the models during the startup, and write
+the profile to this file once DEEPaaS is ready. It can be inspected with the
+Python "pstats" module or with tools like "snakeviz". The timing of all the
+startup phases is always logged and provided through the "/debug/startup"
+endpoint.
+""",
+    ),
+    cfg.BoolOpt(
+        "profile-requests",
+        default=False,
+        help="""
+Allow the clients to profile (with cProfile) a prediction, by sending the
+"X-Profile: 1" header. The model's predict method is profiled in the worker
+that runs it, and the profile is stored (as a pstats file and as collapsed
+stacks for flame graphs) under the ID returned in the "X-Profile-Id" header,
+to be downloaded from the "/debug/profiles" endpoint. Profiling slows down the
+request, only enable it in trusted environments.
+""",
+    ),
+    cfg.StrOpt(
+        "profile-dir",
+        default="",
+        help="""
+Directory where the profiles of the requests are stored (see the
+"profile-requests" option). Defaults to a new temporary directory.
+""",
+    ),
+    cfg.StrOpt(
+        "trace-exporter",
+        default="none",
+        choices=["none", "jsonl", "otlp"],
+        help="""
+Trace the requests, recording a span for each of their phases (including the
+execution in the model workers, where the model can add its own spans), and
+export the spans to a JSON lines file ("jsonl", see "trace-file") or to an
+OpenTelemetry collector ("otlp", see "trace-otlp-endpoint"). The trace
+context is taken from the W3C "traceparent" header of the requests.
+""",
+    ),
+    cfg.StrOpt(
+        "trace-file",
+        default="deepaas-traces.jsonl",
+        help="""
+File where the spans are appended, one JSON object per line, when using the
+"jsonl" trace exporter.
+""",
+    ),
+    cfg.URIOpt(
+        "trace-otlp-endpoint",
+        default="http://localhost:4318/v1/traces",
+        schemes=["http", "https"],
+        help="""
+URL (http or https) of the OpenTelemetry collector (OTLP over HTTP, JSON
+encoded) where the spans are sent, when using the "otlp" trace exporter.
+""",
+    ),
+    cfg.StrOpt(
+        "spec-file",
+        default="",
+        help="""
+File where the OpenAPI (Swagger) specification of the API is stored. If it
+exists, and it was generated for the same DEEPaaS and model versions, it is
+loaded at startup instead of being generated again. Otherwise it is generated
+and written to this file. See also the "deepaas-run --dump-spec" option.
 """,
     ),
     cfg.BoolOpt(
@@ -55,6 +126,17 @@ provide logging information about the API itself.
         help="""
 Enable documentation endpoint. If set we will provide the documentation
 through the "/api" endpoint. Default is to provide this information.
+""",
+    ),
+    # Allow to define base path for the API
+    cfg.StrOpt(
+        "base-path",
+        default="",
+        help="""
+Base path for the API. This is useful when the API is served behind a
+reverse proxy that is not at the root of the domain. For example, if
+the API is served at https://example.com/deepaas, then the base path
+should be set to /deepaas. Defaults to the root of the domain.
 """,
     ),
     cfg.IntOpt(
@@ -65,6 +147,28 @@ through the "/api" endpoint. Default is to provide this information.
 Specify the number of workers to spawn. If using a CPU you probably want to
 increase this number, if using a GPU probably you want to leave it to 1.
 (defaults to 1)
+""",
+    ),
+    cfg.BoolOpt(
+        "fork-workers",
+        default=False,
+        help="""
+Fork the workers from a template process where the model has already been
+imported and warmed, instead of spawning them, so that they share the memory
+of the model (e.g. its weights) copy-on-write, instead of loading a copy
+each. Only use it with CPU-only models, as CUDA and some frameworks (e.g.
+TensorFlow) do not support being used from forked processes.
+""",
+    ),
+    cfg.IntOpt(
+        "predict-retries",
+        default=0,
+        min=0,
+        help="""
+Number of times that a prediction is retried, on another worker, if the worker
+executing it dies (e.g. it crashes or it is killed by the OOM killer). Only
+set it if the predictions of the model are idempotent, as a prediction that
+kills its worker is executed again (defaults to 0, not retried).
 """,
     ),
     cfg.IntOpt(
@@ -75,6 +179,112 @@ increase this number, if using a GPU probably you want to leave it to 1.
 Client’s maximum size in a request, in bytes. If a POST request exceeds this
 value, it raises an HTTPRequestEntityTooLarge exception. If set to 0, no
 file size limit will be enforced.
+""",
+    ),
+    cfg.BoolOpt(
+        "compress-responses",
+        default=True,
+        help="""
+Compress the responses (e.g. predictions) with zstd, brotli or gzip, depending
+on what the client accepts (zstd and brotli are only used if their Python
+modules are installed). Compressed request bodies are always accepted.
+""",
+    ),
+    cfg.IntOpt(
+        "compression-min-size",
+        default=1024,
+        min=0,
+        help="""
+Minimum size, in bytes, of the responses that are compressed (see
+"compress-responses"). Smaller responses are not worth compressing.
+""",
+    ),
+    cfg.FloatOpt(
+        "rate-limit",
+        default=0,
+        min=0,
+        help="""
+Maximum rate (in requests per second) of the predict and train requests of
+each client, enforced with a token bucket (see "rate-limit-burst"). Clients
+are identified by the "client-id-header" header, or by their address.
+Requests over the limit are rejected with a 429 status code and a
+"Retry-After" header. Defaults to 0, i.e. no limit.
+""",
+    ),
+    cfg.IntOpt(
+        "rate-limit-burst",
+        default=10,
+        min=1,
+        help="""
+Maximum number of predict and train requests that a client can make at once,
+above the "rate-limit" rate, i.e. the size of its token bucket.
+""",
+    ),
+    cfg.IntOpt(
+        "client-max-concurrency",
+        default=0,
+        min=0,
+        help="""
+Maximum number of predict and train requests of each client that are served
+at the same time. Requests over the limit are rejected with a 429 status code
+and a "Retry-After" header. Trainings are only counted while their request is
+being served, not while they run in the background. Defaults to 0, i.e. no
+limit.
+""",
+    ),
+    cfg.StrOpt(
+        "client-id-header",
+        default="",
+        help="""
+Header that identifies the clients for the rate limits (e.g. "X-API-Key"). If
+not set, or missing in a request, the client is identified by its address. As
+clients can send any value, only use it if a trusted proxy sets (or validates)
+this header, or limit the IDs of each address with
+"client-max-ids-per-address".
+""",
+    ),
+    cfg.IntOpt(
+        "client-max-ids-per-address",
+        default=0,
+        min=0,
+        help="""
+Maximum number of different "client-id-header" IDs that are limited separately
+for each address at the same time. The requests with other IDs from the same
+address are limited together, as the address. Do not use it if the requests
+come through a proxy, as they all have its address. Defaults to 0, i.e. no
+limit.
+""",
+    ),
+    cfg.IntOpt(
+        "readiness-max-queue",
+        default=0,
+        min=0,
+        help="""
+Maximum number of requests waiting for a free worker of a model. If exceeded,
+the "/readyz" endpoint reports that DEEPaaS is saturated (with a 503 status
+code), so that orchestrators and load balancers stop sending it traffic.
+Defaults to 0, i.e. the queue is not checked.
+""",
+    ),
+    cfg.IntOpt(
+        "max-concurrent-trainings",
+        default=0,
+        min=0,
+        help="""
+Maximum number of trainings that can run at the same time for a model. Any
+training submitted above this limit will be queued, and started according to
+its priority once a running training finishes. If set to 0 (the default),
+trainings are not queued.
+""",
+    ),
+    cfg.IntOpt(
+        "train-events-history",
+        default=100,
+        min=0,
+        help="""
+Number of progress events (reported by the model during a training) that are
+kept for each training, so that they can be retrieved by clients that connect
+later to the training events endpoint (defaults to 100).
 """,
     ),
     cfg.BoolOpt(
@@ -83,7 +293,19 @@ file size limit will be enforced.
         help="""
 Pre-warm the modules (eg. load models, do preliminary checks, etc). You might
 want to disable this option if DEEPaaS is loading more than one module because
-you risk getting out of memory errors.
+you risk getting out of memory errors. When serving several models (see
+"multi-model") each model is warmed when it is used for the first time.
+""",
+    ),
+    cfg.IntOpt(
+        "warm-concurrency",
+        default=0,
+        min=0,
+        help="""
+Maximum number of workers (of all the models) that are warmed at the same time
+at startup. Set it to bound the peak memory usage while the models are being
+loaded, 0 means that all the workers are warmed at the same time (defaults to
+0).
 """,
     ),
     cfg.StrOpt(
@@ -92,6 +314,27 @@ you risk getting out of memory errors.
         help="""
 Specify the model to be used. If not specified, DEEPaaS will fail if there are
 more than only one models available.
+""",
+    ),
+    cfg.BoolOpt(
+        "multi-model",
+        default=False,
+        help="""
+Serve all the models that are available, instead of only one. Models are
+loaded (and warmed, if enabled) the first time that they are used, therefore
+the "model-name" option is ignored.
+""",
+    ),
+    cfg.IntOpt(
+        "models-memory-budget",
+        default=0,
+        min=0,
+        help="""
+Maximum memory (in MiB) that the workers of the loaded models can use when
+serving several models (see "multi-model"). Whenever a model is loaded and this
+budget is exceeded, the least recently used models that are idle are unloaded
+(i.e. their workers are shut down) until the memory usage fits in the budget.
+If set to 0 (the default), models are never unloaded.
 """,
     ),
     cfg.BoolOpt(
@@ -134,8 +377,12 @@ def parse_args(argv, default_config_files=None):
 
 
 def setup(argv, default_config_files=None):
-    parse_args(argv, default_config_files=default_config_files)
+    with startup.phase("config"):
+        parse_args(argv, default_config_files=default_config_files)
+
+        log_level = (CONF.debug and "DEBUG") or CONF.log_level
 
-    log_level = (CONF.debug and "DEBUG") or CONF.log_level
+        log.setup(log_level, CONF.log_file)
 
-    log.setup(log_level, CONF.log_file)
+    if CONF.startup_profile:
+        startup.enable_profiling()
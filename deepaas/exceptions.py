@@ -25,3 +25,7 @@ class NoModelsAvailable(Exception):
 
 class MultipleModelsFound(Exception):
     """Multiple models found."""
+
+
+class WorkerDied(Exception):
+    """A worker process exited while executing a task."""
@@ -15,6 +15,7 @@
 # under the License.
 
 from deepaas import exceptions
+from deepaas import startup
 
 import stevedore
 
@@ -22,10 +23,65 @@ NAMESPACES = {
     "v2": "deepaas.v2.model",
 }
 
+# Entry points found for each namespace, so that we only scan the installed
+# distributions once per process. Across processes we rely on the stevedore
+# cache, that is stored on disk and invalidated whenever the import path
+# (i.e. the installed distributions) changes.
+_ENTRY_POINTS = {}
+
+
+def _get_entry_points(version):
+    """Get the entry points defined for a version, without loading them.
+
+    :returns: A dict with the entry point name as the key and the entry point
+              as the value.
+    :rtype: dict
+    """
+    namespace = NAMESPACES.get(version)
+    if namespace not in _ENTRY_POINTS:
+        # Asking for no names will not import any of the plugins
+        with startup.phase("entry_points", namespace=namespace):
+            mgr = stevedore.NamedExtensionManager(namespace=namespace, names=[])
+            eps = {}
+            for ep in mgr.list_entry_points():
+                eps.setdefault(ep.name, ep)
+        _ENTRY_POINTS[namespace] = eps
+    return _ENTRY_POINTS[namespace]
+
+
+class _ObjectEntryPoint(object):
+    """Entry point for a model object that is already loaded."""
+
+    dist = None
+
+    def __init__(self, name, obj):
+        self.name = name
+        self._obj = obj
+
+    def load(self):
+        return self._obj
+
+
+def add_model(name, model_obj, version):
+    """Make a model object available, as if it was defined in an entry point.
+
+    This allows serving models that are not installed, e.g. in benchmarks.
+    Note that the model object is sent to the worker processes, so it must be
+    picklable.
+    """
+    _get_entry_points(version)[name] = _ObjectEntryPoint(name, model_obj)
+
+
+def reset_cache():
+    """Forget the entry points found so far, forcing a new scan."""
+    _ENTRY_POINTS.clear()
+
 
 def get_model_by_name(name, version):
     """Get a model by its name.
 
+    Only the requested model is imported.
+
     :param name: The name of the model.
     :type name: str
     :param version: The version of the model.
@@ -34,36 +90,78 @@ def get_model_by_name(name, version):
     :returns: The model.
     :rtype: object
     """
-    mgr = stevedore.NamedExtensionManager(
-        namespace=NAMESPACES.get(version),
-        names=[name],
-    )
-    if name not in mgr.names():
+    ep = _get_entry_points(version).get(name)
+    if ep is None:
         raise exceptions.ModuleNotFoundError(
             "Model '%s' not found in namespace '%s'" % (name, NAMESPACES.get(version))
         )
-    return mgr[name].plugin
+    with startup.phase("model_import", profile=True, model=name):
+        return ep.load()
+
+
+def get_model_reference(name, version):
+    """Get the object reference of the entry point of a model.
+
+    The reference (e.g. ``package.module:attribute``) can be used to load the
+    model in other processes, without pickling it.
+
+    :returns: The reference, or None if the model was added with
+              ``add_model``.
+    :rtype: str
+    """
+    ep = _get_entry_points(version).get(name)
+    if ep is None or isinstance(ep, _ObjectEntryPoint):
+        return None
+    return ep.value
 
 
 def get_available_model_names(version):
     """Get the names of all the models that are available on the system.
 
+    The models are not imported.
+
     :returns: A list of names.
     :rtype: frozenset
     """
-    mgr = stevedore.ExtensionManager(namespace=NAMESPACES.get(version))
-    return frozenset(mgr.names())
+    return frozenset(_get_entry_points(version))
 
 
 def get_available_models(version):
     """Retrieve all the models available on the system.
 
+    Note that this imports all the models, use ``get_available_model_names``
+    and ``get_model_by_name`` if you only need some of them.
+
     :returns: A dict with model entrypoint name as the key and the model
               as the value.
     :rtype: dict
     """
-    mgr = stevedore.ExtensionManager(
-        namespace=NAMESPACES.get(version), propagate_map_exceptions=True
-    )
+    return {name: ep.load() for name, ep in _get_entry_points(version).items()}
+
+
+def get_model_distribution_metadata(name, version):
+    """Get the metadata of the distribution providing a model.
+
+    This does not import the model, so it can be used to describe models that
+    have not been loaded yet.
+
+    :returns: A dict with the model description, author, license, url and
+              version, if available.
+    :rtype: dict
+    """
+    meta = {"description": "Model '%s' has not been loaded yet." % name}
+    ep = _get_entry_points(version).get(name)
+    if ep is None or ep.dist is None:
+        return meta
 
-    return dict(mgr.map(lambda ext: (ext.entry_point.name, ext.plugin)))
+    dist_meta = ep.dist.metadata
+    for key, dist_key in (
+        ("description", "Summary"),
+        ("author", "Author"),
+        ("license", "License"),
+        ("url", "Home-page"),
+        ("version", "Version"),
+    ):
+        if dist_meta.get(dist_key):
+            meta[key] = dist_meta[dist_key]
+    return meta
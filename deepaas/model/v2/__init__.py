@@ -18,12 +18,18 @@ from deepaas import config
 from deepaas import exceptions
 from deepaas import log
 from deepaas.model import loading
+from deepaas.model.v2 import events
+from deepaas.model.v2 import lazy
 from deepaas.model.v2 import wrapper
+from deepaas import startup
 
 LOG = log.getLogger(__name__)
 
 CONF = config.CONF
 
+# Helper to be used by the models to report their progress
+report_progress = events.report_progress
+
 # Model registry
 MODELS = {}
 MODELS_LOADED = False
@@ -36,6 +42,11 @@ def register_models(app):
     if MODELS_LOADED:
         return
 
+    if CONF.multi_model:
+        _register_lazy_models(app)
+        MODELS_LOADED = True
+        return
+
     if CONF.model_name:
         model_name = CONF.model_name
     else:
@@ -53,11 +64,10 @@ def register_models(app):
             raise exceptions.MultipleModelsFound()
 
     try:
-        MODELS[model_name] = wrapper.ModelWrapper(
-            model_name,
-            loading.get_model_by_name(model_name, "v2"),
-            app,
-        )
+        model_obj = loading.get_model_by_name(model_name, "v2")
+        # This also creates the worker processes
+        with startup.phase("model_wrapper", model=model_name):
+            MODELS[model_name] = wrapper.ModelWrapper(model_name, model_obj, app)
     except exceptions.ModuleNotFoundError:
         LOG.error("Model not found: %s", model_name)
         raise
@@ -66,3 +76,14 @@ def register_models(app):
         raise e
 
     MODELS_LOADED = True
+
+
+def _register_lazy_models(app):
+    model_names = sorted(loading.get_available_model_names("v2"))
+    if not model_names:
+        LOG.error("No models found.")
+        raise exceptions.NoModelsAvailable()
+
+    cache = lazy.ModelCache(memory_budget=CONF.models_memory_budget * 1024 * 1024)
+    for model_name in model_names:
+        MODELS[model_name] = lazy.LazyModelWrapper(model_name, cache, app)
@@ -0,0 +1,231 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Memory mapped loading of the model artifacts (e.g. weights).
+
+Reading the weights of a model into memory makes each worker hold a private
+copy of them. Mapping the files instead makes all the workers (and the
+processes of the other DEEPaaS instances on the node) share the same pages of
+the page cache, and the startup only reads the parts that are really used,
+when they are first accessed. For example, in the ``warm`` method of a
+model::
+
+    from deepaas.model.v2 import artifacts
+
+    WEIGHTS = None
+
+    def warm(self):
+        global WEIGHTS
+        WEIGHTS = artifacts.load_safetensors("model.safetensors")
+
+The arrays and buffers that are returned are read-only. Relative paths are
+resolved against the directory set in the ``DEEPAAS_ARTIFACTS_DIR``
+environment variable, if any. NumPy is only needed to load arrays.
+"""
+
+import collections
+import json
+import mmap
+import os
+import struct
+import zipfile
+
+from deepaas import log
+
+try:
+    import numpy
+except ImportError:  # numpy is optional
+    numpy = None
+
+LOG = log.getLogger(__name__)
+
+ENV_VAR = "DEEPAAS_ARTIFACTS_DIR"
+
+SAFETENSORS_DTYPES = {
+    "BOOL": "?",
+    "U8": "u1",
+    "I8": "i1",
+    "U16": "<u2",
+    "I16": "<i2",
+    "F16": "<f2",
+    "U32": "<u4",
+    "I32": "<i4",
+    "F32": "<f4",
+    "U64": "<u8",
+    "I64": "<i8",
+    "F64": "<f8",
+}
+
+Tensor = collections.namedtuple("Tensor", ("dtype", "shape", "data"))
+"""A tensor of a safetensors file.
+
+.. py:attribute:: dtype
+
+   Data type, as named in the safetensors format (e.g. ``F32`` or ``BF16``).
+
+.. py:attribute:: shape
+
+   Shape of the tensor, as a tuple.
+
+.. py:attribute:: data
+
+   Read-only ``memoryview`` of the (little-endian) data of the tensor.
+"""
+
+# Files mapped by this process, by their real path
+_MAPS = {}
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError("NumPy is needed to load arrays, please install it")
+
+
+def get_path(path):
+    """Get the path of an artifact, relative to ``DEEPAAS_ARTIFACTS_DIR``."""
+    return os.path.join(os.environ.get(ENV_VAR, ""), os.fspath(path))
+
+
+def map_file(path):
+    """Map a file into memory, read-only.
+
+    The file is only mapped once per process, later calls return the same
+    mapping.
+
+    :returns: a read-only ``memoryview`` of the contents of the file
+    """
+    return _map(get_path(path))
+
+
+def _map(path):
+    path = os.path.realpath(path)
+    view = _MAPS.get(path)
+    if view is None:
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                # Empty files cannot be mapped
+                view = memoryview(b"")
+            else:
+                view = memoryview(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+        _MAPS[path] = view
+    return view
+
+
+def load_npy(path):
+    """Load a NumPy ``.npy`` file as a read-only memory mapped array."""
+    _require_numpy()
+    return numpy.load(get_path(path), mmap_mode="r")
+
+
+def _load_npy_member(path, buf, info):
+    with open(path, "rb") as f:
+        # The size of the extra field of the local header may be different
+        # from the one in the central directory
+        f.seek(info.header_offset + 26)
+        name_len, extra_len = struct.unpack("<HH", f.read(4))
+        f.seek(info.header_offset + 30 + name_len + extra_len)
+        start = f.tell()
+        version = numpy.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_1_0(f)
+        elif version == (2, 0):
+            shape, fortran_order, dtype = numpy.lib.format.read_array_header_2_0(f)
+        else:
+            return None
+        offset = f.tell()
+    if dtype.hasobject or offset - start > info.file_size:
+        return None
+    array = numpy.ndarray(
+        shape,
+        dtype=dtype,
+        buffer=buf,
+        offset=offset,
+        order="F" if fortran_order else "C",
+    )
+    return array
+
+
+def load_npz(path):
+    """Load the arrays of a NumPy ``.npz`` file, memory mapped.
+
+    Only the arrays stored without compression (i.e. saved with
+    ``numpy.savez``, not ``numpy.savez_compressed``) can be mapped, the rest
+    are read into memory.
+
+    :returns: a dict with the arrays, by name
+    """
+    _require_numpy()
+    path = get_path(path)
+    buf = _map(path)
+    arrays = {}
+    with zipfile.ZipFile(path) as zf:
+        for info in zf.infolist():
+            name = info.filename[:-4] if info.filename.endswith(".npy") else None
+            if name is None:
+                continue
+            array = None
+            if info.compress_type == zipfile.ZIP_STORED:
+                array = _load_npy_member(path, buf, info)
+            if array is None:
+                LOG.debug("Cannot map array '%s' of %s, reading it", name, path)
+                with zf.open(info) as f:
+                    array = numpy.lib.format.read_array(f)
+            arrays[name] = array
+    return arrays
+
+
+def read_safetensors(path):
+    """Read the tensors of a safetensors file, memory mapped.
+
+    This does not need NumPy, the data of the tensors can be loaded by other
+    frameworks (e.g. with ``torch.frombuffer``).
+
+    :returns: a tuple with a dict of :class:`Tensor`, by name, and the
+        metadata stored in the file
+    """
+    buf = map_file(path)
+    (header_len,) = struct.unpack("<Q", buf[:8])
+    start = 8 + header_len
+    header = json.loads(bytes(buf[8:start]))
+    metadata = header.pop("__metadata__", {})
+    data = buf[start:]
+    tensors = {}
+    for name, info in header.items():
+        begin, end = info["data_offsets"]
+        tensors[name] = Tensor(info["dtype"], tuple(info["shape"]), data[begin:end])
+    return tensors, metadata
+
+
+def load_safetensors(path):
+    """Load the tensors of a safetensors file as memory mapped arrays.
+
+    :returns: a dict with the arrays, by name
+    :raises ValueError: if a tensor has a data type that NumPy does not
+        support (e.g. ``BF16``), use :func:`read_safetensors` instead
+    """
+    _require_numpy()
+    tensors, _ = read_safetensors(path)
+    arrays = {}
+    for name, t in tensors.items():
+        if t.dtype not in SAFETENSORS_DTYPES:
+            raise ValueError(
+                "Tensor '%s' has a data type not supported by NumPy: %s"
+                % (name, t.dtype)
+            )
+        arrays[name] = numpy.frombuffer(
+            t.data, dtype=SAFETENSORS_DTYPES[t.dtype]
+        ).reshape(t.shape)
+    return arrays
@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Events reported by the models from inside the worker processes.
+
+Models can report their progress (e.g. the current epoch and its metrics)
+while they are being executed by calling :func:`report_progress`. Events are
+sent back to the API process by the worker that is executing the task, and
+dispatched there to whoever is listening for the task that produced them.
+"""
+
+import datetime
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+# Worker side state: the channel to the API process, set when the worker is
+# spawned, and the key of the task that is being executed, if any.
+_CHANNEL = None
+_CURRENT_KEY = None
+
+
+def report_progress(progress=None, message=None, **metrics):
+    """Report the progress of the current task to the API.
+
+    This function is meant to be called from the model code (e.g. from the
+    ``train`` method, after each epoch) and can be called as many times as
+    needed. If the API is not listening for events (e.g. the model is executed
+    through ``deepaas-cli``) this is a no-op. For example::
+
+        from deepaas.model.v2 import report_progress
+
+        def train(self, **kwargs):
+            for epoch in range(epochs):
+                loss = ...
+                report_progress(
+                    progress=(epoch + 1) / epochs,
+                    message="Finished epoch %d" % epoch,
+                    loss=loss,
+                )
+
+    :param progress: Fraction of the task that is already done (between 0
+        and 1), if known.
+    :param message: Optional message explaining the current status.
+    :param metrics: Any other JSON serializable value that should be reported
+        (e.g. accuracy, loss, etc.).
+    """
+    event = {
+        "date": str(datetime.datetime.now()),
+        "progress": progress,
+        "message": message,
+        "metrics": metrics,
+    }
+    if _CHANNEL is None or _CURRENT_KEY is None:
+        LOG.debug("Not reporting event, nobody is listening: %s", event)
+        return
+    _CHANNEL.send(_CURRENT_KEY, event)
+
+
+def run_with_events(key, func, *args, **kwargs):
+    """Run a function in the worker, reporting its events with the given key."""
+    global _CURRENT_KEY
+
+    _CURRENT_KEY = key
+    try:
+        return func(*args, **kwargs)
+    finally:
+        _CURRENT_KEY = None
+
+
+def init_worker(channel):
+    """Initialize the worker side of the channel, called on worker spawn."""
+    global _CHANNEL
+
+    _CHANNEL = channel
+
+
+class EventChannel(object):
+    """Dispatcher of the events sent by the workers to the API process.
+
+    The events are sent by the workers over the same socket as the results of
+    the calls (see :mod:`deepaas.model.v2.workers`), and passed to
+    :meth:`dispatch` by the event loop in the API process, so no extra threads
+    are needed. As nothing is shared between the workers, a worker killed
+    while it is reporting an event (e.g. when its training is cancelled)
+    cannot block the others, and the events of a task are always received
+    before its result.
+    """
+
+    def __init__(self):
+        self._listeners = {}
+
+    def listen(self, key, callback):
+        """Call ``callback`` with all the events reported for ``key``."""
+        self._listeners[key] = callback
+
+    def unlisten(self, key):
+        self._listeners.pop(key, None)
+
+    def dispatch(self, key, event):
+        callback = self._listeners.get(key)
+        if callback is None:
+            LOG.debug("Discarding event for unknown task %s", key)
+            return
+        try:
+            callback(event)
+        except Exception:
+            LOG.exception("Error dispatching event for task %s", key)
+
+    def close(self):
+        self._listeners.clear()
@@ -0,0 +1,202 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Lazy loading of models, used when serving several models at once.
+
+Models are only imported (and warmed) when they are used for the first time,
+and the least recently used ones are unloaded (i.e. their workers are shut
+down) whenever the memory used by all the loaded models exceeds the
+configured budget.
+"""
+
+import asyncio
+import collections
+import os
+
+from oslo_config import cfg
+
+from deepaas import log
+from deepaas.model import loading
+from deepaas.model.v2 import wrapper
+
+LOG = log.getLogger(__name__)
+
+CONF = cfg.CONF
+
+
+def get_rss(pid):
+    """Get the resident set size (in bytes) of a process, 0 if unknown."""
+    try:
+        with open("/proc/%s/statm" % pid) as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return 0
+
+
+class ModelCache(object):
+    """Keep track of the loaded models, unloading them when needed.
+
+    :param memory_budget: Maximum memory (in bytes) that the workers of all
+        the loaded models may use, 0 means no limit.
+    """
+
+    def __init__(self, memory_budget=0):
+        self.memory_budget = memory_budget
+        self._loaded = collections.OrderedDict()
+
+    def touch(self, model):
+        """Mark a model as the most recently used one."""
+        self._loaded[model.name] = model
+        self._loaded.move_to_end(model.name)
+
+    def discard(self, model):
+        self._loaded.pop(model.name, None)
+
+    def memory_usage(self):
+        return sum(m.memory_usage() for m in self._loaded.values())
+
+    def evict(self, keep=None):
+        """Unload idle models, least recently used first, to fit the budget."""
+        if not self.memory_budget:
+            return
+
+        usage = self.memory_usage()
+        for model in list(self._loaded.values()):
+            if usage <= self.memory_budget:
+                break
+            if model is keep or model.busy:
+                continue
+            LOG.info("Unloading model '%s' to free memory", model.name)
+            usage -= model.memory_usage()
+            model.unload()
+
+        if usage > self.memory_budget:
+            LOG.warning(
+                "Loaded models use %s bytes, above the memory budget of %s bytes",
+                usage,
+                self.memory_budget,
+            )
+
+
+class LazyModelWrapper(object):
+    """Wrapper that only loads the underlying model when it is used.
+
+    It exposes the same interface as :class:`wrapper.ModelWrapper`, loading the
+    model on first access. Calls to ``predict`` and ``train`` will also warm
+    the model before performing them, if warming is enabled.
+
+    :param name: Model name
+    :param cache: The ``ModelCache`` that tracks the loaded models.
+    """
+
+    lazy = True
+
+    def __init__(self, name, cache, app=None):
+        self.name = name
+        self._cache = cache
+        self._wrapper = None
+        self._warm_task = None
+
+        if app is not None:
+            app.on_cleanup.append(self._unload_on_cleanup)
+
+    @property
+    def loaded(self):
+        return self._wrapper is not None
+
+    @property
+    def busy(self):
+        return self._wrapper is not None and self._wrapper._executor.busy
+
+    def load(self):
+        """Load the underlying model, if needed, and return its wrapper."""
+        if self._wrapper is None:
+            LOG.info("Loading model '%s'", self.name)
+            self._wrapper = wrapper.ModelWrapper(
+                self.name, loading.get_model_by_name(self.name, "v2")
+            )
+        self._cache.touch(self)
+        return self._wrapper
+
+    def unload(self):
+        """Shut down the workers of the underlying model."""
+        if self._wrapper is not None:
+            self._wrapper._executor.shutdown()
+        self._wrapper = None
+        self._warm_task = None
+        self._cache.discard(self)
+
+    async def _unload_on_cleanup(self, app):
+        self.unload()
+
+    @property
+    def warmed(self):
+        # Lazy models are only warmed when they are used for the first time
+        return self._wrapper is not None and self._wrapper.warmed
+
+    def get_load(self):
+        if self._wrapper is None:
+            return {
+                "workers": 0,
+                "busy": 0,
+                "queued": 0,
+                "crashes": 0,
+                "restarting": 0,
+            }
+        return self._wrapper.get_load()
+
+    def memory_usage(self):
+        if self._wrapper is None:
+            return 0
+        return sum(get_rss(pid) for pid in self._wrapper._executor.pids())
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+    def get_metadata(self):
+        """Get the model metadata, without loading the model if possible."""
+        if self.loaded:
+            return self._wrapper.get_metadata()
+
+        meta = loading.get_model_distribution_metadata(self.name, "v2")
+        meta.update({"id": "0", "name": self.name})
+        return meta
+
+    async def warm(self):
+        """Load and warm the model, only once."""
+        w = self.load()
+        if self._warm_task is None:
+            self._warm_task = asyncio.ensure_future(w.warm())
+        await asyncio.shield(self._warm_task)
+        self._cache.evict(keep=self)
+
+    async def _call(self, method, *args, **kwargs):
+        w = self.load()
+        # The model may have just been loaded
+        self._cache.evict(keep=self)
+        if CONF.warm:
+            await self.warm()
+        try:
+            return await getattr(w, method)(*args, **kwargs)
+        finally:
+            # Models that are not warmed load their data when they are used
+            self._cache.evict(keep=self)
+
+    def predict(self, *args, **kwargs):
+        return asyncio.ensure_future(self._call("predict", *args, **kwargs))
+
+    def train(self, *args, **kwargs):
+        return asyncio.ensure_future(self._call("train", *args, **kwargs))
@@ -0,0 +1,176 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Fork-after-load mode: workers forked from a process with the model loaded.
+
+By default the workers are spawned (see :mod:`deepaas.model.v2.workers`),
+therefore each of them imports and warms its own copy of the model. For
+CPU-only models, the "fork-workers" option uses a multiprocessing forkserver
+instead, that acts as a template: it imports and warms the model once (this
+module is preloaded in it, and loads the model given in the ENV_VAR
+environment variable), freezes the garbage collector and then forks the
+workers, that share the pages of the model (e.g. its weights) copy-on-write,
+as long as they do not modify them.
+
+The models are given to the template by the reference of their entry point (or
+of their module), so that they are imported there as usual, and they are only
+pickled if they have no such reference (e.g. the ones added with
+:func:`deepaas.model.loading.add_model`).
+"""
+
+import gc
+import importlib.metadata
+import multiprocessing
+import multiprocessing.forkserver
+import os
+import pickle  # nosec B403
+import stat
+import tempfile
+import types
+
+from deepaas import log
+from deepaas.model import loading
+
+LOG = log.getLogger(__name__)
+
+ENV_VAR = "DEEPAAS_PRELOAD_MODELS"
+
+# Models already warmed in the template process (and so in the workers forked
+# from it)
+WARMED = set()
+
+
+def get_context(name, model_obj):
+    """Get a multiprocessing context whose processes have the model warmed.
+
+    The forkserver is started if needed, with the model preloaded. There is
+    only one forkserver per process: if it is already running (e.g. to serve
+    another model), the model is not preloaded and each worker warms its own
+    copy.
+    """
+    ctx = multiprocessing.get_context("forkserver")
+    if multiprocessing.forkserver._forkserver._forkserver_pid is not None:
+        LOG.warning(
+            "The template process is already running, model '%s' will be "
+            "loaded by each worker instead",
+            name,
+        )
+        return ctx
+
+    try:
+        path = _dump_models({name: model_obj})
+    except Exception as e:
+        LOG.warning(
+            "Cannot give model '%s' to the template process (%s), it will be "
+            "loaded by each worker instead",
+            name,
+            e,
+        )
+        return ctx
+    ctx.set_forkserver_preload([__name__])
+    os.environ[ENV_VAR] = path
+    try:
+        multiprocessing.forkserver.ensure_running()
+    finally:
+        # Only the forkserver must load the models
+        del os.environ[ENV_VAR]
+    return ctx
+
+
+def _get_reference(name, model_obj):
+    ref = loading.get_model_reference(name, "v2")
+    if ref is None and isinstance(model_obj, types.ModuleType):
+        ref = model_obj.__name__
+    return ref
+
+
+def _dump_models(models):
+    """Write the models to be preloaded to a temporary file.
+
+    :returns: the path of the file, that is removed by the template process
+    """
+    models = {
+        name: _get_reference(name, model_obj) or model_obj
+        for name, model_obj in models.items()
+    }
+    # Only readable and writable by us, as the template process unpickles it
+    fd, path = tempfile.mkstemp(prefix="deepaas-preload-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            os.fchmod(f.fileno(), stat.S_IRUSR | stat.S_IWUSR)
+            pickle.dump(models, f)
+    except BaseException:
+        os.unlink(path)
+        raise
+    return path
+
+
+def _load(name, model):
+    if not isinstance(model, str):
+        return model
+    ep = importlib.metadata.EntryPoint(name, model, loading.NAMESPACES["v2"])
+    return ep.load()
+
+
+def warm_once(name, func):
+    """Warm a model in a worker, unless it was warmed in the template."""
+    if name in WARMED:
+        return
+    return func()
+
+
+def _preload(path):
+    try:
+        with open(path, "rb") as f:
+            st = os.fstat(f.fileno())
+            if st.st_uid != os.getuid() or st.st_mode & 0o077:
+                # The workers will load the models
+                LOG.error("Not preloading the models, %s is not private", path)
+                return
+            # Written by the parent process, only we can access it
+            models = pickle.load(f)  # nosec B301
+    finally:
+        os.unlink(path)
+
+    for name, model in models.items():
+        try:
+            model_obj = _load(name, model)
+        except Exception:
+            # The workers will load it
+            LOG.exception("Error loading model '%s' in the template process", name)
+            continue
+        try:
+            warm = model_obj.warm
+        except AttributeError:
+            WARMED.add(name)
+            continue
+        try:
+            warm()
+        except NotImplementedError:
+            pass
+        except Exception:
+            # The workers will try to warm it again
+            LOG.exception("Error warming model '%s' in the template process", name)
+            continue
+        WARMED.add(name)
+
+    # Do not touch the (already loaded) objects in the garbage collections of
+    # the workers, so that their pages are not copied
+    gc.freeze()
+
+
+if ENV_VAR in os.environ:
+    _preload(os.environ.pop(ENV_VAR))
@@ -0,0 +1,298 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Worker processes executing the calls to the models.
+
+Each worker is a process connected to the API process by a socket pair, over
+which they exchange frames: a 4 byte header with the length of the payload,
+followed by a pickled message. The API process sends the calls to execute, one
+at a time, and the worker answers with the events reported by the model while
+it is being executed (see :mod:`deepaas.model.v2.events`) and then with the
+result of the call. The API side of the sockets is watched directly by the
+event loop, so no helper threads are needed. The socket pair is created by the
+API process and only inherited by the worker, so nobody else can send frames
+to be unpickled.
+
+The workers are spawned by default (instead of forked, that is the default in
+Linux) in order to work with CUDA [1] or Tensorflow [2], or forked from a
+template process when the "fork-workers" option is set (see
+:mod:`deepaas.model.v2.preload`). They are not daemonic, so that the models
+can start processes on their own.
+
+[1] https://pytorch.org/docs/stable/notes/multiprocessing.html
+#cuda-in-multiprocessing
+[2] https://github.com/tensorflow/tensorflow/issues/5448
+#issuecomment-258934405
+"""
+
+import asyncio
+import functools
+import io
+import multiprocessing
+import multiprocessing.pool
+import multiprocessing.util
+import os
+import pickle  # nosec B403
+import socket
+import struct
+import threading
+
+from deepaas import exceptions
+from deepaas import log
+from deepaas.model.v2 import events
+
+LOG = log.getLogger(__name__)
+
+HEADER = struct.Struct("!I")
+
+# Size of the reads of the API side of the sockets
+READ_SIZE = 256 * 1024
+
+# Types of the messages sent by the workers
+RESULT, ERROR, EVENT = range(3)
+
+
+def _dump(msg):
+    buf = io.BytesIO()
+    buf.write(bytes(HEADER.size))
+    pickle.dump(msg, buf, protocol=pickle.HIGHEST_PROTOCOL)
+    frame = buf.getbuffer()
+    HEADER.pack_into(frame, 0, len(frame) - HEADER.size)
+    return frame
+
+
+class Worker(object):
+    """A worker process, as seen from the API process.
+
+    :param context: The multiprocessing context used to start the process.
+    :param on_event: Callable that will be called with the key and the event
+        of each of the events reported by the worker.
+    :param on_exit: Callable that will be called with the worker if its
+        process exits unexpectedly (e.g. it crashes, or it is killed by the
+        OOM killer). The call that it was executing, if any, fails with
+        :class:`deepaas.exceptions.WorkerDied`.
+    """
+
+    def __init__(self, context=None, on_event=None, on_exit=None):
+        context = context or multiprocessing.get_context("spawn")
+        self._on_event = on_event
+        self._on_exit = on_exit
+        self._loop = None
+        self._buf = bytearray()
+        self._future = None
+
+        self._sock, child_sock = socket.socketpair()
+        self.process = context.Process(target=_main, args=(child_sock,))
+        self.process.start()
+        child_sock.close()
+        self._sock.setblocking(False)
+
+        # Do not wait for the (non daemonic) process at exit
+        self._finalizer = multiprocessing.util.Finalize(
+            self, _terminate, (self.process, self._sock), exitpriority=10
+        )
+
+        # Watch the worker from now on if possible, so that its exit is
+        # noticed even if it is idle
+        try:
+            self._watch()
+        except RuntimeError:
+            # No running event loop, it will be watched once it is called
+            pass
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    @property
+    def closed(self):
+        """Whether the worker cannot execute calls anymore."""
+        return self._sock is None
+
+    def _watch(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._unwatch()
+            self._loop = loop
+            loop.add_reader(self._sock.fileno(), self._on_readable)
+
+    def _unwatch(self):
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.remove_reader(self._sock.fileno())
+        self._loop = None
+
+    def _on_readable(self):
+        try:
+            data = self._sock.recv(READ_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        except OSError:
+            data = b""
+        if not data:
+            self._on_eof()
+            return
+
+        buf = self._buf
+        buf += data
+        pos = 0
+        msgs = []
+        while len(buf) - pos >= HEADER.size:
+            (length,) = HEADER.unpack_from(buf, pos)
+            start = pos + HEADER.size
+            end = start + length
+            if len(buf) < end:
+                break
+            with memoryview(buf) as view:
+                # Sent by our own worker process, over its private socket pair
+                msgs.append(pickle.loads(view[start:end]))  # nosec B301
+            pos = end
+        del buf[:pos]
+
+        for msg in msgs:
+            self._handle(msg)
+
+    def _handle(self, msg):
+        if msg[0] == EVENT:
+            if self._on_event is not None:
+                self._on_event(*msg[1:])
+            return
+
+        fut, self._future = self._future, None
+        if fut is None or fut.done():
+            return
+        if msg[0] == RESULT:
+            fut.set_result(msg[1])
+        else:
+            fut.set_exception(msg[1])
+
+    def _on_eof(self):
+        LOG.warning("Worker process %s exited unexpectedly", self.pid)
+        fut, self._future = self._future, None
+        self.close()
+        if fut is not None and not fut.done():
+            fut.set_exception(
+                exceptions.WorkerDied(
+                    "Worker process %s exited unexpectedly" % self.pid
+                )
+            )
+        if self._on_exit is not None:
+            self._on_exit(self)
+
+    async def call(self, fn, args=()):
+        """Execute ``fn(*args)`` in the worker, and return its result.
+
+        Only one call can be executed at the same time.
+
+        :raises WorkerDied: if the worker exits before returning the result
+        """
+        if self.closed:
+            raise exceptions.WorkerDied("Worker process %s is dead" % self.pid)
+        self._watch()
+        frame = _dump((fn, args))
+        fut = self._future = self._loop.create_future()
+        try:
+            await self._loop.sock_sendall(self._sock, frame)
+        except OSError:
+            # The worker is dead, wait for the end of file
+            pass
+        try:
+            return await fut
+        finally:
+            self._future = None
+
+    def close(self):
+        """Stop watching the worker, that exits once it sees the end of file."""
+        if self._sock is None:
+            return
+        self._unwatch()
+        self._sock.close()
+        self._sock = None
+
+    def terminate(self):
+        self.close()
+        self.process.terminate()
+
+    def kill(self):
+        self.close()
+        self.process.kill()
+        self.process.join()
+
+
+def _terminate(process, sock):
+    sock.close()
+    if process.is_alive():
+        process.terminate()
+
+
+class _Channel(object):
+    """Worker side of the socket, writes are serialized with a lock so that
+    events can be reported from any thread of the model."""
+
+    def __init__(self, sock):
+        self._sock = sock
+        self._lock = threading.Lock()
+
+    def send(self, key, event):
+        self.write((EVENT, key, event))
+
+    def write(self, msg):
+        frame = _dump(msg)
+        with self._lock:
+            self._sock.sendall(frame)
+
+
+def _detach(fd):
+    # The API process notices that the worker exited when the socket is
+    # closed, processes forked by the model must not keep it open
+    events.init_worker(None)
+    null = os.open(os.devnull, os.O_RDWR)
+    os.dup2(null, fd)
+    os.close(null)
+
+
+def _main(sock):
+    """Main loop of the worker processes."""
+    channel = _Channel(sock)
+    events.init_worker(channel)
+    os.register_at_fork(after_in_child=functools.partial(_detach, sock.fileno()))
+    reader = sock.makefile("rb")
+    while True:
+        header = reader.read(HEADER.size)
+        if len(header) < HEADER.size:
+            # The API process is gone
+            break
+        (length,) = HEADER.unpack(header)
+        # Sent by the API process that started us, over the private socket pair
+        fn, args = pickle.loads(reader.read(length))  # nosec B301
+        try:
+            msg = (RESULT, fn(*args))
+        except Exception as e:
+            msg = (
+                ERROR,
+                multiprocessing.pool.ExceptionWithTraceback(e, e.__traceback__),
+            )
+        del fn, args
+
+        try:
+            channel.write(msg)
+        except OSError:
+            # The API process is gone
+            break
+        except Exception as e:
+            # The result (or the error) cannot be pickled
+            error = multiprocessing.pool.MaybeEncodingError(e, msg[1])
+            channel.write((ERROR, error))
+        del msg
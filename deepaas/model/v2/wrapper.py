@@ -20,22 +20,32 @@ import contextlib
 import datetime
 import functools
 import io
+import itertools
 import multiprocessing
-import multiprocessing.pool
 import os
-import signal
 import tempfile
+import uuid
 
 from aiohttp import web
 import marshmallow
 from oslo_config import cfg
 
+from deepaas import exceptions
 from deepaas import log
+from deepaas.model.v2 import events
+from deepaas.model.v2 import preload
+from deepaas.model.v2 import workers
+from deepaas import profiling
+from deepaas import startup
+from deepaas import tracing
 
 LOG = log.getLogger(__name__)
 
 CONF = cfg.CONF
 
+# Time (in seconds) to wait before replacing a worker that died while starting
+RESTART_DELAY = 1
+
 
 UploadedFile = collections.namedtuple(
     "UploadedFile", ("name", "filename", "content_type", "original_filename")
@@ -109,6 +119,7 @@ class ModelWrapper(object):
 
         self._workers = CONF.workers
         self._executor = self._init_executor()
+        self.warmed = False
 
         if self._app is not None:
             self._setup_cleanup()
@@ -147,7 +158,10 @@ class ModelWrapper(object):
 
     def _init_executor(self):
         n = self._workers
-        executor = CancellablePool(max_workers=n)
+        context = None
+        if CONF.fork_workers:
+            context = preload.get_context(self.name, self.model_obj)
+        executor = CancellablePool(max_workers=n, context=context)
         return executor
 
     @contextlib.contextmanager
@@ -229,11 +243,39 @@ class ModelWrapper(object):
         return d
 
     def _run_in_pool(self, func, *args, **kwargs):
-        fn = functools.partial(func, *args, **kwargs)
-        ret = self._loop.create_task(self._executor.apply(fn))
+        return self._submit(functools.partial(func, *args, **kwargs))
+
+    def _submit(self, fn, retries=0):
+        return self._loop.create_task(self._apply(fn, retries))
+
+    async def _apply(self, fn, retries=0):
+        context = tracing.get_current_context()
+        while True:
+            try:
+                if context is not None:
+                    return await self._apply_traced(context, fn)
+                return await self._executor.apply(fn)
+            except exceptions.WorkerDied:
+                if retries <= 0:
+                    raise
+                retries -= 1
+                LOG.warning(
+                    "Worker of model '%s' died executing a task, retrying it",
+                    self.name,
+                )
+
+    async def _apply_traced(self, context, fn):
+        fn = functools.partial(tracing.run_in_worker, context, fn)
+        try:
+            ret = await self._executor.apply(fn)
+        except Exception as e:
+            tracing.collect_worker_spans(getattr(e, "_deepaas_spans", []))
+            raise
+        ret["output"], spans = ret["output"]
+        tracing.collect_worker_spans(spans)
         return ret
 
-    async def warm(self):
+    async def warm(self, semaphore=None):
         """Warm (i.e. load, initialize) the underlying model.
 
         This method is called automatically when the model is loaded. You
@@ -241,21 +283,55 @@ class ModelWrapper(object):
         the first prediction.
 
         The model receives no arguments.
+
+        :param semaphore: Optional semaphore limiting how many workers are
+            warmed at the same time (e.g. shared by all the models).
         """
         try:
             func = self.model_obj.warm
         except AttributeError:
             LOG.debug("Cannot warm (initialize) model '%s'" % self.name)
+            self.warmed = True
             return
 
+        # Requests wait until all the workers are warmed, so that they do not
+        # reach a cold worker nor delay the warming of the busy ones
+        self._executor.pause()
         try:
             n = self._workers
             LOG.debug("Warming '%s' model with %s workers" % (self.name, n))
-            fs = [self._run_in_pool(func) for _ in range(0, n)]
-            await asyncio.gather(*fs)
+            init = functools.partial(preload.warm_once, self.name, func)
+            fn = functools.partial(startup.run_timed, init)
+            for ret in await self._executor.apply_each(fn, semaphore=semaphore):
+                if ret is None:
+                    continue
+                _, start, duration, pid = ret["output"]
+                startup.record("warm_worker", start, duration, model=self.name, pid=pid)
+            # Also warm the workers that replace the ones that die
+            self._executor.initializer = init
             LOG.debug("Model '%s' has been warmed" % self.name)
         except NotImplementedError:
             LOG.debug("Cannot warm (initialize) model '%s'" % self.name)
+        finally:
+            self._executor.resume()
+        self.warmed = True
+
+    def get_load(self):
+        """Get the number of workers, and how many of them are busy.
+
+        :returns dict: dictionary with the number of workers, how many of
+            them are executing a task ("busy"), how many tasks are waiting for
+            a free worker ("queued"), how many workers have died ("crashes")
+            and how many of their replacements are being started
+            ("restarting")
+        """
+        return {
+            "workers": self._workers,
+            "busy": self._executor.working,
+            "queued": self._executor.queued,
+            "crashes": self._executor.crashes,
+            "restarting": self._executor.restarting,
+        }
 
     @staticmethod
     def predict_wrap(predict_func, *args, **kwargs):
@@ -269,9 +345,12 @@ class ModelWrapper(object):
 
         return ret
 
-    def predict(self, *args, **kwargs):
+    def predict(self, *args, profile=None, **kwargs):
         """Perform a prediction on wrapped model's ``predict`` method.
 
+        :param profile: Optional path (without extension) where the profile
+            of the call, made in the worker process, will be written. See
+            :func:`deepaas.profiling.run_profiled`.
         :raises HTTPNotImplemented: If the method is not
             implemented in the wrapper model.
         :raises HTTPInternalServerError: If the call produces
@@ -279,29 +358,36 @@ class ModelWrapper(object):
         :raises HTTPException: If the call produces an
             error, already wrapped as a HTTPException
         """
-        for key, val in kwargs.items():
-            if isinstance(val, web.FileField):
-                fd, name = tempfile.mkstemp()
-                fd = os.fdopen(fd, "w+b")
-                fd.write(val.file.read())
-                fd.close()
-                aux = UploadedFile(
-                    name=val.name,
-                    filename=name,
-                    content_type=val.content_type,
-                    original_filename=val.filename,
-                )
-                kwargs[key] = aux
-                # FIXME(aloga); cleanup of tmpfile here
+        with tracing.span("stage_uploads"):
+            for key, val in kwargs.items():
+                if isinstance(val, web.FileField):
+                    fd, name = tempfile.mkstemp()
+                    fd = os.fdopen(fd, "w+b")
+                    fd.write(val.file.read())
+                    fd.close()
+                    aux = UploadedFile(
+                        name=val.name,
+                        filename=name,
+                        content_type=val.content_type,
+                        original_filename=val.filename,
+                    )
+                    kwargs[key] = aux
+                    # FIXME(aloga); cleanup of tmpfile here
 
         with self._catch_error():
-            return self._run_in_pool(
+            fn = functools.partial(
                 self.predict_wrap, self.model_obj.predict, *args, **kwargs
             )
+            if profile is not None:
+                fn = functools.partial(profiling.run_profiled, profile, fn)
+            return self._submit(fn, retries=CONF.predict_retries)
 
-    def train(self, *args, **kwargs):
+    def train(self, *args, on_event=None, **kwargs):
         """Perform a training on wrapped model's ``train`` method.
 
+        :param on_event: Optional callable that will be called, in the API
+            process, with each of the events that the model reports with
+            :func:`deepaas.model.v2.report_progress` during the training.
         :raises HTTPNotImplemented: If the method is not
             implemented in the wrapper model.
         :raises HTTPInternalServerError: If the call produces
@@ -311,7 +397,16 @@ class ModelWrapper(object):
         """
 
         with self._catch_error():
-            return self._run_in_pool(self.model_obj.train, *args, **kwargs)
+            if on_event is None:
+                return self._run_in_pool(self.model_obj.train, *args, **kwargs)
+
+            key = uuid.uuid4().hex
+            self._executor.events.listen(key, on_event)
+            task = self._run_in_pool(
+                events.run_with_events, key, self.model_obj.train, *args, **kwargs
+            )
+            task.add_done_callback(lambda _: self._executor.events.unlisten(key))
+            return task
 
     def get_train_args(self):
         """Add training arguments into the training parser.
@@ -340,84 +435,171 @@ class ModelWrapper(object):
         return args
 
 
-class NonDaemonProcess(multiprocessing.context.SpawnProcess):
-    """Processes must use 'spawn' instead of 'fork' (which is the default
-    in Linux) in order to work CUDA [1] or Tensorflow [2].
+class CancellablePool(object):
+    """Pool of worker processes, executing one task each at a time.
 
-    [1] https://pytorch.org/docs/stable/notes/multiprocessing.html
-    #cuda-in-multiprocessing
-    [2] https://github.com/tensorflow/tensorflow/issues/5448
-    #issuecomment-258934405
+    The workers that die (e.g. crash, or are killed by the OOM killer) are
+    replaced by new ones, that execute the ``initializer`` function (e.g. to
+    warm the model), if set, before they are given any task.
+
+    :param max_workers: Number of worker processes.
+    :param context: The multiprocessing context used to start the workers
+        (spawn by default).
     """
 
+    def __init__(self, max_workers=None, context=None):
+        self._context = context or multiprocessing.get_context("spawn")
+        self.events = events.EventChannel()
+        self.initializer = None
+        self.crashes = 0
+        self._closed = False
+        self._paused = 0
+        self._starting = {}
+        self._free = {self._new_worker() for _ in range(max_workers)}
+        self._working = set()
+        self._waiting = 0
+        self._change = asyncio.Event()
+
     @property
-    def daemon(self):
-        return False
+    def busy(self):
+        """Whether there are tasks being executed or waiting for a worker."""
+        return bool(self._working or self._waiting)
 
-    @daemon.setter
-    def daemon(self, value):
-        pass
+    @property
+    def working(self):
+        """Number of tasks being executed."""
+        return len(self._working)
 
+    @property
+    def queued(self):
+        """Number of tasks waiting for a free worker."""
+        return self._waiting
 
-class NonDaemonPool(multiprocessing.pool.Pool):
-    # Based on https://stackoverflow.com/questions/6974695/
-    def Process(self, *args, **kwds):  # noqa
-        proc = super(NonDaemonPool, self).Process(*args, **kwds)
-        proc.__class__ = NonDaemonProcess
+    @property
+    def restarting(self):
+        """Number of replacements of dead workers being started."""
+        return len(self._starting)
+
+    def pids(self):
+        """Return the PIDs of the worker processes."""
+        return [
+            w.pid for w in itertools.chain(self._free, self._working, self._starting)
+        ]
+
+    def _new_worker(self):
+        return workers.Worker(
+            self._context, on_event=self.events.dispatch, on_exit=self._on_exit
+        )
+
+    def _on_exit(self, worker):
+        self.crashes += 1
+        if worker in self._free:
+            self._free.remove(worker)
+            self._replace()
+        # Workers executing a task are replaced once the task fails
+
+    def _replace(self):
+        if self._closed:
+            return
+        worker = self._new_worker()
+        if self.initializer is None:
+            self._free.add(worker)
+            self._change.set()
+            return
+        self._starting[worker] = asyncio.ensure_future(self._initialize(worker))
 
-        return proc
+    async def _initialize(self, worker):
+        try:
+            await worker.call(self.initializer)
+        except exceptions.WorkerDied:
+            # Do not replace workers that die when starting in a busy loop
+            await asyncio.sleep(RESTART_DELAY)
+            del self._starting[worker]
+            self._replace()
+            return
+        except Exception:
+            LOG.exception("Error initializing worker %s", worker.pid)
+        del self._starting[worker]
+        self._free.add(worker)
+        self._change.set()
 
+    def pause(self):
+        """Hold the tasks given to :meth:`apply` until :meth:`resume`.
 
-class CancellablePool(object):
-    def __init__(self, max_workers=None):
-        self._free = {self._new_pool() for _ in range(max_workers)}
-        self._working = set()
-        self._change = asyncio.Event()
+        The functions executed with :meth:`apply_each` are not held.
+        """
+        self._paused += 1
 
-    def _new_pool(self):
-        return NonDaemonPool(1, context=multiprocessing.get_context("spawn"))
+    def resume(self):
+        self._paused -= 1
+        self._change.set()
 
     async def apply(self, fn, *args):
         """
-        Like multiprocessing.Pool.apply_async, but:
+        Execute a function in a free worker, but:
          * is an asyncio coroutine
          * terminates the process if cancelled
         """
-        while not self._free:
-            await self._change.wait()
-            self._change.clear()
-        pool = usable_pool = self._free.pop()
-        self._working.add(pool)
-
-        loop = asyncio.get_event_loop()
-        fut = loop.create_future()
-
-        def _on_done(obj):
-            ret = {"output": obj, "finish_date": str(datetime.datetime.now())}
-            loop.call_soon_threadsafe(fut.set_result, ret)
+        self._waiting += 1
+        try:
+            with tracing.span("queue_wait"):
+                while self._paused or not self._free:
+                    await self._change.wait()
+                    self._change.clear()
+        finally:
+            self._waiting -= 1
+        return await self._run(self._free.pop(), fn, args)
 
-        def _on_err(err):
-            loop.call_soon_threadsafe(fut.set_exception, err)
+    async def apply_each(self, fn, *args, semaphore=None):
+        """Execute a function once in each of the workers (e.g. to warm them).
 
-        pool.apply_async(fn, args, callback=_on_done, error_callback=_on_err)
+        :param semaphore: Optional semaphore limiting how many workers execute
+            the function at the same time, it can be shared between pools.
+        :returns: a list with the results, as returned by :meth:`apply`, or
+            None for the workers that were replaced in the meantime
+        """
+        fs = [
+            self._apply_to(w, fn, args, semaphore)
+            for w in itertools.chain(self._free, self._working)
+        ]
+        return await asyncio.gather(*fs)
+
+    async def _apply_to(self, worker, fn, args, semaphore):
+        if semaphore is not None:
+            async with semaphore:
+                return await self._apply_to(worker, fn, args, None)
+
+        while worker not in self._free:
+            if worker not in self._working:
+                return None
+            await self._change.wait()
+            self._change.clear()
+        self._free.remove(worker)
+        return await self._run(worker, fn, args)
 
+    async def _run(self, worker, fn, args):
+        self._working.add(worker)
         try:
-            return await fut
+            output = await worker.call(fn, args)
+            return {"output": output, "finish_date": str(datetime.datetime.now())}
         except asyncio.CancelledError:
-            # This is ugly, but since our pools only have one slot we can
-            # kill the process before termination
-            try:
-                pool._pool[0].kill()
-            except AttributeError:
-                os.kill(pool._pool[0].pid, signal.SIGKILL)
-            pool.terminate()
-            usable_pool = self._new_pool()
+            # Our workers only execute one task, so we can kill the process
+            worker.kill()
         finally:
-            self._working.remove(pool)
-            self._free.add(usable_pool)
+            self._working.remove(worker)
+            if worker.closed:
+                # It was killed, or it exited while executing the task
+                self._replace()
+            else:
+                self._free.add(worker)
             self._change.set()
 
     def shutdown(self):
-        for p in self._working:
-            p.terminate()
+        self._closed = True
+        for task in self._starting.values():
+            task.cancel()
+        for w in itertools.chain(self._working, self._free, self._starting):
+            w.terminate()
         self._free.clear()
+        self._starting.clear()
+        self.events.close()
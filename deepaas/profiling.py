@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""On-demand profiling of single requests.
+
+If enabled with the "profile-requests" option, a client can ask for a
+prediction to be profiled (with cProfile) by sending the "X-Profile: 1"
+header. The model's predict method is profiled inside the worker process that
+runs it, and the profile is stored in the "profile-dir" directory, both as a
+pstats file and as collapsed stacks (that can be rendered as a flame graph),
+keyed by a unique ID, built from the ID of the request if the client sent one.
+The ID is returned in the "X-Profile-Id" header of the response.
+"""
+
+import collections
+import cProfile
+import heapq
+import os
+import pstats
+import re
+import tempfile
+import uuid
+
+from oslo_config import cfg
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+CONF = cfg.CONF
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+REQUEST_ID_HEADER = "X-Request-Id"
+
+FORMATS = {
+    "pstats": (".prof", "application/octet-stream"),
+    "collapsed": (".folded", "text/plain"),
+}
+
+# Request IDs are used as file names, only accept safe ones from clients
+_VALID_ID = re.compile(r"^[A-Za-z0-9_.-]{1,128}$")
+
+# Maximum depth and number of the collapsed stacks, and minimum time (in
+# seconds) of the stacks that are written
+_MAX_DEPTH = 128
+_MAX_STACKS = 20000
+_MIN_TIME = 1e-6
+
+_PROFILE_DIR = None
+
+
+def get_profile_dir():
+    """Get the directory where the profiles are stored, creating it if needed.
+
+    If the "profile-dir" option is not set, a temporary directory is used.
+    """
+    global _PROFILE_DIR
+    if _PROFILE_DIR is None:
+        if CONF.profile_dir:
+            os.makedirs(CONF.profile_dir, exist_ok=True)
+            _PROFILE_DIR = CONF.profile_dir
+        else:
+            _PROFILE_DIR = tempfile.mkdtemp(prefix="deepaas-profiles-")
+        LOG.info("Request profiles will be stored in %s", _PROFILE_DIR)
+    return _PROFILE_DIR
+
+
+def get_profile_path(profile_id, fmt="pstats"):
+    """Get the path of a stored profile, or None if it does not exist."""
+    if not _VALID_ID.match(profile_id) or fmt not in FORMATS:
+        return None
+    path = os.path.join(get_profile_dir(), profile_id + FORMATS[fmt][0])
+    if not os.path.exists(path):
+        return None
+    return path
+
+
+def list_profiles():
+    """List the IDs of the stored profiles."""
+    suffix = FORMATS["pstats"][0]
+    return sorted(
+        f[: -len(suffix)] for f in os.listdir(get_profile_dir()) if f.endswith(suffix)
+    )
+
+
+def get_request_profile(request):
+    """Check if a request asks to be profiled.
+
+    :returns: the ID of the profile, or None if the request must not be
+        profiled (profiling is disabled or the client did not ask for it).
+    """
+    if not CONF.profile_requests:
+        return None
+    if request.headers.get(PROFILE_HEADER, "").lower() not in ("1", "true", "yes"):
+        return None
+    request_id = request.headers.get(REQUEST_ID_HEADER, "")
+    if not _VALID_ID.match(request_id):
+        return uuid.uuid4().hex
+    # Request IDs are chosen by the clients, they must not be able to
+    # overwrite the profiles of other requests
+    return "%s-%s" % (request_id[:95], uuid.uuid4().hex)
+
+
+def get_profile_prefix(profile_id):
+    """Get the path (without extension) where a profile will be written."""
+    return os.path.join(get_profile_dir(), profile_id)
+
+
+def _get_label(func):
+    filename, line, name = func
+    if filename == "~":
+        # Built-in functions
+        return name
+    return "%s (%s:%d)" % (name, filename, line)
+
+
+def get_collapsed_stacks(stats):
+    """Get the collapsed stacks of a profile, to be rendered as a flame graph.
+
+    cProfile does not record the whole stacks, only the time spent in each
+    function and how it is split among its callers, so the stacks are
+    rebuilt from the call graph, splitting the time of each function among its
+    callers proportionally.
+
+    The number of paths in the call graph can grow exponentially with its
+    depth, so the stacks are expanded from the most to the least expensive,
+    up to _MAX_STACKS of them. The time of the stacks that are not expanded
+    is attributed to their innermost function.
+
+    :param stats: a pstats.Stats object
+    :returns: a dict whose keys are the stacks (tuples of function labels,
+        outermost first) and whose values are the time (in seconds) spent in
+        the innermost function
+    """
+    callees = collections.defaultdict(list)
+    pending = []
+    for func, (_, _, _, cumtime, callers) in stats.stats.items():
+        if not callers:
+            pending.append((-cumtime, (func,), 1.0))
+        for caller, (_, _, _, edge_time) in callers.items():
+            callees[caller].append((func, edge_time))
+    heapq.heapify(pending)
+
+    stacks = collections.defaultdict(float)
+    while pending:
+        _, stack, scale = heapq.heappop(pending)
+        func = stack[-1]
+        _, _, tottime, cumtime, _ = stats.stats[func]
+        # Each of the stacks already seen, pending and to be added is written
+        count = len(stacks) + len(pending) + 1 + len(callees[func])
+        if count > _MAX_STACKS or len(stack) >= _MAX_DEPTH:
+            stacks[stack] += cumtime * scale
+            continue
+        stacks[stack] += tottime * scale
+        for callee, edge_time in callees[func]:
+            callee_time = stats.stats[callee][3]
+            time = edge_time * scale
+            # Do not follow recursive calls, their time is already included
+            if callee in stack or not callee_time or time < _MIN_TIME:
+                continue
+            heapq.heappush(pending, (-time, stack + (callee,), time / callee_time))
+
+    return {
+        tuple(_get_label(f) for f in stack): time
+        for stack, time in stacks.items()
+        if time >= _MIN_TIME
+    }
+
+
+def dump_collapsed_stacks(stats, path):
+    """Write the collapsed stacks of a profile, in microseconds.
+
+    The file is in the format used by flamegraph.pl, speedscope or inferno.
+    """
+    stacks = get_collapsed_stacks(stats)
+    with open(path, "w") as f:
+        for stack, time in sorted(stacks.items()):
+            f.write("%s %d\n" % (";".join(stack), round(time * 1e6)))
+
+
+def run_profiled(prefix, func, *args, **kwargs):
+    """Run a function under cProfile, and write its profile.
+
+    This is executed in the worker process, the profile is written to
+    ``prefix`` plus the extension of each of the FORMATS.
+    """
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args, **kwargs)
+    finally:
+        try:
+            stats = pstats.Stats(profiler)
+            stats.dump_stats(prefix + FORMATS["pstats"][0])
+            dump_collapsed_stacks(stats, prefix + FORMATS["collapsed"][0])
+        except Exception as e:
+            LOG.error("Cannot write the profile to %s: %s", prefix, e)
@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Timing of the startup phases of DEEPaaS.
+
+Each phase (configuration parsing, model discovery and import, workers
+creation, warming, API specification generation, etc.) is recorded with its
+start (relative to the start of the process) and duration, so that we can
+tell why DEEPaaS is slow to become ready.
+"""
+
+import contextlib
+import cProfile
+import os
+import time
+
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+# Recorded phases, in the order they finish
+PHASES = []
+
+_READY = None
+_PROFILER = None
+
+
+def _get_process_start():
+    """Get the time when this process was started."""
+    try:
+        with open("/proc/self/stat") as f:
+            # The process name may contain spaces, skip it
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        started = int(fields[19]) / os.sysconf("SC_CLK_TCK")
+        return time.time() - uptime + started
+    except (OSError, ValueError, IndexError):
+        # Not Linux, use the first time DEEPaaS records something instead
+        return time.time()
+
+
+PROCESS_START = _get_process_start()
+
+
+def enable_profiling():
+    """Profile (with cProfile) the phases that ask for it."""
+    global _PROFILER
+    if _PROFILER is None:
+        _PROFILER = cProfile.Profile()
+
+
+def dump_profile(path):
+    """Dump the profile of the phases recorded so far to a file.
+
+    The file can be inspected with the ``pstats`` module or tools like
+    ``snakeviz``.
+    """
+    if _PROFILER is None:
+        return
+    _PROFILER.dump_stats(path)
+    LOG.info("Startup profile written to %s", path)
+
+
+def record(name, start, duration, **details):
+    """Record a phase that started at start and lasted duration seconds."""
+    PHASES.append(
+        dict(
+            name=name,
+            start=round(start - PROCESS_START, 6),
+            duration=round(duration, 6),
+            **details,
+        )
+    )
+
+
+@contextlib.contextmanager
+def phase(name, profile=False, **details):
+    """Context manager to time a startup phase.
+
+    :param name: name of the phase
+    :param profile: whether to profile the phase, if profiling is enabled
+    :param details: additional information to report with the phase
+    """
+    profiler = _PROFILER if profile else None
+    start = time.time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record(name, start, time.time() - start, **details)
+
+
+def run_timed(func, *args, **kwargs):
+    """Run a function, returning how long it took and the PID that ran it.
+
+    This is used to time the phases that are run in the worker processes.
+
+    :returns: a (result, start, duration, pid) tuple
+    """
+    start = time.time()
+    ret = func(*args, **kwargs)
+    return ret, start, time.time() - start, os.getpid()
+
+
+def mark_ready():
+    """Mark the end of the startup, logging the timing report."""
+    global _READY
+    _READY = time.time()
+    log_report()
+
+
+def get_report():
+    """Get the startup timing report.
+
+    :returns: a dict with whether the startup has finished ("ready"), the
+        seconds since the process started until it finished, or until now
+        ("elapsed") and the list of recorded phases ("phases")
+    """
+    end = _READY or time.time()
+    return {
+        "ready": _READY is not None,
+        "elapsed": round(end - PROCESS_START, 6),
+        "phases": list(PHASES),
+    }
+
+
+def log_report():
+    report = get_report()
+    LOG.info("Startup finished in %.3fs, phases:", report["elapsed"])
+    for p in report["phases"]:
+        details = ", ".join(
+            "%s=%s" % (k, v)
+            for k, v in p.items()
+            if k not in ("name", "start", "duration")
+        )
+        LOG.info(
+            "  %-40s start=%.3fs duration=%.3fs%s",
+            p["name"],
+            p["start"],
+            p["duration"],
+            " (%s)" % details if details else "",
+        )
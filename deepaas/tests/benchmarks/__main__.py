@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Run the micro-benchmarks of the DEEPaaS hot paths.
+
+Usage::
+
+    python -m deepaas.tests.benchmarks [--save FILE] [--compare FILE]
+        [--threshold FRACTION] [BENCHMARK ...]
+"""
+
+import argparse
+import os
+import sys
+
+from deepaas.tests.benchmarks import bench_api  # noqa
+from deepaas.tests.benchmarks import bench_cli  # noqa
+from deepaas.tests.benchmarks import bench_wrapper  # noqa
+from deepaas.tests.benchmarks import runner
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m deepaas.tests.benchmarks")
+    parser.add_argument(
+        "benchmarks",
+        nargs="*",
+        help="benchmarks to run (default: all): %s" % ", ".join(runner.BENCHMARKS),
+    )
+    parser.add_argument("--save", help="write the results to this file")
+    parser.add_argument(
+        "--compare",
+        help=(
+            "compare the results with the baseline stored in this file (e.g. "
+            "one written by --save), failing if it does not exist"
+        ),
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.3,
+        help=(
+            "maximum slowdown (as a fraction) allowed with respect to the "
+            "baseline, before failing (default: 0.3)"
+        ),
+    )
+    parser.add_argument("--repeat", type=int, default=5, help="runs per benchmark")
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(runner.BENCHMARKS)
+    if unknown:
+        parser.error("unknown benchmarks: %s" % ", ".join(sorted(unknown)))
+
+    # Fail before running anything if there is nothing to compare with
+    if args.compare and not os.path.exists(args.compare):
+        print(
+            "No baseline in %s, store one with --save %s"
+            % (args.compare, args.compare),
+            file=sys.stderr,
+        )
+        return 2
+    baseline = runner.load(args.compare) if args.compare else {"results": {}}
+
+    results = runner.run(args.benchmarks, repeat=args.repeat)
+    if args.save:
+        runner.dump(results, args.save)
+
+    rows, regressions = runner.compare(results, baseline, args.threshold)
+    runner.print_comparison(rows, regressions)
+    if regressions:
+        print(
+            "\n%d benchmarks are more than %d%% slower than the baseline"
+            % (len(regressions), args.threshold * 100)
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Micro-benchmarks of the API handlers."""
+
+import datetime
+import itertools
+from unittest import mock
+
+from aiohttp import streams
+from aiohttp import test_utils
+from aiohttp import web
+from webargs import aiohttpparser
+import webargs.core
+
+from deepaas.api.v2 import train
+from deepaas.tests.benchmarks import runner
+from deepaas.tests.benchmarks.runner import benchmark
+from deepaas.tests import fake_v2_model
+
+BOUNDARY = "deepaasbenchmark"
+
+
+def _get_multipart_body(fields, files):
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            'Content-Disposition: form-data; name="%s"\r\n\r\n%s' % (name, value)
+        )
+    for name, value in files.items():
+        parts.append(
+            'Content-Disposition: form-data; name="%s"; filename="%s"\r\n'
+            "Content-Type: application/octet-stream\r\n\r\n%s" % (name, name, value)
+        )
+    body = "".join("--%s\r\n%s\r\n" % (BOUNDARY, part) for part in parts)
+    return (body + "--%s--\r\n" % BOUNDARY).encode()
+
+
+def _make_request(loop, body):
+    payload = streams.StreamReader(mock.Mock(), 2**16, loop=loop)
+    payload.feed_data(body)
+    payload.feed_eof()
+    return test_utils.make_mocked_request(
+        "POST",
+        "/v2/models/deepaas-test/predict/",
+        headers={
+            "Content-Type": "multipart/form-data; boundary=%s" % BOUNDARY,
+            "Content-Length": str(len(body)),
+            "Accept": "application/json",
+        },
+        payload=payload,
+        loop=loop,
+    )
+
+
+@benchmark
+def webargs_parse_predict():
+    """Parsing of the predict arguments of a (multipart) request."""
+    args = fake_v2_model.TestModel().get_predict_args()
+    args["accept"].location = "headers"
+    schema = webargs.core.dict2schema(args)
+    schema.opts.ordered = True
+    body = _get_multipart_body(
+        {"parameter": 1, "parameter_three": "foo"}, {"data": "x" * 1024}
+    )
+
+    with runner.event_loop() as loop:
+
+        def func():
+            request = _make_request(loop, body)
+            loop.run_until_complete(aiohttpparser.parser.parse(schema, request))
+
+        yield func
+
+
+@benchmark
+def json_response():
+    """JSON serialization of a prediction."""
+    prediction = {"status": "OK", "predictions": fake_v2_model.TestModel().predict()}
+    yield lambda: web.json_response(prediction)
+
+
+@benchmark
+def build_train_response():
+    """Building of the response that describes a training."""
+    with runner.event_loop():
+        handler = train._get_handler("deepaas-test", fake_v2_model.TestModel())
+        now = datetime.datetime.now()
+        training = {
+            "start": now,
+            "date": str(now),
+            "args": {"sleep": 1, "parameter_two": "foo"},
+            "status": "done",
+            "priority": 0,
+            "result": {"output": None, "finish_date": str(now), "duration": "1s"},
+            "event_seq": itertools.count(),
+        }
+        yield lambda: handler.build_train_response("uuid", training)
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Benchmarks of the startup of the command line tools."""
+
+import subprocess
+import sys
+
+from deepaas.tests.benchmarks.runner import benchmark
+
+
+@benchmark
+def cli_startup_help():
+    """Startup of deepaas-cli, in a new interpreter, up to its --help."""
+    cmd = [sys.executable, "-m", "deepaas.cmd.cli", "--help"]
+    yield lambda: subprocess.run(cmd, stdout=subprocess.DEVNULL, check=True)
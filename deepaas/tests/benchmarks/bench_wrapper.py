@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Micro-benchmarks of the model wrapper."""
+
+import io
+import os
+
+from aiohttp import web
+from multidict import CIMultiDict
+
+from deepaas.model.v2 import wrapper as v2_wrapper
+from deepaas.tests.benchmarks import runner
+from deepaas.tests.benchmarks.runner import benchmark
+from deepaas.tests import fake_v2_model
+
+
+class _Wrapper(v2_wrapper.ModelWrapper):
+    """Model wrapper without workers, calls to the model are discarded."""
+
+    def _init_executor(self):
+        return None
+
+    def _submit(self, fn, retries=0):
+        # Remove the files spooled by predict()
+        for value in fn.keywords.values():
+            if isinstance(value, v2_wrapper.UploadedFile):
+                os.remove(value.filename)
+
+
+@benchmark
+def pool_apply():
+    """Round trip of a call to a worker (CancellablePool.apply)."""
+    with runner.event_loop() as loop:
+        pool = v2_wrapper.CancellablePool(max_workers=1)
+        try:
+            # Wait for the worker to be started
+            loop.run_until_complete(pool.apply(int))
+            yield lambda: loop.run_until_complete(pool.apply(int))
+        finally:
+            pool.shutdown()
+
+
+@benchmark
+def wrapper_predict_upload():
+    """Spooling of a 1 MiB upload to a file by ModelWrapper.predict."""
+    data = io.BytesIO(b"x" * 1024 * 1024)
+    field = web.FileField(
+        name="data",
+        filename="data.bin",
+        file=data,
+        content_type="application/octet-stream",
+        headers=CIMultiDict(),
+    )
+
+    def func():
+        data.seek(0)
+        wrapper.predict(data=field, parameter=1)
+
+    with runner.event_loop():
+        wrapper = _Wrapper("deepaas-test", fake_v2_model.TestModel())
+        yield func
+
+
+@benchmark
+def validate_response():
+    """Validation of a prediction against the model schema."""
+    model = fake_v2_model.TestModel()
+    prediction = model.predict()
+    with runner.event_loop():
+        wrapper = _Wrapper("deepaas-test", model)
+        yield lambda: wrapper.validate_response(prediction)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Runner of the micro-benchmarks, and comparison against a baseline.
+
+Each benchmark is timed like ``timeit`` does: the number of calls is chosen so
+that a run lasts at least MIN_TIME seconds, and the best time per call out of
+several runs is reported, as it is the least affected by the noise of the
+system.
+"""
+
+import asyncio
+import contextlib
+import json
+import platform
+import sys
+import timeit
+
+import deepaas
+
+BENCHMARKS = {}
+
+MIN_TIME = 0.2
+
+
+def benchmark(func):
+    """Register a benchmark.
+
+    The function does the setup, yields the function to be timed (that gets no
+    arguments) and then does the teardown.
+    """
+    BENCHMARKS[func.__name__] = contextlib.contextmanager(func)
+    return func
+
+
+@contextlib.contextmanager
+def event_loop():
+    """Set an event loop, for the code that needs one."""
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        yield loop
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+
+
+def run_benchmark(name, repeat=5, min_time=None):
+    """Run a benchmark, returning the best time per call (in seconds)."""
+    min_time = min_time or MIN_TIME
+    with BENCHMARKS[name]() as func:
+        timer = timeit.Timer(func)
+        number = 1
+        while True:
+            if timer.timeit(number) >= min_time:
+                break
+            number *= 2
+        return min(timer.repeat(repeat, number)) / number
+
+
+def run(names=None, repeat=5, min_time=None):
+    """Run the benchmarks, returning the results to be stored as JSON."""
+    results = {}
+    for name in names or sorted(BENCHMARKS):
+        results[name] = run_benchmark(name, repeat=repeat, min_time=min_time)
+    return {
+        "deepaas_version": deepaas.extract_version(),
+        "python": sys.version.split()[0],
+        "machine": platform.machine(),
+        "results": results,
+    }
+
+
+def compare(results, baseline, threshold):
+    """Compare the results with a baseline.
+
+    :param threshold: maximum slowdown allowed, as a fraction (e.g. 0.2 means
+        that a benchmark can be 20% slower than in the baseline)
+    :returns: a list of (name, baseline time, time, change) tuples, and the
+        list of the names of the benchmarks that regressed
+    """
+    rows = []
+    regressions = []
+    for name, time in sorted(results["results"].items()):
+        base = baseline["results"].get(name)
+        if base is None:
+            rows.append((name, None, time, None))
+            continue
+        change = time / base - 1
+        rows.append((name, base, time, change))
+        if change > threshold:
+            regressions.append(name)
+    return rows, regressions
+
+
+def _format_time(t):
+    if t is None:
+        return "-"
+    for unit, scale in (("s", 1), ("ms", 1e3), ("us", 1e6)):
+        if t * scale >= 1:
+            return "%.2f %s" % (t * scale, unit)
+    return "%.0f ns" % (t * 1e9)
+
+
+def print_comparison(rows, regressions):
+    print("%-32s %12s %12s %8s" % ("benchmark", "baseline", "current", "change"))
+    for name, base, time, change in rows:
+        print(
+            "%-32s %12s %12s %8s%s"
+            % (
+                name,
+                _format_time(base),
+                _format_time(time),
+                "-" if change is None else "%+.1f%%" % (change * 100),
+                "  REGRESSION" if name in regressions else "",
+            )
+        )
+
+
+def load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def dump(results, path):
+    with open(path, "w") as f:
+        json.dump(results, f, indent=2, sort_keys=True)
@@ -15,16 +15,22 @@
 # under the License.
 
 import base64
+import os
 import time
 
 from webargs import fields
 from webargs import validate
 
 from deepaas import log
+from deepaas.model import v2
 from deepaas.model.v2 import base
+from deepaas import tracing
 
 LOG = log.getLogger(__name__)
 
+# Memory allocated by the BenchModel in this process
+_BENCH_MEMORY = None
+
 
 class TestModel(base.BaseModel):
     """Dummy model implementing minimal functionality.
@@ -106,6 +112,7 @@ class TestModel(base.BaseModel):
         LOG.debug("Got the following kw arguments: %s", kwargs)
         LOG.debug("Starting training, ending in %is" % sleep)
         time.sleep(sleep)
+        v2.report_progress(progress=1.0, message="Training finished", sleep=sleep)
 
     def get_predict_args(self):
         return {
@@ -175,3 +182,74 @@ class TestModel(base.BaseModel):
             "license": "Apache 2.0",
         }
         return d
+
+
+class BenchModel(TestModel):
+    """Model with a tunable cost, used to benchmark DEEPaaS.
+
+    :param cpu_time: CPU seconds spent in each prediction or training
+    :param sleep: seconds that each prediction or training sleeps, e.g. to
+        mimic I/O or a GPU
+    :param output_size: size (in bytes) of the data returned by predictions
+    :param memory: memory (in MiB) allocated by each worker when warming
+    """
+
+    name = "deepaas-bench"
+    schema = None
+
+    def __init__(self, cpu_time=0.0, sleep=0.0, output_size=1024, memory=0):
+        self.cpu_time = cpu_time
+        self.sleep = sleep
+        self.output_size = output_size
+        self.memory = memory
+
+    def _run(self):
+        start = time.perf_counter()
+        with tracing.span("bench_cpu", cpu_time=self.cpu_time):
+            cpu_start = time.process_time()
+            while time.process_time() - cpu_start < self.cpu_time:
+                pass
+        with tracing.span("bench_sleep", sleep=self.sleep):
+            time.sleep(self.sleep)
+        return time.perf_counter() - start
+
+    def warm(self):
+        global _BENCH_MEMORY
+        # The model object is sent to the workers with each call, so the
+        # memory is kept by the (worker) process instead
+        if self.memory and _BENCH_MEMORY is None:
+            # Touch all the pages, so that they are really allocated
+            _BENCH_MEMORY = bytearray(b"\1") * (self.memory * 1024 * 1024)
+
+    def predict(self, **kwargs):
+        duration = self._run()
+        return {
+            "pid": os.getpid(),
+            "duration": duration,
+            "data": "x" * self.output_size,
+        }
+
+    def train(self, **kwargs):
+        duration = self._run()
+        return {"pid": os.getpid(), "duration": duration}
+
+    def get_predict_args(self):
+        return {
+            "data": fields.Field(
+                metadata={
+                    "description": "Data file, ignored.",
+                    "location": "form",
+                    "type": "file",
+                },
+            ),
+        }
+
+    def get_train_args(self):
+        return {}
+
+    def get_metadata(self):
+        return dict(
+            super().get_metadata(),
+            name=self.name,
+            description="Model with a tunable cost, to benchmark DEEPaaS.",
+        )
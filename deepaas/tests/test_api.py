@@ -14,16 +14,24 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import asyncio
 import io
+import json
+import os
 
+import mock
+from oslo_config import cfg
 import pytest
 
 import deepaas
 from deepaas import api
+from deepaas.api import health
 from deepaas.model.v2 import wrapper as v2_wrapper
 from deepaas.tests import fake_responses
 from deepaas.tests import fake_v2_model
 
+CONF = cfg.CONF
+
 
 class TestApiV2:
     @pytest.fixture
@@ -47,6 +55,8 @@ class TestApiV2:
         monkeypatch.setattr(deepaas.model, "register_v2_models", lambda x: None)
 
         app = await api.get_app(enable_doc=False, base_path="/custom")
+        # The models are warmed in the background
+        await health._WARM_TASK
 
         return app
 
@@ -103,3 +113,164 @@ class TestApiV2:
         ret_meta["links"][0]["href"] = "/v2/models/deepaas-test"
 
         assert meta["models"][0] == ret_meta
+
+    async def test_startup_report(self, client):
+        ret = await client.get("/custom/v2/debug/startup/")
+        assert 200 == ret.status
+
+        report = await ret.json()
+        assert report["ready"]
+        phases = {p["name"]: p for p in report["phases"]}
+        assert {"routes", "warm", "warm_worker", "apispec"} <= set(phases)
+        assert "deepaas-test" == phases["warm"]["model"]
+        assert phases["warm_worker"]["pid"] != os.getpid()
+        for p in report["phases"]:
+            assert 0 <= p["start"] <= report["elapsed"]
+            assert 0 <= p["duration"]
+
+    async def test_health(self, client):
+        ret = await client.get("/custom/healthz")
+        assert 200 == ret.status
+        assert {"status": "ok"} == await ret.json()
+
+        ret = await client.get("/custom/readyz")
+        assert 200 == ret.status
+        assert {
+            "status": "ready",
+            "models": {
+                "deepaas-test": {
+                    "workers": 1,
+                    "busy": 0,
+                    "queued": 0,
+                    "crashes": 0,
+                    "restarting": 0,
+                    "warm": True,
+                }
+            },
+        } == await ret.json()
+
+    async def test_spec(self, client):
+        ret = await client.get(
+            "/custom/swagger.json", headers={"Accept-Encoding": "identity"}
+        )
+        assert 200 == ret.status
+        assert "Content-Encoding" not in ret.headers
+        spec = await ret.json()
+        assert "/custom/v2/models/deepaas-test/predict/" in spec["paths"]
+        train = spec["paths"]["/custom/v2/models/deepaas-test/train/"]["post"]
+        assert "priority" in [p["name"] for p in train["parameters"]]
+        etag = ret.headers["ETag"]
+
+        ret = await client.get(
+            "/custom/swagger.json", headers={"Accept-Encoding": "gzip"}
+        )
+        assert "gzip" == ret.headers["Content-Encoding"]
+        assert spec == await ret.json()
+
+        ret = await client.get("/custom/swagger.json", headers={"If-None-Match": etag})
+        assert 304 == ret.status
+
+
+async def test_spec_file(aiohttp_client, monkeypatch, tmp_path):
+    spec_file = tmp_path / "swagger.json"
+    CONF.set_override("spec_file", str(spec_file))
+
+    async def get_spec():
+        w = v2_wrapper.ModelWrapper("deepaas-test", fake_v2_model.TestModel(), None)
+        monkeypatch.setattr(api, "APP", None)
+        monkeypatch.setattr(deepaas.model, "V2_MODELS", {"deepaas-test": w})
+        monkeypatch.setattr(deepaas.model, "register_v2_models", lambda x: None)
+        app = await api.get_app(enable_doc=False)
+        await health._WARM_TASK
+        client = await aiohttp_client(app)
+        ret = await client.get("/swagger.json")
+        return await ret.json()
+
+    try:
+        spec = await get_spec()
+        assert spec == json.loads(spec_file.read_text())
+
+        # The stored specification is used instead of introspecting the API
+        spec_file.write_text(json.dumps(dict(spec, info={"title": "foo"})))
+        with mock.patch("aiohttp_apispec.AiohttpApiSpec.register") as m:
+            assert {"title": "foo"} == (await get_spec())["info"]
+        m.assert_not_called()
+
+        # Unless it was generated for something else
+        spec_file.write_text(json.dumps(dict(spec, **{"x-deepaas-spec-key": "foo"})))
+        assert spec == await get_spec()
+    finally:
+        CONF.clear_override("spec_file")
+
+
+async def test_app_factory(monkeypatch):
+    monkeypatch.setenv("DEEPAAS_ARGS", "--notrain-endpoint --model-name foo")
+    with mock.patch("deepaas.config.setup") as m_setup:
+        with mock.patch.object(api, "get_app", mock.AsyncMock()) as m_get_app:
+            app = await api.app_factory()
+    m_setup.assert_called_once_with(
+        ["deepaas", "--notrain-endpoint", "--model-name", "foo"]
+    )
+    assert app is m_get_app.return_value
+    m_get_app.assert_awaited_once_with(
+        enable_doc=CONF.doc_endpoint,
+        enable_train=CONF.train_endpoint,
+        enable_predict=CONF.predict_endpoint,
+        base_path="",
+    )
+
+
+async def test_app_factory_base_path(monkeypatch, aiohttp_client):
+    monkeypatch.setattr(api, "APP", None)
+    monkeypatch.setattr(deepaas.model, "V2_MODELS", {})
+    monkeypatch.setattr(deepaas.model, "register_v2_models", lambda x: None)
+    CONF.set_override("base_path", "/custom/")
+    try:
+        with mock.patch("deepaas.config.setup"):
+            app = await api.app_factory()
+        await health._WARM_TASK
+        client = await aiohttp_client(app)
+
+        ret = await client.get("/custom/v2/models/")
+        assert 200 == ret.status
+        ret = await client.get("/v2/models/")
+        assert 404 == ret.status
+    finally:
+        CONF.clear_override("base_path")
+
+
+def test_normalize_base_path():
+    assert "" == api.normalize_base_path("")
+    assert "" == api.normalize_base_path(None)
+    assert "/custom" == api.normalize_base_path("/custom/")
+    assert "/custom/path" == api.normalize_base_path("/custom//path")
+    with pytest.raises(ValueError):
+        api.normalize_base_path("custom")
+
+
+class _SlowWarmModel(object):
+    def __init__(self, running):
+        self.running = running
+        self.semaphore = None
+
+    async def warm(self, semaphore=None):
+        self.semaphore = semaphore
+        self.running.append(self)
+        await asyncio.sleep(0.01)
+        # All the models are warmed at the same time
+        assert 2 == len(self.running)
+
+
+async def test_warm_models(monkeypatch):
+    running = []
+    models = {"foo": _SlowWarmModel(running), "bar": _SlowWarmModel(running)}
+    monkeypatch.setattr(deepaas.model, "V2_MODELS", models)
+
+    CONF.set_override("warm_concurrency", 3)
+    try:
+        await api._warm_models()
+    finally:
+        CONF.clear_override("warm_concurrency")
+    foo, bar = models.values()
+    assert foo.semaphore is bar.semaphore
+    assert 3 == foo.semaphore._value
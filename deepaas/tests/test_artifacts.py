@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import struct
+
+import pytest
+
+from deepaas.model.v2 import artifacts
+
+
+@pytest.fixture(autouse=True)
+def artifacts_dir(monkeypatch, tmp_path):
+    monkeypatch.setenv(artifacts.ENV_VAR, str(tmp_path))
+    monkeypatch.setattr(artifacts, "_MAPS", {})
+    return tmp_path
+
+
+def _write_safetensors(path, tensors, metadata=None):
+    header = {}
+    data = b""
+    for name, (dtype, shape, raw) in tensors.items():
+        header[name] = {
+            "dtype": dtype,
+            "shape": shape,
+            "data_offsets": [len(data), len(data) + len(raw)],
+        }
+        data += raw
+    if metadata:
+        header["__metadata__"] = metadata
+    header = json.dumps(header).encode()
+    path.write_bytes(struct.pack("<Q", len(header)) + header + data)
+
+
+def test_map_file(artifacts_dir):
+    (artifacts_dir / "foo").write_bytes(b"foo")
+    (artifacts_dir / "empty").write_bytes(b"")
+
+    view = artifacts.map_file("foo")
+    assert b"foo" == bytes(view)
+    assert view.readonly
+    assert view is artifacts.map_file(str(artifacts_dir / "foo"))
+    assert b"" == bytes(artifacts.map_file("empty"))
+
+
+def test_read_safetensors(artifacts_dir):
+    _write_safetensors(
+        artifacts_dir / "model.safetensors",
+        {
+            "a": ("F32", [2], struct.pack("<2f", 1, 2)),
+            "b": ("BF16", [1, 1], b"\x80\x3f"),
+        },
+        metadata={"format": "pt"},
+    )
+    tensors, metadata = artifacts.read_safetensors("model.safetensors")
+    assert {"format": "pt"} == metadata
+    assert ("F32", (2,)) == tensors["a"][:2]
+    assert (1.0, 2.0) == struct.unpack("<2f", tensors["a"].data)
+    assert ("BF16", (1, 1)) == tensors["b"][:2]
+    assert b"\x80\x3f" == bytes(tensors["b"].data)
+
+
+def test_load_safetensors(artifacts_dir):
+    numpy = pytest.importorskip("numpy")
+    a = numpy.arange(6, dtype="<f4").reshape(2, 3)
+    b = numpy.array([1, -1], dtype="<i8")
+    _write_safetensors(
+        artifacts_dir / "model.safetensors",
+        {"a": ("F32", [2, 3], a.tobytes()), "b": ("I64", [2], b.tobytes())},
+    )
+    arrays = artifacts.load_safetensors("model.safetensors")
+    numpy.testing.assert_array_equal(a, arrays["a"])
+    numpy.testing.assert_array_equal(b, arrays["b"])
+    assert not arrays["a"].flags.writeable
+
+    _write_safetensors(
+        artifacts_dir / "bf16.safetensors", {"a": ("BF16", [1], b"\x80\x3f")}
+    )
+    with pytest.raises(ValueError):
+        artifacts.load_safetensors("bf16.safetensors")
+
+
+def test_load_npy(artifacts_dir):
+    numpy = pytest.importorskip("numpy")
+    a = numpy.arange(10)
+    numpy.save(artifacts_dir / "a.npy", a)
+    loaded = artifacts.load_npy("a.npy")
+    numpy.testing.assert_array_equal(a, loaded)
+    assert isinstance(loaded, numpy.memmap)
+
+
+def test_load_npz(artifacts_dir):
+    numpy = pytest.importorskip("numpy")
+    a = numpy.arange(10, dtype="f8")
+    b = numpy.asfortranarray(numpy.arange(6).reshape(2, 3))
+    c = numpy.array([{"foo": 1}], dtype=object)
+    numpy.savez(artifacts_dir / "arrays.npz", a=a, b=b)
+    numpy.savez_compressed(artifacts_dir / "compressed.npz", a=a)
+
+    arrays = artifacts.load_npz("arrays.npz")
+    numpy.testing.assert_array_equal(a, arrays["a"])
+    numpy.testing.assert_array_equal(b, arrays["b"])
+    view = artifacts.map_file("arrays.npz")
+    for array in arrays.values():
+        # The arrays use the memory of the mapping
+        assert not array.flags.writeable
+        assert numpy.shares_memory(array, numpy.frombuffer(view, dtype="u1"))
+
+    arrays = artifacts.load_npz("compressed.npz")
+    numpy.testing.assert_array_equal(a, arrays["a"])
+
+    numpy.savez(artifacts_dir / "objects.npz", c=c)
+    with pytest.raises(ValueError):
+        # Object arrays are read, and they need allow_pickle
+        artifacts.load_npz("objects.npz")
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import time
+import uuid
+
+from aiohttp import web
+import pytest
+
+from deepaas.cmd import bench
+from deepaas.tests import fake_v2_model
+
+
+def test_bench_model():
+    model = fake_v2_model.BenchModel(cpu_time=0.01, sleep=0.01, output_size=10)
+    start = time.process_time()
+    ret = model.predict(data=None)
+    assert time.process_time() - start >= 0.01
+    assert ret["duration"] >= 0.02
+    assert "x" * 10 == ret["data"]
+    assert "duration" in model.train()
+    assert "deepaas-bench" == model.get_metadata()["name"]
+
+
+def test_percentile():
+    values = [1, 2, 3, 4, 5]
+    assert 3 == bench._percentile(values, 50)
+    assert 5 == bench._percentile(values, 100)
+    assert 4.5 == bench._percentile(values, 87.5)
+    assert 7 == bench._percentile([7], 99)
+
+
+def test_get_stages():
+    trace = {"create_start": 1.0, "create_end": 1.5, "headers": 3.0}
+    assert {"connect": 0.5, "server": 1.5, "transfer": 1.0} == bench._get_stages(
+        1.0, trace, 4.0
+    )
+
+
+@pytest.fixture
+async def server(aiohttp_server):
+    model = fake_v2_model.BenchModel(sleep=0.005)
+    trainings = {}
+
+    async def predict(request):
+        await request.post()
+        if request.query.get("fail"):
+            raise web.HTTPInternalServerError()
+        return web.json_response({"status": "OK", "predictions": model.predict()})
+
+    async def train(request):
+        uuid_ = uuid.uuid4().hex
+        trainings[uuid_] = model.train()
+        return web.json_response({"uuid": uuid_, "status": "running"})
+
+    async def get_training(request):
+        output = trainings[request.match_info["uuid"]]
+        return web.json_response({"status": "done", "result": {"output": output}})
+
+    app = web.Application()
+    prefix = "/v2/models/deepaas-bench"
+    app.router.add_post(prefix + "/predict/", predict)
+    app.router.add_post(prefix + "/train/", train)
+    app.router.add_get(prefix + "/train/{uuid}", get_training)
+    return await aiohttp_server(app)
+
+
+@pytest.mark.parametrize("rate", [0, 100])
+async def test_benchmark(server, rate):
+    b = bench.Benchmark(str(server.make_url("")), input_size=10)
+    duration = await b.run(0.2, warmup=0.05, concurrency=2, rate=rate)
+    report = bench.get_report(b, duration)
+
+    assert report["requests"] > 0
+    assert {} == report["errors"]
+    assert report["throughput"] == round(report["requests"] / 0.2, 3)
+    assert {"total", "connect", "server", "model", "transfer"} == set(report["latency"])
+    total = report["latency"]["total"]
+    assert total["p50"] <= total["p95"] <= total["p99"] <= total["max"]
+    assert report["latency"]["model"]["p50"] >= 0.005
+
+
+async def test_benchmark_train(server):
+    b = bench.Benchmark(str(server.make_url("")), endpoint="train")
+    duration = await b.run(0.1, concurrency=1)
+    report = bench.get_report(b, duration)
+    assert report["requests"] > 0
+    assert "training" in report["latency"]
+
+
+async def test_benchmark_errors(server):
+    b = bench.Benchmark(str(server.make_url("")))
+    b.url += "?fail=1"
+    await b.run(0.1, concurrency=1)
+    report = bench.get_report(b, 0.1)
+    assert 0 == report["requests"]
+    assert report["errors"]["HTTP 500"] > 0
+    bench.print_report(report)
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import pytest
+
+from deepaas.tests.benchmarks import __main__ as benchmarks
+from deepaas.tests.benchmarks import runner
+
+
+@pytest.fixture
+def fake_benchmarks(monkeypatch):
+    monkeypatch.setattr(runner, "BENCHMARKS", {})
+    monkeypatch.setattr(runner, "MIN_TIME", 0.001)
+    calls = []
+
+    @runner.benchmark
+    def foo():
+        calls.append("setup")
+        yield lambda: sum(range(10))
+        calls.append("teardown")
+
+    return calls
+
+
+def test_run_benchmark(fake_benchmarks):
+    t = runner.run_benchmark("foo", repeat=2)
+    assert 0 < t < 0.001
+    assert ["setup", "teardown"] == fake_benchmarks
+
+
+def test_compare():
+    baseline = {"results": {"foo": 1.0, "bar": 1.0}}
+    results = {"results": {"foo": 1.1, "bar": 1.5, "baz": 1.0}}
+    rows, regressions = runner.compare(results, baseline, 0.2)
+    assert ["bar"] == regressions
+    assert ("baz", None, 1.0, None) in rows
+    runner.print_comparison(rows, regressions)
+
+
+def test_main(fake_benchmarks, tmp_path, monkeypatch):
+    baseline = tmp_path / "baseline.json"
+    # A missing baseline is an error, and it is not created
+    assert 2 == benchmarks.main(["--compare", str(baseline), "--repeat", "1"])
+    assert [] == fake_benchmarks
+    assert not baseline.exists()
+
+    assert 0 == benchmarks.main(["--save", str(baseline), "--repeat", "1"])
+    # Only check that the comparison runs, the timings are too noisy here
+    argv = ["--compare", str(baseline), "--repeat", "1", "--threshold", "100"]
+    assert 0 == benchmarks.main(argv)
+    results = runner.load(baseline)
+    assert {"foo"} == set(results["results"])
+
+    # Much faster than now
+    results["results"]["foo"] /= 10
+    runner.dump(results, baseline)
+    assert 1 == benchmarks.main(["--compare", str(baseline), "--repeat", "1"])
+
+    with pytest.raises(SystemExit):
+        benchmarks.main(["bar"])
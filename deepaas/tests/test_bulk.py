@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import json
+import os
+
+import pytest
+
+from deepaas.cmd import _bulk
+from deepaas.cmd import cli
+from deepaas.tests import fake_v2_model
+
+
+class RecordingModel(fake_v2_model.TestModel):
+    def __init__(self):
+        self.calls = []
+
+    def predict(self, **kwargs):
+        self.calls.append(kwargs)
+        data = kwargs["data"]
+        if "bad" in data.original_filename:
+            raise ValueError("bad input")
+        with open(data.filename) as f:
+            return {"content": f.read(), "parameter": kwargs["parameter"]}
+
+
+@pytest.fixture
+def model():
+    return RecordingModel()
+
+
+@pytest.fixture
+def method_args(model):
+    fields_in = model.get_predict_args()
+    return cli._fields_to_dict(fields_in), cli._get_file_args(fields_in)
+
+
+@pytest.fixture
+def input_dir(tmp_path):
+    d = tmp_path / "inputs"
+    (d / "sub").mkdir(parents=True)
+    for name in ("a.txt", "b.txt", "sub/c.txt"):
+        (d / name).write_text(name)
+    return d
+
+
+def test_inputs_from_directory(input_dir, method_args):
+    inputs = _bulk.get_inputs(str(input_dir), *method_args)
+    assert ["a.txt", "b.txt", os.path.join("sub", "c.txt")] == [
+        name for _, name, _ in inputs
+    ]
+    assert {"data": str(input_dir / "a.txt")} == inputs[0][2]
+
+
+def test_inputs_from_glob(input_dir, method_args):
+    inputs = _bulk.get_inputs(str(input_dir / "**" / "c.txt"), *method_args)
+    assert [(str(input_dir / "sub" / "c.txt"), "c.txt")] == [
+        (key, name) for key, name, _ in inputs
+    ]
+
+
+def test_inputs_bad_file_argument(input_dir, method_args):
+    with pytest.raises(_bulk.BulkError):
+        _bulk.get_inputs(str(input_dir), *method_args, file_arg="parameter")
+
+
+def test_inputs_from_manifest(input_dir, method_args):
+    manifest = input_dir / "manifest.csv"
+    manifest.write_text("data,parameter\na.txt,1\nsub/c.txt,2\n")
+    inputs = _bulk.get_inputs(str(manifest), *method_args)
+    assert [
+        ("row-1", "row-1", {"data": str(input_dir / "a.txt"), "parameter": 1}),
+        ("row-2", "row-2", {"data": str(input_dir / "sub/c.txt"), "parameter": 2}),
+    ] == inputs
+
+    manifest = input_dir / "manifest.jsonl"
+    manifest.write_text('{"data": "b.txt", "parameter": 3}\n{"foo": 1}\n')
+    with pytest.raises(_bulk.BulkError):
+        _bulk.get_inputs(str(manifest), *method_args)
+
+
+def test_check_inputs(input_dir, method_args):
+    inputs = _bulk.get_inputs(str(input_dir), *method_args)
+    with pytest.raises(_bulk.BulkError) as e:
+        _bulk.check_inputs(inputs, method_args[0], {"parameter": None})
+    assert "parameter" in str(e.value)
+    _bulk.check_inputs(inputs, method_args[0], {"parameter": 1})
+
+    manifest = input_dir / "manifest.jsonl"
+    manifest.write_text('{"data": "a.txt", "parameter": 1}\n{"data": "b.txt"}\n')
+    inputs = _bulk.get_inputs(str(manifest), *method_args)
+    with pytest.raises(_bulk.BulkError) as e:
+        _bulk.check_inputs(inputs, method_args[0], {})
+    assert "row-2" in str(e.value)
+
+
+def test_run_combined_and_resume(tmp_path, input_dir, model, method_args):
+    (input_dir / "bad.txt").write_text("bad")
+    inputs = _bulk.get_inputs(str(input_dir), *method_args)
+    output = str(tmp_path / "out" / "results.jsonl")
+
+    ret = _bulk.run("foo", model, inputs, output, {"parameter": 5}, method_args[1])
+    assert {"inputs": 4, "processed": 3, "failed": 1} == ret
+    assert 4 == len(model.calls)
+
+    with open(output) as f:
+        lines = [json.loads(line) for line in f]
+    assert {"content": "a.txt", "parameter": 5} == lines[0]["output"]
+    errors = [line for line in lines if "error" in line]
+    assert [str(input_dir / "bad.txt")] == [line["input"] for line in errors]
+    assert "ValueError: bad input" == errors[0]["error"]
+    assert 3 == len(_bulk.read_checkpoint(output + ".checkpoint"))
+
+    # Only the failed input is processed again
+    model.calls.clear()
+    ret = _bulk.run("foo", model, inputs, output, {"parameter": 5}, method_args[1])
+    assert {"inputs": 4, "processed": 3, "failed": 1} == ret
+    assert 1 == len(model.calls)
+
+
+def test_run_per_input_outputs(tmp_path, input_dir, model, method_args):
+    inputs = _bulk.get_inputs(str(input_dir), *method_args)
+    output = tmp_path / "out"
+    checkpoint = tmp_path / "checkpoint"
+
+    ret = _bulk.run(
+        "foo",
+        model,
+        inputs,
+        str(output),
+        {"parameter": 1},
+        method_args[1],
+        checkpoint=str(checkpoint),
+    )
+    assert {"inputs": 3, "processed": 3, "failed": 0} == ret
+    result = json.loads((output / "sub" / "c.txt.json").read_text())
+    assert {"content": "sub/c.txt", "parameter": 1} == result
+    assert checkpoint.exists()
+
+
+def test_run_removes_staged_files(tmp_path, input_dir, model, method_args):
+    inputs = _bulk.get_inputs(str(input_dir), *method_args)
+    staged = []
+
+    def predict(**kwargs):
+        # The files of the previous inputs are already removed
+        assert not any(os.path.exists(f) for f in staged)
+        staged.append(kwargs["data"].filename)
+        return {}
+
+    model.predict = predict
+    output = str(tmp_path / "results.jsonl")
+    ret = _bulk.run("foo", model, inputs, output, {"parameter": 1}, method_args[1])
+    assert {"inputs": 3, "processed": 3, "failed": 0} == ret
+    assert 3 == len(staged)
+    assert not any(os.path.exists(f) for f in staged)
+    assert (input_dir / "a.txt").exists()
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+
+import pytest
+
+from deepaas.cmd import _daemon
+from deepaas.cmd import cli
+from deepaas.tests import fake_v2_model
+
+# Modules that must not be imported just to start the CLI
+HEAVY_MODULES = ("aiohttp", "marshmallow", "webargs", "deepaas.model.v2.wrapper")
+
+
+def _run(code):
+    return subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, text=True, check=True
+    )
+
+
+def test_import_is_lightweight():
+    ret = _run(
+        "import sys; import deepaas.cmd.cli; "
+        "print(','.join(m for m in %r if m in sys.modules))" % (HEAVY_MODULES,)
+    )
+    assert "" == ret.stdout.strip()
+
+
+def test_help_does_not_load_model():
+    ret = _run(
+        "import sys; sys.argv = ['deepaas-cli', '--help']\n"
+        "from deepaas.cmd import cli\n"
+        "try:\n"
+        "    cli.main()\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        "print('loaded:' + ','.join(m for m in %r if m in sys.modules))"
+        % (HEAVY_MODULES,)
+    )
+    assert "predict" in ret.stdout
+    assert "loaded:" == ret.stdout.strip().splitlines()[-1]
+
+
+@pytest.mark.parametrize(
+    "argv,expected",
+    [
+        ([], ("", None)),
+        (["warm"], ("", "warm")),
+        (["--model-name", "foo", "predict", "--foo", "1"], ("foo", "predict")),
+        (["--model_name=bar", "train"], ("bar", "train")),
+        # Only the first positional argument is the method
+        (["--deepaas_method_output", "train", "predict"], ("", "predict")),
+        (["--deepaas_daemon", "--log-level", "warm", "train"], ("", "train")),
+        (["--model-name", "predict"], ("predict", None)),
+        (["foo", "predict"], ("", None)),
+        (["predict", "--model-name", "foo"], ("", "predict")),
+        (["predict", "--mode", "train"], ("", "predict")),
+    ],
+)
+def test_peek_argv(argv, expected, monkeypatch):
+    monkeypatch.setattr(cli.CONF, "model_name", "", raising=False)
+    assert expected == cli._peek_argv(argv)
+
+
+def test_method_args(monkeypatch):
+    model = fake_v2_model.TestModel()
+    monkeypatch.setattr(cli, "_get_model", lambda name: (name, model))
+    cli._get_method_args.cache_clear()
+
+    args, file_args = cli._get_method_args("foo", "predict")
+    assert {"data", "parameter", "parameter_three", "accept"} == set(args)
+    assert int is args["parameter"]["type"]
+    assert ["data"] == file_args
+
+    assert ({}, []) == cli._get_method_args("foo", "warm")
+    cli._get_method_args.cache_clear()
+
+
+def _fake_method(argv):
+    if argv == ["--help"]:
+        print("usage: deepaas-cli")
+        sys.exit(0)
+    if argv == ["fail"]:
+        raise ValueError("failed")
+    return {"argv": argv, "cwd": os.getcwd()}
+
+
+@pytest.fixture
+def daemon(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    server = _daemon.make_server(path, _fake_method)
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+    yield path
+    server.shutdown()
+    server.server_close()
+    t.join()
+
+
+def test_daemon_forward(daemon, tmp_path, monkeypatch, capsys):
+    monkeypatch.chdir(tmp_path)
+    ret = _daemon.replay(_daemon.forward(daemon, ["predict", "--parameter", "1"]))
+    assert {"argv": ["predict", "--parameter", "1"], "cwd": str(tmp_path)} == ret
+
+    with pytest.raises(SystemExit) as e:
+        _daemon.replay(_daemon.forward(daemon, ["--help"]))
+    assert 0 == e.value.code
+    assert "usage: deepaas-cli\n" == capsys.readouterr().out
+
+    with pytest.raises(SystemExit) as e:
+        _daemon.replay(_daemon.forward(daemon, ["fail"]))
+    assert 1 == e.value.code
+    assert "ValueError: failed" in capsys.readouterr().err
+
+    with pytest.raises(RuntimeError):
+        _daemon.make_server(daemon, _fake_method)
+
+
+def test_daemon_not_running(tmp_path):
+    assert _daemon.forward(str(tmp_path / "daemon.sock"), []) is None
+
+
+def test_daemon_other_user(daemon, monkeypatch):
+    uid = os.getuid()
+    monkeypatch.setattr(_daemon.os, "getuid", lambda: uid + 1)
+    assert _daemon.forward(daemon, ["warm"]) is None
+
+
+def test_daemon_timeout(tmp_path):
+    path = str(tmp_path / "daemon.sock")
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(path)
+    server.listen()
+    try:
+        with pytest.raises(TimeoutError):
+            _daemon.forward(path, ["warm"], timeout=0.1)
+    finally:
+        server.close()
+
+
+def test_socket_path(tmp_path, monkeypatch):
+    runtime_dir = tmp_path / "run"
+    runtime_dir.mkdir(mode=0o700)
+    monkeypatch.setenv("XDG_RUNTIME_DIR", str(runtime_dir))
+    assert str(runtime_dir / "deepaas-cli-foo.sock") == _daemon.get_socket_path("foo")
+
+    runtime_dir.chmod(0o755)
+    with pytest.raises(RuntimeError):
+        _daemon.get_socket_path("foo")
+
+    monkeypatch.delenv("XDG_RUNTIME_DIR")
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    path = _daemon.get_socket_path()
+    private_dir = os.path.dirname(path)
+    assert str(tmp_path) == os.path.dirname(private_dir)
+    assert 0o700 == os.stat(private_dir).st_mode & 0o777
+
+
+@pytest.mark.parametrize(
+    "argv,expected",
+    [
+        ([], False),
+        (["--deepaas_daemon"], True),
+        (["--deepaas_daemon=true"], True),
+        (["--deepaas_daemon=False"], False),
+        (["--deepaas_daemon", "--nodeepaas_daemon"], False),
+        (["--deepaas_daemon_socket", "foo"], False),
+        (["predict", "--", "--deepaas_daemon"], False),
+    ],
+)
+def test_is_daemon(argv, expected):
+    assert expected == cli._is_daemon(argv)
+
+
+def test_main_forwards_to_daemon(daemon, monkeypatch):
+    argv = ["--deepaas_daemon_socket", daemon, "warm"]
+    monkeypatch.setattr(sys, "argv", ["deepaas-cli"] + argv)
+    monkeypatch.setattr(cli, "_run_method", None)
+    assert argv == cli.main()["argv"]
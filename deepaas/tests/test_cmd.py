@@ -14,6 +14,8 @@
 # License for the specific language governing permissions and limitations
 # under the License.
 
+import os
+import socket
 import sys
 
 import mock
@@ -39,6 +41,8 @@ async def test_run(m_get_app, m_run_app, m_handle_signals):
         mock.ANY,
         host="127.0.0.1",
         port=5000,
+        backlog=128,
+        keepalive_timeout=75.0,
     )
     m_handle_signals.assert_called_once()
 
@@ -73,5 +77,158 @@ async def test_run_custom_ip_port(
         mock.ANY,
         host=ip,
         port=port,
+        backlog=128,
+        keepalive_timeout=75.0,
     )
     m_handle_signals.assert_called_once()
+
+
+@mock.patch("deepaas.api.spec.dump")
+@mock.patch("aiohttp.web.run_app")
+@mock.patch("deepaas.api.get_app")
+def test_run_dump_spec(m_get_app, m_run_app, m_dump, cfg_fixture, monkeypatch):
+    monkeypatch.setattr(deepaas.config, "setup", lambda x: None)
+    app = mock.MagicMock()
+    app.cleanup = mock.AsyncMock()
+    m_get_app.return_value = app
+
+    cfg_fixture("dump_spec", "/tmp/spec.json")
+    try:
+        with mock.patch.object(sys, "argv", ["deepaas-run"]):
+            run.main()
+    finally:
+        for flag in ("dump_spec", "warm", "spec_file"):
+            CONF.clear_override(flag)
+    m_run_app.assert_not_called()
+    m_dump.assert_called_once_with(app["swagger_dict"], "/tmp/spec.json")
+    app.cleanup.assert_awaited_once()
+
+
+@pytest.mark.parametrize(
+    "workers,http_workers,expected",
+    [(1, 1, [1]), (4, 2, [2, 2]), (3, 2, [2, 1]), (3, 3, [1, 1, 1])],
+)
+def test_get_workers_share(workers, http_workers, expected):
+    shares = [run._get_workers_share(workers, http_workers, i) for i in range(3)]
+    assert shares[: len(expected)] == expected
+
+
+@mock.patch("multiprocessing.connection.wait")
+@mock.patch("multiprocessing.get_context")
+@mock.patch("deepaas.cmd._shutdown.handle_signals")
+@mock.patch("aiohttp.web.run_app")
+def test_run_http_workers(
+    m_run_app, m_handle_signals, m_get_context, m_wait, cfg_fixture, monkeypatch
+):
+    monkeypatch.setattr(deepaas.config, "setup", lambda x: None)
+    m_proc = m_get_context.return_value.Process
+    m_proc.return_value.is_alive.return_value = False
+    m_proc.return_value.exitcode = 0
+
+    cfg_fixture("http_workers", 3)
+    cfg_fixture("workers", 3)
+    try:
+        with mock.patch.object(sys, "argv", ["deepaas-run"]):
+            run.main()
+    finally:
+        CONF.clear_override("http_workers")
+        CONF.clear_override("workers")
+    m_get_context.assert_called_once_with("fork")
+    assert m_proc.call_count == 3
+    assert m_proc.return_value.start.call_count == 3
+    m_wait.assert_called_once()
+    m_run_app.assert_not_called()
+
+
+@mock.patch("multiprocessing.get_context")
+@mock.patch("deepaas.cmd._shutdown.handle_signals")
+@mock.patch("aiohttp.web.run_app")
+def test_run_http_workers_few_workers(
+    m_run_app, m_handle_signals, m_get_context, cfg_fixture, monkeypatch
+):
+    monkeypatch.setattr(deepaas.config, "setup", lambda x: None)
+    cfg_fixture("http_workers", 3)
+    cfg_fixture("workers", 2)
+    try:
+        with mock.patch.object(sys, "argv", ["deepaas-run"]):
+            with pytest.raises(SystemExit) as e:
+                run.main()
+    finally:
+        CONF.clear_override("http_workers")
+        CONF.clear_override("workers")
+    assert 1 == e.value.code
+    m_get_context.assert_not_called()
+    m_run_app.assert_not_called()
+
+
+@mock.patch("aiohttp.web.run_app")
+@mock.patch("deepaas.api.get_app")
+def test_serve_front_end(m_get_app, m_run_app):
+    CONF.set_override("workers", 3)
+    CONF.set_override("http_workers", 2)
+    try:
+        run._serve_front_end(1, {}, {"host": "::1", "port": 5000})
+        assert CONF.workers == 1
+    finally:
+        for flag in ("workers", "http_workers"):
+            CONF.clear_override(flag)
+    m_get_app.assert_called_once_with()
+    m_run_app.assert_called_once_with(
+        mock.ANY,
+        host="::1",
+        port=5000,
+        backlog=128,
+        keepalive_timeout=75.0,
+        print=None,
+    )
+
+
+@mock.patch("deepaas.cmd._shutdown.handle_signals")
+@mock.patch("aiohttp.web.run_app")
+@mock.patch("deepaas.api.get_app")
+def test_run_unix_socket(
+    m_get_app, m_run_app, m_handle_signals, cfg_fixture, monkeypatch, tmp_path
+):
+    monkeypatch.setattr(deepaas.config, "setup", lambda x: None)
+    path = str(tmp_path / "deepaas.sock")
+
+    def run_app(app, sock, **kwargs):
+        assert sock.family == socket.AF_UNIX
+        assert sock.getsockname() == path
+        assert os.path.exists(path)
+        sock.close()
+
+    m_run_app.side_effect = run_app
+
+    cfg_fixture("listen_socket", path)
+    cfg_fixture("access_log", False)
+    cfg_fixture("keepalive_timeout", 5)
+    try:
+        with mock.patch.object(sys, "argv", ["deepaas-run"]):
+            run.main()
+    finally:
+        for flag in ("listen_socket", "access_log", "keepalive_timeout"):
+            CONF.clear_override(flag)
+    m_run_app.assert_called_once_with(
+        mock.ANY,
+        sock=mock.ANY,
+        backlog=128,
+        keepalive_timeout=5,
+        access_log=None,
+    )
+    # The socket is removed on exit
+    assert not os.path.exists(path)
+
+
+def test_bind_unix_socket_stale(tmp_path):
+    path = str(tmp_path / "deepaas.sock")
+    run._bind_unix_socket(path, 1).close()
+    assert os.path.exists(path)
+    sock = run._bind_unix_socket(path, 1)
+    sock.close()
+
+    other = tmp_path / "not-a-socket"
+    other.write_text("foo")
+    with pytest.raises(OSError):
+        run._bind_unix_socket(str(other), 1)
+    assert other.read_text() == "foo"
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gzip
+import json
+
+from aiohttp import web
+from oslo_config import cfg
+import pytest
+
+from deepaas.api import compression
+
+CONF = cfg.CONF
+
+DATA = {"predictions": ["foo"] * 1000}
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        (None, None),
+        ("", None),
+        ("gzip", "gzip"),
+        ("deflate, gzip;q=0.5", "gzip"),
+        ("gzip;q=0", None),
+        ("identity", None),
+        ("GZIP ; q=0.8, foo", "gzip"),
+    ],
+)
+def test_get_encoding(header, expected):
+    assert expected == compression.get_encoding(header)
+
+
+def test_get_encoding_preference():
+    available = {"gzip": None, "br": None}
+    assert "br" == compression.get_encoding("gzip, br", available)
+    assert "gzip" == compression.get_encoding("gzip, br;q=0.5", available)
+    assert "br" == compression.get_encoding("*", available)
+    assert "gzip" == compression.get_encoding("*, br;q=0", available)
+
+
+def test_is_compressible():
+    assert compression.is_compressible("application/json")
+    assert compression.is_compressible("text/csv")
+    assert compression.is_compressible("application/geo+json")
+    assert not compression.is_compressible("image/png")
+    assert not compression.is_compressible("application/zip")
+
+
+@pytest.fixture
+async def client(aiohttp_client):
+    async def get(request):
+        return web.json_response(DATA)
+
+    async def small(request):
+        return web.json_response({"foo": "bar"})
+
+    async def image(request):
+        return web.Response(body=b"\0" * 4096, content_type="image/png")
+
+    async def post(request):
+        data = await request.post()
+        return web.json_response({"size": len(data["data"])})
+
+    app = web.Application()
+    app.middlewares.append(compression.compression_middleware)
+    app.router.add_get("/", get)
+    app.router.add_get("/small", small)
+    app.router.add_get("/image", image)
+    app.router.add_post("/", post)
+    return await aiohttp_client(app, auto_decompress=False)
+
+
+async def test_compress(client):
+    ret = await client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert 200 == ret.status
+    assert "gzip" == ret.headers["Content-Encoding"]
+    assert "Accept-Encoding" == ret.headers["Vary"]
+    assert DATA == json.loads(gzip.decompress(await ret.read()))
+
+
+async def test_compress_large(client, monkeypatch):
+    # Compressed in a thread
+    monkeypatch.setattr(compression, "EXECUTOR_SIZE", 0)
+    ret = await client.get("/", headers={"Accept-Encoding": "gzip"})
+    assert DATA == json.loads(gzip.decompress(await ret.read()))
+
+
+async def test_no_compression(client):
+    ret = await client.get("/", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in ret.headers
+    assert "Accept-Encoding" == ret.headers["Vary"]
+    assert DATA == await ret.json()
+
+    for path in ("/small", "/image"):
+        ret = await client.get(path, headers={"Accept-Encoding": "gzip"})
+        assert "Content-Encoding" not in ret.headers
+
+
+async def test_compression_disabled(client):
+    CONF.set_override("compress_responses", False)
+    try:
+        ret = await client.get("/", headers={"Accept-Encoding": "gzip"})
+    finally:
+        CONF.clear_override("compress_responses")
+    assert "Content-Encoding" not in ret.headers
+    assert DATA == await ret.json()
+
+
+async def test_compressed_request(client):
+    body = gzip.compress(b"data=" + b"x" * 100000)
+    ret = await client.post(
+        "/",
+        data=body,
+        headers={
+            "Content-Encoding": "gzip",
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+    )
+    assert 200 == ret.status
+    assert {"size": 100000} == await ret.json()
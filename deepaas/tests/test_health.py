@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+
+from aiohttp import web
+from oslo_config import cfg
+import pytest
+
+import deepaas.model
+from deepaas.api import health
+from deepaas import config  # noqa
+
+CONF = cfg.CONF
+
+
+class FakeModel(object):
+    warmed = False
+
+    def __init__(self):
+        self.load = {"workers": 2, "busy": 0, "queued": 0}
+
+    def get_load(self):
+        return dict(self.load)
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    m = FakeModel()
+    monkeypatch.setattr(deepaas.model, "V2_MODELS", {"foo": m})
+    monkeypatch.setattr(health, "_WARM_TASK", None)
+    return m
+
+
+@pytest.fixture
+def app(fake_model):
+    app = web.Application()
+    health.setup_routes(app)
+    return app
+
+
+async def test_warming(app, aiohttp_client, fake_model):
+    warmed = asyncio.Event()
+
+    async def warm():
+        await warmed.wait()
+        fake_model.warmed = True
+
+    health.start_warming(app, warm())
+    client = await aiohttp_client(app)
+
+    ret = await client.get("/healthz")
+    assert 200 == ret.status
+    ret = await client.get("/readyz")
+    assert 503 == ret.status
+    assert "warming" == (await ret.json())["status"]
+    assert not (await ret.json())["models"]["foo"]["warm"]
+
+    warmed.set()
+    await health._WARM_TASK
+    ret = await client.get("/readyz")
+    assert 200 == ret.status
+    assert {
+        "status": "ready",
+        "models": {"foo": {"workers": 2, "busy": 0, "queued": 0, "warm": True}},
+    } == await ret.json()
+
+
+async def test_warming_error(app, aiohttp_client):
+    async def warm():
+        raise ValueError()
+
+    health.start_warming(app, warm())
+    client = await aiohttp_client(app)
+    with pytest.raises(ValueError):
+        await health._WARM_TASK
+
+    ret = await client.get("/healthz")
+    assert 503 == ret.status
+    assert {"status": "error"} == await ret.json()
+    ret = await client.get("/readyz")
+    assert 503 == ret.status
+    assert "error" == (await ret.json())["status"]
+
+
+async def test_saturated(app, aiohttp_client, fake_model):
+    client = await aiohttp_client(app)
+    fake_model.load.update(busy=2, queued=3)
+    ret = await client.get("/readyz")
+    assert 200 == ret.status
+
+    CONF.set_override("readiness_max_queue", 2)
+    try:
+        ret = await client.get("/readyz")
+        assert 503 == ret.status
+        assert "saturated" == (await ret.json())["status"]
+
+        fake_model.load.update(queued=2)
+        ret = await client.get("/readyz")
+        assert 200 == ret.status
+    finally:
+        CONF.clear_override("readiness_max_queue")
@@ -0,0 +1,75 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import importlib.metadata
+
+import mock
+import pytest
+import stevedore
+
+from deepaas import exceptions
+from deepaas.model import loading
+
+
+@pytest.fixture
+def entry_points(monkeypatch):
+    eps = [
+        importlib.metadata.EntryPoint(
+            "foo", "deepaas.tests.fake_v2_model:TestModel", "deepaas.v2.model"
+        ),
+        importlib.metadata.EntryPoint(
+            "bar", "deepaas.tests.does_not_exist:Model", "deepaas.v2.model"
+        ),
+    ]
+    mgr = mock.Mock(spec=stevedore.NamedExtensionManager)
+    mgr.return_value.list_entry_points.return_value = eps
+    monkeypatch.setattr(stevedore, "NamedExtensionManager", mgr)
+    loading.reset_cache()
+    yield mgr
+    loading.reset_cache()
+
+
+def test_names_are_cached(entry_points):
+    assert {"foo", "bar"} == loading.get_available_model_names("v2")
+    assert {"foo", "bar"} == loading.get_available_model_names("v2")
+    entry_points.assert_called_once_with(namespace="deepaas.v2.model", names=[])
+
+
+def test_get_model_by_name(entry_points):
+    from deepaas.tests import fake_v2_model
+
+    assert fake_v2_model.TestModel is loading.get_model_by_name("foo", "v2")
+    with pytest.raises(exceptions.ModuleNotFoundError):
+        loading.get_model_by_name("baz", "v2")
+    entry_points.assert_called_once()
+
+
+def test_get_available_models_propagates_errors(entry_points):
+    with pytest.raises(ImportError):
+        loading.get_available_models("v2")
+
+
+def test_distribution_metadata(entry_points):
+    meta = loading.get_model_distribution_metadata("foo", "v2")
+    assert "description" in meta
+
+
+def test_add_model(entry_points):
+    model = object()
+    loading.add_model("baz", model, "v2")
+    assert {"foo", "bar", "baz"} == loading.get_available_model_names("v2")
+    assert model is loading.get_model_by_name("baz", "v2")
+    assert "description" in loading.get_model_distribution_metadata("baz", "v2")
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import gc
+import multiprocessing.forkserver
+import os
+import pickle
+import tempfile
+import threading
+
+from oslo_config import cfg
+import pytest
+
+from deepaas import config  # noqa
+from deepaas.model import loading
+from deepaas.model.v2 import preload
+from deepaas.model.v2 import wrapper as v2_wrapper
+from deepaas.tests import fake_v2_model
+
+CONF = cfg.CONF
+
+# PID of the process where the model was warmed
+_WARM_PID = None
+
+
+class PreloadModel(object):
+    def warm(self):
+        global _WARM_PID
+        _WARM_PID = os.getpid()
+
+    def predict(self, **kwargs):
+        return {
+            "pid": os.getpid(),
+            "warm_pid": _WARM_PID,
+            "frozen": gc.get_freeze_count() > 0,
+        }
+
+
+class BrokenModel(object):
+    def warm(self):
+        raise ValueError()
+
+
+@pytest.fixture
+def warmed(monkeypatch):
+    monkeypatch.setattr(preload, "WARMED", set())
+    return preload.WARMED
+
+
+def test_preload(warmed, tmp_path):
+    path = tmp_path / "models"
+    models = {"foo": PreloadModel(), "bar": object(), "baz": BrokenModel()}
+    path.write_bytes(pickle.dumps(models))
+    path.chmod(0o600)
+    try:
+        preload._preload(str(path))
+        assert gc.get_freeze_count() > 0
+    finally:
+        gc.unfreeze()
+    assert not path.exists()
+    assert {"foo", "bar"} == warmed
+    assert os.getpid() == _WARM_PID
+
+
+def test_preload_not_private(warmed, tmp_path):
+    path = tmp_path / "models"
+    path.write_bytes(pickle.dumps({"foo": PreloadModel()}))
+    path.chmod(0o644)
+    preload._preload(str(path))
+    assert not path.exists()
+    assert set() == warmed
+
+
+def test_preload_module(warmed):
+    # Models whose entry point is a module cannot be pickled
+    with pytest.raises(TypeError):
+        pickle.dumps(fake_v2_model)
+    path = preload._dump_models({"fake": fake_v2_model})
+    assert 0o600 == os.stat(path).st_mode & 0o777
+    with open(path, "rb") as f:
+        assert {"fake": "deepaas.tests.fake_v2_model"} == pickle.load(f)
+
+    try:
+        preload._preload(path)
+    finally:
+        gc.unfreeze()
+    assert not os.path.exists(path)
+    assert {"fake"} == warmed
+    assert fake_v2_model is preload._load("fake", "deepaas.tests.fake_v2_model")
+
+
+def test_preload_entry_point(monkeypatch):
+    monkeypatch.setattr(
+        loading, "get_model_reference", lambda name, version: "foo.bar:Model"
+    )
+    path = preload._dump_models({"foo": PreloadModel()})
+    with open(path, "rb") as f:
+        assert {"foo": "foo.bar:Model"} == pickle.load(f)
+    os.unlink(path)
+
+
+def test_preload_unpicklable(monkeypatch, tmp_path):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(multiprocessing.forkserver._forkserver, "_forkserver_pid", None)
+    ctx = preload.get_context("foo", threading.Lock())
+    assert "forkserver" == ctx.get_start_method()
+    assert preload.ENV_VAR not in os.environ
+    # The temporary file is not left behind
+    assert [] == os.listdir(tmp_path)
+
+
+def test_warm_once(warmed):
+    calls = []
+    warmed.add("foo")
+    preload.warm_once("foo", lambda: calls.append("foo"))
+    preload.warm_once("bar", lambda: calls.append("bar"))
+    assert ["bar"] == calls
+
+
+@pytest.mark.skipif(
+    multiprocessing.forkserver._forkserver._forkserver_pid is not None,
+    reason="the forkserver is already running",
+)
+async def test_fork_workers():
+    CONF.set_override("fork_workers", True)
+    CONF.set_override("workers", 2)
+    try:
+        w = v2_wrapper.ModelWrapper("preload-test", PreloadModel())
+    finally:
+        CONF.clear_override("fork_workers")
+        CONF.clear_override("workers")
+    try:
+        assert preload.ENV_VAR not in os.environ
+        await w.warm()
+        outputs = [(await w.predict())["output"] for _ in range(2)]
+    finally:
+        w._executor.shutdown()
+
+    for output in outputs:
+        # Warmed in the template process, not in the workers
+        assert output["warm_pid"] not in (None, output["pid"], os.getpid())
+        assert (
+            output["warm_pid"] == multiprocessing.forkserver._forkserver._forkserver_pid
+        )
+        assert output["frozen"]
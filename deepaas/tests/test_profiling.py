@@ -0,0 +1,159 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import collections
+import os
+import pstats
+import time
+
+from aiohttp import test_utils
+from oslo_config import cfg
+import pytest
+
+from deepaas import config  # noqa
+from deepaas import profiling
+
+CONF = cfg.CONF
+
+
+@pytest.fixture(autouse=True)
+def profile_dir(monkeypatch, tmp_path):
+    monkeypatch.setattr(profiling, "_PROFILE_DIR", str(tmp_path))
+    CONF.set_override("profile_requests", True)
+    yield str(tmp_path)
+    CONF.clear_override("profile_requests")
+
+
+def _busy(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        pass
+
+
+def _outer():
+    _busy(0.02)
+    _inner()
+    return 42
+
+
+def _inner():
+    _busy(0.01)
+
+
+def test_run_profiled(profile_dir):
+    prefix = os.path.join(profile_dir, "foo")
+    assert 42 == profiling.run_profiled(prefix, _outer)
+
+    stats = pstats.Stats(prefix + ".prof")
+    assert any(func[2] == "_outer" for func in stats.stats)
+    assert ["foo"] == profiling.list_profiles()
+    assert prefix + ".prof" == profiling.get_profile_path("foo")
+    assert prefix + ".folded" == profiling.get_profile_path("foo", "collapsed")
+    assert profiling.get_profile_path("bar") is None
+    assert profiling.get_profile_path("../foo") is None
+
+    with open(prefix + ".folded") as f:
+        lines = f.read().splitlines()
+    stacks = {}
+    for line in lines:
+        stack, time_us = line.rsplit(" ", 1)
+        stacks[tuple(stack.split(";"))] = int(time_us)
+
+    outer = [s for s in stacks if s[-1].startswith("_outer ")]
+    inner = [s for s in stacks if s[-1].startswith("_inner ")]
+    assert 1 == len(outer) and 1 == len(inner)
+    assert outer[0] == inner[0][:-1]
+    busy = {s[-2].split()[0]: t for s, t in stacks.items() if "_busy" in s[-1]}
+    assert busy["_outer"] > busy["_inner"] > 0
+
+
+def test_run_profiled_error(profile_dir):
+    prefix = os.path.join(profile_dir, "foo")
+    with pytest.raises(ZeroDivisionError):
+        profiling.run_profiled(prefix, lambda: 1 / 0)
+    assert os.path.exists(prefix + ".prof")
+    assert os.path.exists(prefix + ".folded")
+
+
+def test_collapsed_stacks_recursion():
+    def fact(n):
+        return 1 if n <= 1 else n * fact(n - 1)
+
+    prefix = os.path.join(profiling.get_profile_dir(), "fact")
+    profiling.run_profiled(prefix, fact, 50)
+    stacks = profiling.get_collapsed_stacks(pstats.Stats(prefix + ".prof"))
+    # The recursive calls are not followed
+    assert all(sum(1 for f in s if f.startswith("fact ")) <= 1 for s in stacks)
+
+
+class _LadderStats(object):
+    """Call graph where each level calls the next one through two functions,
+    so that there are 2**levels different stacks. Every function takes 1
+    second on its own."""
+
+    def __init__(self, levels):
+        cumtime = {("f", levels, "f"): 1.0}
+        callers = collections.defaultdict(dict)
+        for i in reversed(range(levels)):
+            f, next_f = ("f", i, "f"), ("f", i + 1, "f")
+            cumtime[f] = 1.0
+            for name in ("a", "b"):
+                func = ("f", i, name)
+                callers[next_f][func] = (1, 1, 1.0, cumtime[next_f] / 2)
+                cumtime[func] = 1 + cumtime[next_f] / 2
+                callers[func][f] = (1, 1, 1.0, cumtime[func])
+                cumtime[f] += cumtime[func]
+        self.stats = {
+            func: (1, 1, 1.0, t, callers.get(func, {})) for func, t in cumtime.items()
+        }
+        self.cumtime = cumtime[("f", 0, "f")]
+
+
+def test_collapsed_stacks_many_paths():
+    stats = _LadderStats(40)
+    start = time.perf_counter()
+    stacks = profiling.get_collapsed_stacks(stats)
+    assert time.perf_counter() - start < 10
+    assert len(stacks) <= profiling._MAX_STACKS
+    # No time is lost
+    assert abs(sum(stacks.values()) - stats.cumtime) < 1e-6 * stats.cumtime
+
+
+def test_get_request_profile():
+    def request(headers):
+        return test_utils.make_mocked_request("POST", "/", headers=headers)
+
+    assert profiling.get_request_profile(request({})) is None
+    assert profiling.get_request_profile(request({"X-Profile": "0"})) is None
+
+    profile_id = profiling.get_request_profile(request({"X-Profile": "1"}))
+    assert 32 == len(profile_id)
+
+    # Unique even if the clients reuse the request IDs
+    headers = {"X-Profile": "true", "X-Request-Id": "foo-1"}
+    profile_id = profiling.get_request_profile(request(headers))
+    assert profile_id.startswith("foo-1-")
+    assert profile_id != profiling.get_request_profile(request(headers))
+
+    headers = {"X-Profile": "true", "X-Request-Id": "x" * 128}
+    profile_id = profiling.get_request_profile(request(headers))
+    assert profiling._VALID_ID.match(profile_id)
+
+    headers = {"X-Profile": "1", "X-Request-Id": "../../foo"}
+    assert "../../foo" != profiling.get_request_profile(request(headers))
+
+    CONF.set_override("profile_requests", False)
+    assert profiling.get_request_profile(request({"X-Profile": "1"})) is None
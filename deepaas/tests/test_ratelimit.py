@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+
+from aiohttp import web
+from oslo_config import cfg
+import pytest
+
+from deepaas.api import ratelimit
+from deepaas import config  # noqa
+
+CONF = cfg.CONF
+
+
+def test_rate():
+    limiter = ratelimit.RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        assert limiter.acquire("foo", now=0) is None
+        limiter.release("foo")
+    assert 0.5 == limiter.acquire("foo", now=0)
+    assert 0.25 == limiter.acquire("foo", now=0.25)
+    # Other clients are not affected
+    assert limiter.acquire("bar", now=0.25) is None
+
+    assert limiter.acquire("foo", now=0.5) is None
+    assert limiter.acquire("foo", now=0.5) is not None
+    # The bucket is not filled over the burst
+    for _ in range(3):
+        assert limiter.acquire("foo", now=100) is None
+    assert limiter.acquire("foo", now=100) is not None
+
+
+def test_concurrency():
+    limiter = ratelimit.RateLimiter(max_concurrency=2)
+    assert limiter.acquire("foo", now=0) is None
+    assert limiter.acquire("foo", now=0) is None
+    assert 1 == limiter.acquire("foo", now=0)
+    limiter.release("foo")
+    assert limiter.acquire("foo", now=0) is None
+
+
+def test_expire():
+    limiter = ratelimit.RateLimiter(rate=1, burst=2)
+    assert 2 == limiter.idle_timeout
+    limiter.acquire("foo", now=0)
+    limiter.release("foo")
+    limiter.acquire("bar", now=1)
+    limiter.acquire("baz", now=1.5)
+    assert 3 == len(limiter)
+
+    # foo is idle, bar is still being served
+    limiter.acquire("qux", now=3)
+    assert ["baz", "bar", "qux"] == list(limiter._clients)
+
+    limiter.release("bar")
+    limiter.release("baz")
+    limiter.acquire("quux", now=6)
+    assert ["qux", "quux"] == list(limiter._clients)
+
+
+def test_ids_per_address():
+    limiter = ratelimit.RateLimiter(rate=1, burst=1, max_ids_per_address=2)
+    for key in ("foo", "bar"):
+        assert key == limiter.get_key(key, "1.2.3.4")
+        assert limiter.acquire(key, now=0, address="1.2.3.4") is None
+        limiter.release(key)
+    # Known IDs, and IDs from other addresses, are limited on their own
+    assert "foo" == limiter.get_key("foo", "1.2.3.4")
+    assert "baz" == limiter.get_key("baz", "5.6.7.8")
+
+    # New IDs are limited together, as the address
+    assert "1.2.3.4" == limiter.get_key("baz", "1.2.3.4")
+    assert limiter.acquire("1.2.3.4", now=0, address="1.2.3.4") is None
+    limiter.release("1.2.3.4")
+    assert "1.2.3.4" == limiter.get_key("qux", "1.2.3.4")
+    assert limiter.acquire("1.2.3.4", now=0, address="1.2.3.4") is not None
+
+    # Until the known ones are forgotten
+    limiter.acquire("quux", now=10, address="5.6.7.8")
+    assert "baz" == limiter.get_key("baz", "1.2.3.4")
+
+
+@pytest.fixture
+def limits():
+    CONF.set_override("rate_limit", 1)
+    CONF.set_override("rate_limit_burst", 2)
+    CONF.set_override("client_max_concurrency", 1)
+    CONF.set_override("client_id_header", "X-API-Key")
+    yield
+    for flag in ("rate_limit", "rate_limit_burst", "client_max_concurrency"):
+        CONF.clear_override(flag)
+    CONF.clear_override("client_id_header")
+
+
+async def test_middleware(aiohttp_client, limits):
+    release = asyncio.Event()
+
+    async def predict(request):
+        await release.wait()
+        return web.json_response({})
+
+    async def get(request):
+        return web.json_response({})
+
+    app = web.Application()
+    ratelimit.setup(app)
+    app.router.add_post("/models/foo/predict/", predict)
+    app.router.add_get("/models/foo/predict/", get)
+    client = await aiohttp_client(app)
+
+    url = "/models/foo/predict/"
+    headers = {"X-API-Key": "foo"}
+    first = asyncio.ensure_future(client.post(url, headers=headers))
+    await asyncio.sleep(0.1)
+    ret = await client.post(url, headers=headers)
+    assert 429 == ret.status
+    assert "1" == ret.headers["Retry-After"]
+
+    # Other clients, and other requests, are not limited
+    release.set()
+    ret = await client.post(url, headers={"X-API-Key": "bar"})
+    assert 200 == ret.status
+    ret = await client.get(url, headers=headers)
+    assert 200 == ret.status
+
+    assert 200 == (await first).status
+    # The rejected request did not take a token, but there is only one left
+    ret = await client.post(url, headers=headers)
+    assert 200 == ret.status
+    ret = await client.post(url, headers=headers)
+    assert 429 == ret.status
+
+
+async def test_middleware_ids_per_address(aiohttp_client, limits):
+    async def predict(request):
+        return web.json_response({})
+
+    CONF.set_override("rate_limit_burst", 1)
+    CONF.set_override("client_max_ids_per_address", 1)
+    try:
+        app = web.Application()
+        ratelimit.setup(app)
+    finally:
+        CONF.clear_override("client_max_ids_per_address")
+    app.router.add_post("/models/foo/predict/", predict)
+    client = await aiohttp_client(app)
+
+    url = "/models/foo/predict/"
+    ret = await client.post(url, headers={"X-API-Key": "foo"})
+    assert 200 == ret.status
+    # Changing the ID does not give new limits
+    ret = await client.post(url, headers={"X-API-Key": "bar"})
+    assert 200 == ret.status
+    ret = await client.post(url, headers={"X-API-Key": "baz"})
+    assert 429 == ret.status
+
+
+def test_setup_disabled():
+    app = web.Application()
+    ratelimit.setup(app)
+    assert 0 == len(app.middlewares)
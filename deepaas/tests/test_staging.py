@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import errno
+import os
+
+import pytest
+
+from deepaas.cmd import _staging
+
+DATA = os.urandom(3 * 1024 * 1024 + 7)
+
+
+@pytest.fixture
+def src(tmp_path):
+    path = tmp_path / "input.bin"
+    path.write_bytes(DATA)
+    return str(path)
+
+
+def _unsupported(*args):
+    raise OSError(errno.EOPNOTSUPP, "not supported")
+
+
+def test_stage_copy(src):
+    f = _staging.stage_file(src)
+    assert src == f.original_filename
+    assert os.path.abspath(src) != f.filename
+    assert DATA == open(f.filename, "rb").read()
+    assert os.stat(src).st_ino != os.stat(f.filename).st_ino
+    os.remove(f.filename)
+
+
+def test_stage_link(src):
+    f = _staging.stage_file(src, "link")
+    assert DATA == open(f.filename, "rb").read()
+    os.remove(f.filename)
+
+
+def test_stage_link_fallback(src, monkeypatch):
+    monkeypatch.setattr(os, "link", _unsupported)
+    f = _staging.stage_file(src, "link")
+    assert DATA == open(f.filename, "rb").read()
+    assert os.stat(src).st_ino != os.stat(f.filename).st_ino
+    os.remove(f.filename)
+
+
+def test_stage_reference(src):
+    f = _staging.stage_file(src, "reference")
+    assert os.path.abspath(src) == f.filename
+
+
+def test_stage_bad_mode(src):
+    with pytest.raises(ValueError):
+        _staging.stage_file(src, "move")
+
+
+@pytest.mark.parametrize("unsupported", [[], ["_reflink"], ["_reflink", "os"]])
+def test_copy_fallbacks(src, tmp_path, monkeypatch, unsupported):
+    if "_reflink" in unsupported:
+        monkeypatch.setattr(_staging, "_reflink", _unsupported)
+    if "os" in unsupported:
+        monkeypatch.delattr(os, "copy_file_range", raising=False)
+
+    dst = str(tmp_path / "output.bin")
+    how = _staging.copy_file(src, dst)
+    assert how in ("reflink", "copy_file_range", "copy")
+    if "os" in unsupported:
+        assert "copy" == how
+    assert DATA == open(dst, "rb").read()
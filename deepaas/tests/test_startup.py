@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import os
+import pstats
+import time
+
+import pytest
+
+from deepaas import startup
+
+
+@pytest.fixture(autouse=True)
+def phases(monkeypatch):
+    monkeypatch.setattr(startup, "PHASES", [])
+    monkeypatch.setattr(startup, "_READY", None)
+    monkeypatch.setattr(startup, "_PROFILER", None)
+
+
+def _slow_import():
+    time.sleep(0.01)
+
+
+def test_phases():
+    assert startup.PROCESS_START <= time.time()
+
+    with startup.phase("foo", model="bar"):
+        time.sleep(0.01)
+    with pytest.raises(ValueError):
+        with startup.phase("baz"):
+            raise ValueError()
+
+    report = startup.get_report()
+    assert not report["ready"]
+    assert ["foo", "baz"] == [p["name"] for p in report["phases"]]
+    assert "bar" == report["phases"][0]["model"]
+    assert report["phases"][0]["duration"] >= 0.01
+
+    startup.mark_ready()
+    assert startup.get_report()["ready"]
+    assert startup.get_report()["elapsed"] == startup.get_report()["elapsed"]
+
+
+def test_run_timed():
+    ret, start, duration, pid = startup.run_timed(sum, [1, 2])
+    assert 3 == ret
+    assert start <= time.time()
+    assert duration >= 0
+    assert os.getpid() == pid
+
+
+def test_profile(tmp_path):
+    path = str(tmp_path / "startup.prof")
+
+    # Nothing is dumped unless profiling is enabled
+    startup.dump_profile(path)
+    assert not os.path.exists(path)
+
+    startup.enable_profiling()
+    with startup.phase("not_profiled"):
+        _slow_import()
+    with startup.phase("profiled", profile=True):
+        _slow_import()
+    startup.dump_profile(path)
+
+    stats = pstats.Stats(path).stats
+    calls = [v[0] for k, v in stats.items() if k[2] == "_slow_import"]
+    assert [1] == calls
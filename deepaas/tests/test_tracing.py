@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import http.server
+import json
+import os
+import threading
+
+from aiohttp import web
+from oslo_config import cfg
+import pytest
+
+import deepaas
+from deepaas.api import v2
+from deepaas import config  # noqa
+import deepaas.model
+from deepaas.model.v2 import wrapper as v2_wrapper
+from deepaas.tests import fake_v2_model
+from deepaas import tracing
+
+CONF = cfg.CONF
+
+TRACE_ID = "4bf92f3577b34da6a3ce929d0e0e4736"
+PARENT_ID = "00f067aa0ba902b7"
+
+
+class _ListExporter(object):
+    def __init__(self):
+        self.spans = []
+        self.closed = False
+
+    def export(self, spans):
+        self.spans.extend(spans)
+
+    def shutdown(self):
+        self.closed = True
+
+
+@pytest.fixture
+def exporter(monkeypatch):
+    exporter = _ListExporter()
+    processor = tracing.BatchProcessor(exporter, interval=0.01)
+    monkeypatch.setattr(tracing, "_PROCESSOR", processor)
+    yield exporter
+    processor.shutdown()
+
+
+def test_disabled():
+    assert not tracing.is_enabled()
+    with tracing.span("foo") as s:
+        s.set_attribute("bar", 1)
+        assert tracing.get_current_context() is None
+    assert tracing.NON_RECORDING_SPAN is s
+
+
+def test_spans(exporter):
+    with tracing.span("foo", bar=1) as foo:
+        with tracing.span("baz"):
+            assert foo.context != tracing.get_current_context()
+        assert foo.context == tracing.get_current_context()
+        with pytest.raises(ValueError):
+            with tracing.span("qux"):
+                raise ValueError("error")
+    assert tracing.get_current_context() is None
+
+    tracing._PROCESSOR.shutdown()
+    baz, qux, foo = exporter.spans
+    assert ("baz", "qux", "foo") == (baz["name"], qux["name"], foo["name"])
+    assert foo["parent_id"] is None
+    assert {foo["span_id"]} == {baz["parent_id"], qux["parent_id"]}
+    assert {foo["trace_id"]} == {baz["trace_id"], qux["trace_id"]}
+    assert {"bar": 1} == foo["attributes"]
+    assert "ValueError: error" == qux["error"]
+    assert foo["start"] <= baz["start"] <= baz["end"] <= foo["end"]
+    assert exporter.closed
+
+
+@pytest.mark.parametrize(
+    "header,expected",
+    [
+        ("00-%s-%s-01" % (TRACE_ID, PARENT_ID), (TRACE_ID, PARENT_ID)),
+        ("00-%s-%s-00" % (TRACE_ID.upper(), PARENT_ID), (TRACE_ID, PARENT_ID)),
+        ("00-%s-%s-01" % ("0" * 32, PARENT_ID), None),
+        ("00-%s-%s-01" % (TRACE_ID, "0" * 16), None),
+        ("01-%s-%s-01" % (TRACE_ID, PARENT_ID), None),
+        ("foo", None),
+        (None, None),
+    ],
+)
+def test_parse_traceparent(header, expected):
+    assert expected == tracing.parse_traceparent(header)
+
+
+def test_format_traceparent():
+    context = tracing.SpanContext(TRACE_ID, PARENT_ID)
+    assert context == tracing.parse_traceparent(tracing.format_traceparent(context))
+
+
+def _traced():
+    with tracing.span("model"):
+        return os.getpid()
+
+
+def _traced_error():
+    with tracing.span("model"):
+        raise ValueError()
+
+
+def test_run_in_worker(exporter):
+    context = tracing.SpanContext(TRACE_ID, PARENT_ID)
+    output, spans = tracing.run_in_worker(context, _traced)
+    assert os.getpid() == output
+    assert ["model", "worker_execution"] == [s["name"] for s in spans]
+    assert spans[1]["span_id"] == spans[0]["parent_id"]
+    assert PARENT_ID == spans[1]["parent_id"]
+    assert {TRACE_ID} == {s["trace_id"] for s in spans}
+    assert tracing._WORKER_SPANS is None
+
+    with pytest.raises(ValueError) as e:
+        tracing.run_in_worker(context, _traced_error)
+    assert 2 == len(e.value._deepaas_spans)
+
+    with tracing.span("request"):
+        tracing.collect_worker_spans(spans)
+    tracing._PROCESSOR.shutdown()
+    names = [s["name"] for s in exporter.spans]
+    assert ["model", "worker_execution", "result_transfer", "request"] == names
+    transfer = exporter.spans[2]
+    assert spans[1]["end"] == transfer["start"]
+    assert exporter.spans[3]["span_id"] == transfer["parent_id"]
+
+
+def test_batch_processor_full():
+    exporter = _ListExporter()
+    processor = tracing.BatchProcessor(exporter, max_queue=1)
+    processor._ensure_thread = lambda: None
+    processor.submit({"name": "foo"})
+    processor.submit({"name": "bar"})
+    assert 1 == processor.dropped
+
+
+def test_jsonl_exporter(tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    exporter = tracing.JsonLinesExporter(path)
+    exporter.export([{"name": "foo"}])
+    exporter.export([{"name": "bar"}, {"name": "baz"}])
+    exporter.shutdown()
+    with open(path) as f:
+        assert ["foo", "bar", "baz"] == [json.loads(line)["name"] for line in f]
+
+
+def test_otlp_exporter_scheme():
+    with pytest.raises(ValueError):
+        tracing.OTLPExporter("file:///etc/passwd")
+    with pytest.raises(ValueError):
+        CONF.set_override("trace_otlp_endpoint", "file:///etc/passwd")
+    tracing.OTLPExporter("https://collector:4318/v1/traces")
+
+
+def test_otlp_exporter():
+    received = []
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        # Name required by BaseHTTPRequestHandler
+        def do_POST(self):  # noqa: N802
+            length = int(self.headers["Content-Length"])
+            received.append(json.loads(self.rfile.read(length)))
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+
+    server = http.server.HTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.handle_request)
+    thread.start()
+    try:
+        exporter = tracing.OTLPExporter(
+            "http://127.0.0.1:%d/v1/traces" % server.server_port
+        )
+        span = tracing.Span("foo", kind="server", attributes={"a": 1, "b": "c"})
+        span.end = span.start + 1
+        span.error = "ValueError: foo"
+        exporter.export([span.to_dict()])
+        thread.join()
+    finally:
+        server.server_close()
+
+    (payload,) = received
+    (resource_spans,) = payload["resourceSpans"]
+    (scope_spans,) = resource_spans["scopeSpans"]
+    (otlp_span,) = scope_spans["spans"]
+    assert span.trace_id == otlp_span["traceId"]
+    assert span.span_id == otlp_span["spanId"]
+    assert "parentSpanId" not in otlp_span
+    assert 2 == otlp_span["kind"]
+    assert str(span.end) == otlp_span["endTimeUnixNano"]
+    assert {"code": 2, "message": "ValueError: foo"} == otlp_span["status"]
+    assert [
+        {"key": "a", "value": {"intValue": "1"}},
+        {"key": "b", "value": {"stringValue": "c"}},
+    ] == otlp_span["attributes"]
+
+
+def test_otlp_exporter_error():
+    exporter = tracing.OTLPExporter("http://127.0.0.1:1/v1/traces", timeout=1)
+    exporter.export([])
+    assert exporter._failing
+
+
+async def test_api(aiohttp_client, monkeypatch, tmp_path):
+    path = str(tmp_path / "traces.jsonl")
+    CONF.set_override("trace_exporter", "jsonl")
+    CONF.set_override("trace_file", path)
+    try:
+        app = web.Application()
+        tracing.setup(app)
+        app.middlewares.append(tracing.tracing_middleware)
+        app.middlewares.append(web.normalize_path_middleware())
+        model = fake_v2_model.BenchModel()
+        w = v2_wrapper.ModelWrapper("deepaas-bench", model, app)
+        monkeypatch.setattr(deepaas.model, "V2_MODELS", {"deepaas-bench": w})
+        app.add_subapp("/v2", v2.get_app())
+
+        client = await aiohttp_client(app)
+        ret = await client.post(
+            "/v2/models/deepaas-bench/predict/",
+            data={"data": b"foo"},
+            headers={"traceparent": "00-%s-%s-01" % (TRACE_ID, PARENT_ID)},
+        )
+        assert 200 == ret.status
+        pid = (await ret.json())["predictions"]["pid"]
+        await client.close()
+    finally:
+        CONF.clear_override("trace_exporter")
+        CONF.clear_override("trace_file")
+    assert tracing._PROCESSOR is None
+
+    with open(path) as f:
+        spans = {s["name"]: s for s in map(json.loads, f)}
+    server = spans.pop("POST /v2/models/deepaas-bench/predict/")
+    assert "server" == server["kind"]
+    assert PARENT_ID == server["parent_id"]
+    assert 200 == server["attributes"]["http.response.status_code"]
+
+    assert {
+        "parse_arguments",
+        "stage_uploads",
+        "queue_wait",
+        "worker_execution",
+        "bench_cpu",
+        "bench_sleep",
+        "result_transfer",
+        "serialize_response",
+    } == set(spans)
+    assert {TRACE_ID} == {s["trace_id"] for s in spans.values()}
+    worker = spans["worker_execution"]
+    assert pid == worker["attributes"]["pid"] != os.getpid()
+    for name, parent in (("bench_cpu", worker), ("bench_sleep", worker)):
+        assert parent["span_id"] == spans[name]["parent_id"]
+    for name in ("parse_arguments", "stage_uploads", "queue_wait", "worker_execution"):
+        assert server["span_id"] == spans[name]["parent_id"]
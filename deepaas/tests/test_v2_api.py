@@ -15,19 +15,24 @@
 # under the License.
 
 import io
+import pstats
 import uuid
 
 from aiohttp import web
 from oslo_config import cfg
 import pytest
+from webargs import fields
 
 import deepaas
 from deepaas.api import v2
 from deepaas.api.v2 import predict
 from deepaas.api.v2 import responses
+from deepaas.api.v2 import train
 import deepaas.model
 import deepaas.model.v2
+from deepaas.model.v2 import lazy as v2_lazy
 from deepaas.model.v2 import wrapper as v2_wrapper
+from deepaas import profiling
 from deepaas.tests import fake_responses
 from deepaas.tests import fake_v2_model
 
@@ -42,6 +47,16 @@ def test_loading_ok_with_missing_schema():
     assert response is responses.Prediction
 
 
+def test_train_args_clash():
+    class Fake(object):
+        @staticmethod
+        def get_train_args():
+            return {"priority": fields.Int()}
+
+    with pytest.raises(ValueError, match="priority"):
+        train._get_handler("deepaas-test", Fake())
+
+
 @pytest.fixture(autouse=True)
 def cfg_fixture():
     def set_flag(flag, value):
@@ -145,6 +160,53 @@ class TestApiV2NoPredict(BaseTestApiV2):
         assert 402 == ret.status
 
 
+class TestApiV2Queue(BaseTestApiV2):
+    @pytest.fixture
+    @staticmethod
+    async def application(monkeypatch, cfg_fixture):
+        cfg_fixture("max_concurrent_trainings", 1)
+
+        app = web.Application()
+        app.middlewares.append(web.normalize_path_middleware())
+
+        w = v2_wrapper.ModelWrapper("deepaas-test", fake_v2_model.TestModel(), app)
+
+        monkeypatch.setattr(deepaas.model, "V2_MODELS", {"deepaas-test": w})
+
+        v2app = v2.get_app()
+        app.add_subapp("/v2", v2app)
+
+        yield app
+
+        CONF.clear_override("max_concurrent_trainings")
+
+    async def test_train_queued(self, client):
+        url = "/v2/models/deepaas-test/train/"
+        ret = await client.post(url, data={"sleep": 1})
+        running = await ret.json()
+        assert "running" == running["status"]
+
+        ret = await client.post(url, data={"sleep": 0})
+        low = await ret.json()
+        assert "queued" == low["status"]
+        assert 0 == low["position"]
+
+        ret = await client.post(url + "?priority=10", data={"sleep": 0})
+        high = await ret.json()
+        assert "queued" == high["status"]
+        assert 10 == high["priority"]
+        assert 0 == high["position"]
+
+        ret = await client.get(url + low["uuid"])
+        assert 1 == (await ret.json())["position"]
+
+        ret = await client.delete(url + low["uuid"])
+        assert "cancelled" == (await ret.json())["status"]
+
+        ret = await client.get(url, params={"status": "queued"})
+        assert [high["uuid"]] == [t["uuid"] for t in await ret.json()]
+
+
 class TestApiV2(BaseTestApiV2):
     @pytest.fixture
     @staticmethod
@@ -198,7 +260,168 @@ class TestApiV2(BaseTestApiV2):
         assert 422 == ret.status
         assert expected == json
 
+    async def test_train_list_paginated(self, client):
+        uuids = []
+        for _ in range(3):
+            ret = await client.post("/v2/models/deepaas-test/train/", data={"sleep": 0})
+            uuids.append((await ret.json())["uuid"])
+
+        ret = await client.get("/v2/models/deepaas-test/train/", params={"limit": 2})
+        assert 200 == ret.status
+        assert uuids[:2] == [t["uuid"] for t in await ret.json()]
+        assert "next" in ret.links
+
+        ret = await client.get(ret.links["next"]["url"].path_qs)
+        assert 200 == ret.status
+        assert uuids[2:] == [t["uuid"] for t in await ret.json()]
+        assert "next" not in ret.links
+
+    async def test_train_list_filtered(self, client):
+        ret = await client.post("/v2/models/deepaas-test/train/", data={"sleep": 0})
+        json = await ret.json()
+        await client.delete("/v2/models/deepaas-test/train/%s" % json["uuid"])
+        ret = await client.post("/v2/models/deepaas-test/train/", data={"sleep": 0})
+        json = await ret.json()
+
+        ret = await client.get(
+            "/v2/models/deepaas-test/train/", params={"since": json["date"]}
+        )
+        assert [json["uuid"]] == [t["uuid"] for t in await ret.json()]
+
+        ret = await client.get(
+            "/v2/models/deepaas-test/train/", params={"status": "cancelled"}
+        )
+        assert [] == await ret.json()
+
+        ret = await client.get(
+            "/v2/models/deepaas-test/train/", params={"status": "foo"}
+        )
+        assert 422 == ret.status
+
+    async def test_train_events(self, client):
+        ret = await client.post("/v2/models/deepaas-test/train/", data={"sleep": 0})
+        url = "/v2/models/deepaas-test/train/%s/events" % (await ret.json())["uuid"]
+
+        ret = await client.get(url, headers={"Accept": "text/event-stream"})
+        assert 200 == ret.status
+        assert "text/event-stream" == ret.content_type
+        body = await ret.text()
+        assert "id: 0\nevent: progress\n" in body
+        assert "event: status\n" in body
+        assert '"status": "done"' in body
+
+        ret = await client.get(url)
+        assert 200 == ret.status
+        events = await ret.json()
+        assert 1 == len(events)
+        assert 1.0 == events[0]["progress"]
+        assert {"sleep": 0} == events[0]["metrics"]
+
+        ret = await client.get(
+            "/v2/models/deepaas-test/train/%s/events" % uuid.uuid4().hex
+        )
+        assert 404 == ret.status
+
+    async def test_predict_profile(self, client, monkeypatch, tmp_path):
+        monkeypatch.setattr(profiling, "_PROFILE_DIR", str(tmp_path))
+        data = {"data": (io.BytesIO(b"foo"), "foo.txt"), "parameter": 1}
+        headers = {"X-Profile": "1", "X-Request-Id": "foo"}
+
+        ret = await client.post(
+            "/v2/models/deepaas-test/predict/", data=data, headers=headers
+        )
+        assert 200 == ret.status
+        assert "X-Profile-Id" not in ret.headers
+        ret = await client.get("/v2/debug/profiles/")
+        assert 404 == ret.status
+
+        CONF.set_override("profile_requests", True)
+        try:
+            data["data"] = (io.BytesIO(b"foo"), "foo.txt")
+            ret = await client.post(
+                "/v2/models/deepaas-test/predict/", data=data, headers=headers
+            )
+            assert 200 == ret.status
+            profile_id = ret.headers["X-Profile-Id"]
+            assert profile_id.startswith("foo-")
+            assert "data" in await ret.json()
+
+            ret = await client.get("/v2/debug/profiles/")
+            assert [profile_id] == await ret.json()
+
+            ret = await client.get("/v2/debug/profiles/" + profile_id)
+            assert 200 == ret.status
+            path = tmp_path / "download.prof"
+            path.write_bytes(await ret.read())
+            stats = pstats.Stats(str(path))
+            assert any(f[2] == "predict" for f in stats.stats)
+
+            ret = await client.get(
+                "/v2/debug/profiles/%s?format=collapsed" % profile_id
+            )
+            assert 200 == ret.status
+            assert "predict (" in await ret.text()
+
+            ret = await client.get("/v2/debug/profiles/%s?format=bar" % profile_id)
+            assert 400 == ret.status
+            ret = await client.get("/v2/debug/profiles/bar")
+            assert 404 == ret.status
+        finally:
+            CONF.clear_override("profile_requests")
+
     async def test_bad_metods_metadata(self, client):
         for i in (client.post, client.put, client.delete):
             ret = await i("/v2/models/")
             assert 405 == ret.status
+
+
+async def test_lazy_model(aiohttp_client, monkeypatch):
+    app = web.Application()
+    app.middlewares.append(web.normalize_path_middleware())
+
+    monkeypatch.setattr(
+        deepaas.model.loading,
+        "get_model_by_name",
+        lambda x, y: fake_v2_model.TestModel(),
+    )
+    w = v2_lazy.LazyModelWrapper("deepaas-test", v2_lazy.ModelCache(), app)
+    monkeypatch.setattr(deepaas.model, "V2_MODELS", {"deepaas-test": w})
+    app.add_subapp("/v2", v2.get_app())
+
+    client = await aiohttp_client(app)
+    assert not w.loaded
+
+    ret = await client.get("/v2/models/")
+    assert 200 == ret.status
+    assert not w.loaded
+
+    ret = await client.post(
+        "/v2/models/deepaas-test/predict/",
+        data={"data": (io.BytesIO(b"foo"), "foo.txt"), "parameter": 1},
+    )
+    assert 200 == ret.status
+    assert w.loaded
+
+
+async def test_lazy_model_budget_nowarm(monkeypatch):
+    monkeypatch.setattr(
+        deepaas.model.loading,
+        "get_model_by_name",
+        lambda x, y: fake_v2_model.TestModel(),
+    )
+    # Any loaded model is over the budget
+    cache = v2_lazy.ModelCache(memory_budget=1)
+    foo = v2_lazy.LazyModelWrapper("foo", cache)
+    bar = v2_lazy.LazyModelWrapper("bar", cache)
+
+    CONF.set_override("warm", False)
+    try:
+        await foo.predict()
+        assert foo.loaded and not foo.warmed
+        await bar.predict()
+        assert bar.loaded and not bar.warmed
+        assert not foo.loaded
+    finally:
+        CONF.clear_override("warm")
+        foo.unload()
+        bar.unload()
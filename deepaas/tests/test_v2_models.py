@@ -27,6 +27,7 @@ import deepaas
 from deepaas import exceptions
 import deepaas.model.v2
 from deepaas.model.v2 import base as v2_base
+from deepaas.model.v2 import lazy as v2_lazy
 from deepaas.model.v2 import wrapper as v2_wrapper
 from deepaas.tests import fake_v2_model
 
@@ -248,3 +249,70 @@ def test_loading_error(application, monkeypatch):
     monkeypatch.setattr(deepaas.model.loading, "get_available_models", lambda x: {})
     with pytest.raises(exceptions.NoModelsAvailable):
         deepaas.model.v2.register_models(application)
+
+
+async def test_loading_lazy(application, mocks, monkeypatch, request):
+    deepaas.model.v2.CONF.set_override("multi_model", True)
+    request.addfinalizer(lambda: deepaas.model.v2.CONF.clear_override("multi_model"))
+    loaded = []
+    monkeypatch.setattr(
+        deepaas.model.loading,
+        "get_model_by_name",
+        lambda x, y: loaded.append(x) or fake_v2_model.TestModel(),
+    )
+    deepaas.model.v2.register_models(application)
+
+    for name, m in deepaas.model.v2.MODELS.items():
+        assert isinstance(m, v2_lazy.LazyModelWrapper)
+        assert not m.loaded
+        meta = m.get_metadata()
+        assert name == meta["name"]
+        assert "description" in meta
+        assert [] == loaded
+
+        assert m.get_predict_args()
+        assert m.loaded
+        assert [name] == loaded
+        m.unload()
+        assert not m.loaded
+
+
+class FakeLazyModel(object):
+    busy = False
+
+    def __init__(self, name, usage):
+        self.name = name
+        self.usage = usage
+
+    def memory_usage(self):
+        return self.usage
+
+    def unload(self):
+        self.usage = 0
+
+
+def test_model_cache_eviction():
+    cache = v2_lazy.ModelCache(memory_budget=100)
+    a, b, c, d = (FakeLazyModel(n, 50) for n in "abcd")
+    for m in (a, b, c):
+        cache.touch(m)
+    cache.touch(a)
+
+    # b is the least recently used one
+    cache.evict(keep=c)
+    assert [50, 0, 50] == [m.usage for m in (a, b, c)]
+
+    # c is the least recently used one, but it is busy
+    cache.discard(b)
+    cache.touch(d)
+    c.busy = True
+    cache.evict(keep=d)
+    assert [0, 50, 50] == [m.usage for m in (a, c, d)]
+
+
+def test_model_cache_no_budget():
+    cache = v2_lazy.ModelCache()
+    a = FakeLazyModel("a", 1000)
+    cache.touch(a)
+    cache.evict()
+    assert 1000 == a.usage
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+
+import pytest
+
+from deepaas.api.v2 import scheduler
+
+
+def _starter(started, futures, name):
+    def start():
+        if name == "bad":
+            raise RuntimeError("Cannot start")
+        started.append(name)
+        futures[name] = asyncio.get_running_loop().create_future()
+        return futures[name]
+
+    return start
+
+
+async def test_no_limit():
+    s = scheduler.TrainingScheduler()
+    started, futures = [], {}
+    for name in ("a", "b", "c"):
+        assert s.submit({}, _starter(started, futures, name))
+    assert ["a", "b", "c"] == started
+    assert 3 == s.running
+
+
+async def test_priorities_and_positions():
+    s = scheduler.TrainingScheduler(max_running=1)
+    started, futures = [], {}
+    trainings = {name: {} for name in ("a", "b", "c", "d")}
+
+    assert s.submit(trainings["a"], _starter(started, futures, "a"))
+    assert not s.submit(trainings["b"], _starter(started, futures, "b"))
+    assert not s.submit(trainings["c"], _starter(started, futures, "c"), priority=5)
+    assert not s.submit(trainings["d"], _starter(started, futures, "d"))
+
+    assert s.position(trainings["a"]) is None
+    assert 0 == s.position(trainings["c"])
+    assert 1 == s.position(trainings["b"])
+    assert 2 == s.position(trainings["d"])
+
+    assert s.cancel(trainings["b"])
+    assert not s.cancel(trainings["b"])
+    assert 1 == s.position(trainings["d"])
+
+    futures["a"].set_result(None)
+    await asyncio.sleep(0)
+    assert ["a", "c"] == started
+    assert 1 == s.running
+
+    futures["c"].set_result(None)
+    await asyncio.sleep(0)
+    assert ["a", "c", "d"] == started
+
+
+async def test_start_error():
+    errors = []
+    s = scheduler.TrainingScheduler(
+        max_running=1, on_error=lambda t, e: errors.append((t, e))
+    )
+    started, futures = [], {}
+    bad = {}
+
+    with pytest.raises(RuntimeError):
+        s.submit({}, _starter(started, futures, "bad"))
+
+    s.submit({}, _starter(started, futures, "a"))
+    s.submit(bad, _starter(started, futures, "bad"))
+    s.submit({}, _starter(started, futures, "b"))
+
+    futures["a"].set_result(None)
+    await asyncio.sleep(0)
+    assert ["a", "b"] == started
+    assert [bad] == [t for t, _ in errors]
@@ -0,0 +1,309 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+import asyncio
+import multiprocessing.pool
+import os
+import signal
+import threading
+import time
+
+from oslo_config import cfg
+import pytest
+
+from deepaas import config  # noqa
+from deepaas import exceptions
+from deepaas.model.v2 import events
+from deepaas.model.v2 import workers
+from deepaas.model.v2 import wrapper as v2_wrapper
+
+CONF = cfg.CONF
+
+# Worker side state of the tests
+_WARMED = False
+
+
+@pytest.fixture
+def worker():
+    received = []
+    w = workers.Worker(on_event=lambda *a: received.append(a))
+    w.received = received
+    yield w
+    w.terminate()
+
+
+def _error():
+    raise ValueError("foo")
+
+
+def _unpicklable():
+    return threading.Lock()
+
+
+def _fork_and_exit():
+    if os.fork() == 0:
+        # The child must not keep the worker alive
+        time.sleep(3)
+        os._exit(0)
+    os._exit(1)
+
+
+def _warm():
+    global _WARMED
+
+    _WARMED = True
+
+
+def _is_warmed():
+    return _WARMED
+
+
+class SlowWarmModel(object):
+    """Model that takes a while to be warmed."""
+
+    def warm(self):
+        time.sleep(0.3)
+        _warm()
+
+    def predict(self, **kwargs):
+        return _is_warmed()
+
+
+class CrashingModel(object):
+    """Model whose first prediction kills its worker."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def predict(self, **kwargs):
+        if not os.path.exists(self.path):
+            open(self.path, "w").close()
+            os._exit(1)
+        return "foo"
+
+
+def _report(n):
+    for i in range(n):
+        events.report_progress(progress=i / n)
+    return n
+
+
+async def test_call(worker):
+    assert worker.pid == await worker.call(os.getpid)
+    assert os.getpid() != worker.pid
+    assert 3 == await worker.call(sum, ([1, 2],))
+
+    # Bigger than a single read
+    data = b"x" * (workers.READ_SIZE * 3 + 1)
+    assert data == await worker.call(bytes, (data,))
+
+
+async def test_call_error(worker):
+    with pytest.raises(ValueError) as e:
+        await worker.call(_error)
+    assert isinstance(e.value.__cause__, multiprocessing.pool.RemoteTraceback)
+    assert 'raise ValueError("foo")' in str(e.value.__cause__)
+
+    with pytest.raises(multiprocessing.pool.MaybeEncodingError):
+        await worker.call(_unpicklable)
+
+    # The worker is still usable
+    assert 1 == await worker.call(int, ("1",))
+
+
+async def test_events(worker):
+    assert 3 == await worker.call(events.run_with_events, ("foo", _report, 3))
+    assert ["foo"] * 3 == [key for key, _ in worker.received]
+    assert [0, 1 / 3, 2 / 3] == [e["progress"] for _, e in worker.received]
+
+
+def _report_forever():
+    while True:
+        events.report_progress(progress=0)
+
+
+async def test_events_killed_worker():
+    received = []
+    pool = v2_wrapper.CancellablePool(max_workers=2)
+    pool.events.listen("foo", received.append)
+    pool.events.listen("bar", received.append)
+    try:
+        task = asyncio.ensure_future(
+            pool.apply(events.run_with_events, "foo", _report_forever)
+        )
+        while not received:
+            await asyncio.sleep(0.01)
+        # Killed while it is reporting events
+        task.cancel()
+        await task
+
+        # The other workers can still report events, and all of them are
+        # received before the results
+        received.clear()
+        rets = await pool.apply_each(events.run_with_events, "bar", _report, 3)
+        assert [3, 3] == [ret["output"] for ret in rets]
+        assert 6 == len(received)
+    finally:
+        pool.shutdown()
+
+
+async def test_worker_died(worker):
+    with pytest.raises(exceptions.WorkerDied):
+        await worker.call(os._exit, (1,))
+    assert worker.closed
+    with pytest.raises(exceptions.WorkerDied):
+        await worker.call(int)
+
+
+async def test_worker_died_forked():
+    exited = []
+    worker = workers.Worker(on_exit=exited.append)
+    try:
+        with pytest.raises(exceptions.WorkerDied):
+            await asyncio.wait_for(worker.call(_fork_and_exit), 2)
+    finally:
+        worker.terminate()
+    assert [worker] == exited
+
+
+async def test_pool():
+    pool = v2_wrapper.CancellablePool(max_workers=2)
+    try:
+        pids = set(pool.pids())
+        assert 2 == len(pids)
+        rets = await asyncio.gather(*[pool.apply(os.getpid) for _ in range(4)])
+        assert pids == {ret["output"] for ret in rets}
+        assert not pool.busy
+
+        # Dead and cancelled workers are replaced
+        with pytest.raises(exceptions.WorkerDied):
+            await pool.apply(os._exit, 1)
+        assert 1 == len(set(pool.pids()) - pids)
+        pids = set(pool.pids())
+        task = asyncio.ensure_future(pool.apply(time.sleep, 10))
+        await asyncio.sleep(0.1)
+        assert 1 == pool.working
+        task.cancel()
+        assert None is await task
+        assert 1 == len(set(pool.pids()) - pids)
+        assert set(pool.pids()) == {
+            ret["output"]
+            for ret in await asyncio.gather(*[pool.apply(os.getpid) for _ in range(4)])
+        }
+    finally:
+        pool.shutdown()
+
+
+def _timed_sleep(seconds):
+    start = time.monotonic()
+    time.sleep(seconds)
+    return os.getpid(), start, time.monotonic()
+
+
+async def test_pool_apply_each():
+    pool = v2_wrapper.CancellablePool(max_workers=3)
+    try:
+        semaphore = asyncio.Semaphore(2)
+        rets = await pool.apply_each(_timed_sleep, 0.2, semaphore=semaphore)
+        outputs = sorted(ret["output"] for ret in rets)
+        assert sorted(pool.pids()) == [pid for pid, _, _ in outputs]
+        # At most two workers at the same time
+        starts = sorted(start for _, start, _ in outputs)
+        ends = sorted(end for _, _, end in outputs)
+        assert starts[2] >= ends[0]
+    finally:
+        pool.shutdown()
+
+
+async def test_pool_pause():
+    pool = v2_wrapper.CancellablePool(max_workers=1)
+    try:
+        pool.pause()
+        task = asyncio.ensure_future(pool.apply(int, "1"))
+        await asyncio.sleep(0.1)
+        assert not task.done()
+        assert 1 == pool.queued
+
+        # Not held
+        (ret,) = await pool.apply_each(int, "2")
+        assert 2 == ret["output"]
+        assert not task.done()
+
+        pool.resume()
+        assert 1 == (await task)["output"]
+    finally:
+        pool.shutdown()
+
+
+async def test_predict_while_warming():
+    CONF.set_override("workers", 2)
+    try:
+        w = v2_wrapper.ModelWrapper("slow-warm-test", SlowWarmModel())
+    finally:
+        CONF.clear_override("workers")
+    try:
+        # One worker is warmed at a time, the other one is idle meanwhile
+        warm = asyncio.ensure_future(w.warm(semaphore=asyncio.Semaphore(1)))
+        await asyncio.sleep(0)
+        # The prediction waits for the workers to be warmed
+        assert (await w.predict())["output"]
+        assert warm.done()
+    finally:
+        w._executor.shutdown()
+
+
+async def test_pool_recovery():
+    pool = v2_wrapper.CancellablePool(max_workers=1)
+    pool.initializer = _warm
+    try:
+        (pid,) = pool.pids()
+        assert not (await pool.apply(_is_warmed))["output"]
+
+        # An idle worker dies, and it is replaced by a warmed one
+        os.kill(pid, signal.SIGKILL)
+        for _ in range(100):
+            if pool.crashes and not pool.restarting:
+                break
+            await asyncio.sleep(0.05)
+        assert 1 == pool.crashes
+        assert pid not in pool.pids()
+        assert (await pool.apply(_is_warmed))["output"]
+
+        with pytest.raises(exceptions.WorkerDied):
+            await pool.apply(os._exit, 1)
+        assert 2 == pool.crashes
+        assert 1 == pool.restarting
+        assert (await pool.apply(_is_warmed))["output"]
+    finally:
+        pool.shutdown()
+
+
+async def test_predict_retries(tmp_path):
+    w = v2_wrapper.ModelWrapper("crash-test", CrashingModel(str(tmp_path / "foo")))
+    try:
+        with pytest.raises(exceptions.WorkerDied):
+            await w.predict()
+        assert "foo" == (await w.predict())["output"]
+
+        os.remove(str(tmp_path / "foo"))
+        CONF.set_override("predict_retries", 1)
+        try:
+            assert "foo" == (await w.predict())["output"]
+        finally:
+            CONF.clear_override("predict_retries")
+        assert 2 == w.get_load()["crashes"]
+    finally:
+        w._executor.shutdown()
@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+
+# Copyright 2018 Spanish National Research Council (CSIC)
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may
+# not use this file except in compliance with the License. You may obtain
+# a copy of the License at
+#
+#      http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations
+# under the License.
+
+"""Tracing of the requests, across the API and the worker processes.
+
+If enabled with the "trace-exporter" option, each request produces a trace
+with a span for each of its phases (argument parsing, staging of the uploads,
+wait for a free worker, execution in the worker, transfer of the result,
+validation and serialization of the response). The trace context is taken
+from the W3C "traceparent" header of the request, if any, so that the spans
+are correlated with the rest of the pipeline, and it is propagated to the
+worker processes, where the model can add its own spans::
+
+    from deepaas import tracing
+
+    def predict(self, **kwargs):
+        with tracing.span("preprocess", size=len(data)):
+            ...
+
+The spans follow the OpenTelemetry data model, and are exported in batches
+from a background thread, either to a file (one JSON object per line) or to
+an OpenTelemetry collector (OTLP over HTTP, with JSON encoding), without
+depending on the OpenTelemetry SDK.
+"""
+
+import collections
+import contextlib
+import contextvars
+import json
+import os
+import queue
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+
+from aiohttp import web
+from oslo_config import cfg
+
+import deepaas
+from deepaas import log
+
+LOG = log.getLogger(__name__)
+
+CONF = cfg.CONF
+
+SpanContext = collections.namedtuple("SpanContext", ("trace_id", "span_id"))
+"""Identifiers of a span, used as the parent of the spans created under it."""
+
+SPAN_KINDS = {"internal": 1, "server": 2}
+
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-[0-9a-f]{2}$")
+
+# Span (or SpanContext) under which new spans are created
+_CURRENT = contextvars.ContextVar("deepaas_tracing_current", default=None)
+
+# API process side: the processor that exports the spans, if enabled
+_PROCESSOR = None
+
+# Worker side: the spans finished during the call being traced, if any
+_WORKER_SPANS = None
+
+
+def _new_id(nbytes):
+    return os.urandom(nbytes).hex()
+
+
+class Span(object):
+    """A timed operation, part of a trace."""
+
+    def __init__(self, name, parent=None, kind="internal", attributes=None):
+        self.name = name
+        if parent is None:
+            self.trace_id = _new_id(16)
+            self.parent_id = None
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+        self.span_id = _new_id(8)
+        self.kind = kind
+        self.attributes = dict(attributes or {})
+        self.start = time.time_ns()
+        self.end = None
+        self.error = None
+
+    @property
+    def context(self):
+        return SpanContext(self.trace_id, self.span_id)
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "kind": self.kind,
+            "start": self.start,
+            "end": self.end,
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+
+class _NonRecordingSpan(object):
+    """Span returned when tracing is not enabled, it does nothing."""
+
+    def set_attribute(self, key, value):
+        pass
+
+
+NON_RECORDING_SPAN = _NonRecordingSpan()
+
+
+def is_enabled():
+    """Whether the spans created in this process are recorded."""
+    return _PROCESSOR is not None or _WORKER_SPANS is not None
+
+
+def get_current_context():
+    """Get the context of the current span, or None if there is none."""
+    current = _CURRENT.get()
+    if current is None or not is_enabled():
+        return None
+    return SpanContext(current.trace_id, current.span_id)
+
+
+def _finish(span):
+    if _WORKER_SPANS is not None:
+        _WORKER_SPANS.append(span.to_dict())
+    elif _PROCESSOR is not None:
+        _PROCESSOR.submit(span.to_dict())
+
+
+@contextlib.contextmanager
+def span(name, kind="internal", parent=None, **attributes):
+    """Record a span for the enclosed block of code.
+
+    The span is a child of ``parent`` (a :class:`SpanContext`), or of the
+    current span. If tracing is not enabled this is a no-op.
+
+    :returns: the span, whose attributes can be set while it is not finished
+    """
+    if not is_enabled():
+        yield NON_RECORDING_SPAN
+        return
+
+    s = Span(name, parent=parent or _CURRENT.get(), kind=kind, attributes=attributes)
+    token = _CURRENT.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.error = "%s: %s" % (type(e).__name__, e)
+        raise
+    finally:
+        _CURRENT.reset(token)
+        s.end = time.time_ns()
+        _finish(s)
+
+
+def record_span(name, start, end=None, **attributes):
+    """Record a span that already happened, under the current span."""
+    if not is_enabled():
+        return
+    s = Span(name, parent=_CURRENT.get(), attributes=attributes)
+    s.start = start
+    s.end = end or time.time_ns()
+    _finish(s)
+
+
+def parse_traceparent(header):
+    """Parse a W3C traceparent header, returning a SpanContext or None."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if match is None or set(match.group(1)) == {"0"} or set(match.group(2)) == {"0"}:
+        return None
+    return SpanContext(match.group(1), match.group(2))
+
+
+def format_traceparent(context):
+    return "00-%s-%s-01" % (context.trace_id, context.span_id)
+
+
+WorkerResult = collections.namedtuple("WorkerResult", ("output", "spans"))
+
+
+def run_in_worker(context, func, *args, **kwargs):
+    """Run a function in a worker process, under the given trace context.
+
+    The spans created in the worker (including the ones created by the model)
+    are returned to the API process along with the output of the function, or
+    attached to the exception that it raises.
+    """
+    global _WORKER_SPANS
+
+    _WORKER_SPANS = spans = []
+    token = _CURRENT.set(context)
+    try:
+        with span("worker_execution", pid=os.getpid()):
+            output = func(*args, **kwargs)
+    except BaseException as e:
+        e._deepaas_spans = spans
+        raise
+    finally:
+        _CURRENT.reset(token)
+        _WORKER_SPANS = None
+    return WorkerResult(output, spans)
+
+
+def collect_worker_spans(spans):
+    """Export the spans returned by :func:`run_in_worker`.
+
+    A "result_transfer" span, from the end of the execution in the worker
+    until now, is recorded as well.
+    """
+    if _PROCESSOR is None:
+        return
+    for s in spans:
+        _PROCESSOR.submit(s)
+    ends = [s["end"] for s in spans if s["name"] == "worker_execution"]
+    if ends:
+        record_span("result_transfer", ends[0])
+
+
+@web.middleware
+async def tracing_middleware(request, handler):
+    """Record a span for each request, continuing the trace of the client."""
+    if _PROCESSOR is None:
+        return await handler(request)
+
+    resource = request.match_info.route.resource
+    route = resource.canonical if resource is not None else request.path
+    parent = parse_traceparent(request.headers.get("traceparent"))
+    name = "%s %s" % (request.method, route)
+    with span(
+        name,
+        kind="server",
+        parent=parent,
+        **{
+            "http.request.method": request.method,
+            "http.route": route,
+            "url.path": request.path,
+        },
+    ) as s:
+        try:
+            response = await handler(request)
+        except web.HTTPException as e:
+            s.set_attribute("http.response.status_code", e.status)
+            raise
+        s.set_attribute("http.response.status_code", response.status)
+        return response
+
+
+class JsonLinesExporter(object):
+    """Export the spans to a file, one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._file = None
+
+    def export(self, spans):
+        if self._file is None:
+            self._file = open(self.path, "a")
+        for s in spans:
+            self._file.write(json.dumps(s) + "\n")
+        self._file.flush()
+
+    def shutdown(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def _otlp_attributes(attributes):
+    return [{"key": k, "value": _otlp_value(v)} for k, v in attributes.items()]
+
+
+class OTLPExporter(object):
+    """Export the spans to an OpenTelemetry collector, with OTLP/HTTP (JSON)."""
+
+    def __init__(self, endpoint, timeout=10):
+        if urllib.parse.urlsplit(endpoint).scheme not in ("http", "https"):
+            raise ValueError("The OTLP endpoint must be an http(s) URL")
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self.resource = {
+            "attributes": _otlp_attributes(
+                {
+                    "service.name": "deepaas",
+                    "service.version": deepaas.extract_version(),
+                    "process.pid": os.getpid(),
+                }
+            )
+        }
+        self._failing = False
+
+    def get_payload(self, spans):
+        otlp_spans = []
+        for s in spans:
+            otlp_span = {
+                "traceId": s["trace_id"],
+                "spanId": s["span_id"],
+                "name": s["name"],
+                "kind": SPAN_KINDS[s["kind"]],
+                "startTimeUnixNano": str(s["start"]),
+                "endTimeUnixNano": str(s["end"]),
+                "attributes": _otlp_attributes(s["attributes"]),
+                "status": {"code": 1},
+            }
+            if s["parent_id"]:
+                otlp_span["parentSpanId"] = s["parent_id"]
+            if s["error"]:
+                otlp_span["status"] = {"code": 2, "message": s["error"]}
+            otlp_spans.append(otlp_span)
+        return {
+            "resourceSpans": [
+                {
+                    "resource": self.resource,
+                    "scopeSpans": [
+                        {
+                            "scope": {
+                                "name": "deepaas",
+                                "version": deepaas.extract_version(),
+                            },
+                            "spans": otlp_spans,
+                        }
+                    ],
+                }
+            ]
+        }
+
+    def export(self, spans):
+        request = urllib.request.Request(
+            self.endpoint,
+            data=json.dumps(self.get_payload(spans)).encode(),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            # The scheme of the endpoint was checked when it was set
+            with urllib.request.urlopen(request, timeout=self.timeout):  # nosec B310
+                pass
+        except Exception as e:
+            # Do not flood the logs while the collector is down
+            if not self._failing:
+                LOG.warning("Cannot export spans to %s: %s", self.endpoint, e)
+            self._failing = True
+            return
+        if self._failing:
+            LOG.info("Exporting spans to %s again", self.endpoint)
+        self._failing = False
+
+    def shutdown(self):
+        pass
+
+
+class BatchProcessor(object):
+    """Export the spans in batches, from a background thread.
+
+    Spans are dropped (and counted) if they are produced faster than they can
+    be exported, so that tracing never blocks the requests.
+    """
+
+    def __init__(self, exporter, max_batch=512, interval=1.0, max_queue=4096):
+        self.exporter = exporter
+        self.max_batch = max_batch
+        self.interval = interval
+        self.dropped = 0
+        self._queue = queue.Queue(max_queue)
+        self._thread = None
+        self._pid = None
+
+    def _ensure_thread(self):
+        # Threads do not survive a fork (e.g. of the HTTP front-ends)
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._thread = threading.Thread(
+                target=self._run, name="deepaas-tracing", daemon=True
+            )
+            self._thread.start()
+
+    def submit(self, span):
+        self._ensure_thread()
+        try:
+            self._queue.put_nowait(span)
+        except queue.Full:
+            self.dropped += 1
+
+    def _export(self, batch):
+        try:
+            self.exporter.export(batch)
+        except Exception:
+            LOG.exception("Error exporting %d spans", len(batch))
+
+    def _run(self):
+        batch = []
+        deadline = time.monotonic() + self.interval
+        while True:
+            try:
+                item = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                item = False
+            if item is None:
+                break
+            if item:
+                batch.append(item)
+            if len(batch) >= self.max_batch or time.monotonic() >= deadline:
+                if batch:
+                    self._export(batch)
+                    batch = []
+                deadline = time.monotonic() + self.interval
+        if batch:
+            self._export(batch)
+
+    def shutdown(self, timeout=5):
+        """Export the pending spans and stop the thread."""
+        if self._thread is not None and self._pid == os.getpid():
+            self._queue.put(None)
+            self._thread.join(timeout)
+            self._thread = None
+        self.exporter.shutdown()
+        if self.dropped:
+            LOG.warning("%d spans were dropped", self.dropped)
+
+
+def get_exporter():
+    """Get the exporter configured with the "trace-exporter" option."""
+    if CONF.trace_exporter == "jsonl":
+        return JsonLinesExporter(CONF.trace_file)
+    if CONF.trace_exporter == "otlp":
+        return OTLPExporter(CONF.trace_otlp_endpoint)
+    return None
+
+
+def setup(app):
+    """Enable tracing in the API process, if configured."""
+    global _PROCESSOR
+
+    exporter = get_exporter()
+    if exporter is None:
+        return
+    LOG.info("Exporting traces with the %s exporter", CONF.trace_exporter)
+    _PROCESSOR = BatchProcessor(exporter)
+    app.on_cleanup.append(_on_cleanup)
+
+
+async def _on_cleanup(app):
+    global _PROCESSOR
+
+    if _PROCESSOR is not None:
+        _PROCESSOR.shutdown()
+        _PROCESSOR = None
@@ -102,6 +102,7 @@ modindex_common_prefix = ['deepaas.']
 # (source start file, name, description, authors, manual section).
 man_pages = [
     ('cli/deepaas-run', "deepaas-run", "DEEPaaS API", [author], 1),
+    ('cli/deepaas-bench', "deepaas-bench", "DEEPaaS API benchmark", [author], 1),
     (master_doc, 'deepaas', u'DEEPaaS documentation', [author], 1),
 ]
 